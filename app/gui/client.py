@@ -19,7 +19,9 @@ import os
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 print(sys.path)
 from conversation.openai import OpenAIConversation
-from nlp.classifiers import is_recommendation_request
+from nlp.classifiers import warm_up as warm_up_classifier
+from nlp.recommendation_pipeline import RecommendationPipeline
+from nlp.vector_db import LOCATIONS
 from nlp.vector_db import VectorDB
 from utils import parse_results
 
@@ -29,6 +31,7 @@ logging.basicConfig(level=logging.INFO)
 
 CONVERSATION_AGENT = OpenAIConversation()
 VECTOR_DB = VectorDB()
+RECOMMENDATIONS = RecommendationPipeline(VECTOR_DB)
 
 
 class GUI:
@@ -79,8 +82,11 @@ class GUI:
             side="left", anchor="w"
         )
         self.location_ = StringVar(frame2)
-        self.location_.set("Georgetown, DC")
-        locations = ["Duvall, WA", "Georgetown, DC"]
+        locations = sorted(LOCATIONS)
+        # Georgetown, DC when its data file is present, otherwise the first discovered locale
+        self.location_.set(
+            "Georgetown, DC" if "Georgetown, DC" in LOCATIONS else locations[0]
+        )
         self.location_dropdown = OptionMenu(
             frame2,
             self.location_,
@@ -149,14 +155,12 @@ class GUI:
         # get location
         location = self.location_.get()
 
-        # detect whether the message is a request for local recommendations
+        # detect whether the text typed (without the sender's name, like the intent examples) is a
+        # request for local recommendations, while the vectordb search for it already runs
         extra_context = {}
-        if is_recommendation_request(message.decode("utf-8")):
-            # do vectordb search
-            logging.info("doing vectordb search")
-            VECTOR_DB.set_idx_by_location(location)
-            response = VECTOR_DB.search(collection=location, query=data)
-            parsed_context = parse_results(response)
+        documents = RECOMMENDATIONS.recommendations(data, location)
+        if documents is not None:
+            parsed_context = parse_results(documents)
             logging.info(f"response: " + str(parsed_context))
             extra_context = {"recommendations": parsed_context}
 
@@ -186,5 +190,8 @@ class GUI:
 if __name__ == "__main__":
     root = Tk()
     gui = GUI(root)
+    # the models and the selected location load in the background while the window is already usable
+    warm_up_classifier()
+    VECTOR_DB.start([gui.location_.get()])
     root.protocol("WM_DELETE_WINDOW", gui.on_close_window)
     root.mainloop()
@@ -0,0 +1,115 @@
+import asyncio
+import functools
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from nlp.connection_pool import MilvusConnectionPool
+from nlp.vector_db import MILVUS_HOST
+from nlp.vector_db import MILVUS_PORT
+from nlp.vector_db import VectorDB
+
+logging.basicConfig(level=logging.INFO)
+
+# pooled Milvus connections, and worker threads running blocking calls (one connection each)
+POOL_SIZE = int(os.environ.get("VECTOR_DB_POOL_SIZE", "4"))
+# calls admitted at once; further callers wait for a slot instead of piling up on the workers
+MAX_IN_FLIGHT = int(os.environ.get("VECTOR_DB_MAX_IN_FLIGHT", "32"))
+# seconds before a search or load gives up with asyncio.TimeoutError
+SEARCH_TIMEOUT = float(os.environ.get("VECTOR_DB_SEARCH_TIMEOUT", "10"))
+LOAD_TIMEOUT = float(os.environ.get("VECTOR_DB_LOAD_TIMEOUT", "300"))
+
+
+class AsyncVectorDB:
+    """
+    asyncio front end of a VectorDB, for callers that overlap many retrievals (a server, or pipelined stages).
+
+    Blocking searches run on pool_size worker threads, each searching Milvus through its own pooled
+    connection, so a slow call only holds up its own worker. At most max_in_flight calls are admitted at a
+    time, counting calls a timeout gave up on until their worker is done with them, and every call is
+    bounded by a timeout. Caches, loading and filters are the wrapped VectorDB's, which itself keeps
+    searching through the default connection.
+    """
+
+    def __init__(
+        self,
+        vector_db=None,
+        pool_size=POOL_SIZE,
+        max_in_flight=MAX_IN_FLIGHT,
+        timeout=SEARCH_TIMEOUT,
+    ):
+        self.timeout = timeout
+        self.max_in_flight = max_in_flight
+        self.pool = MilvusConnectionPool(pool_size, MILVUS_HOST, MILVUS_PORT)
+        # a view of the given VectorDB, so that its synchronous callers keep the default connection
+        self.vector_db = (vector_db or VectorDB()).with_connection_pool(self.pool)
+        self._executor = ThreadPoolExecutor(
+            max_workers=pool_size, thread_name_prefix="vector-db-pool"
+        )
+        # created on first use, so it belongs to the event loop that awaits it
+        self._slots = None
+
+    async def _run(self, timeout, call):
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_in_flight)
+        await self._slots.acquire()
+        try:
+            future = asyncio.get_running_loop().run_in_executor(self._executor, call)
+        except BaseException:
+            self._slots.release()
+            raise
+        # a timeout only stops the wait: the slot is held until the worker is done with the call
+        future.add_done_callback(self._call_done)
+        return await asyncio.wait_for(asyncio.shield(future), timeout)
+
+    def _call_done(self, future):
+        self._slots.release()
+        if not future.cancelled():
+            # retrieved, so that the error of a call nobody waits for anymore is not logged as unhandled
+            future.exception()
+
+    async def search(self, collection, query, top_k=5, timeout=None, **options):
+        """
+        VectorDB.search without blocking the event loop; options are its geo, categories, hybrid... arguments
+        """
+        timeout = self.timeout if timeout is None else timeout
+        return await self._run(
+            timeout,
+            functools.partial(
+                self.vector_db.search,
+                collection,
+                query,
+                top_k,
+                timeout=timeout,
+                **options,
+            ),
+        )
+
+    async def search_many(self, collections, queries, top_k=5, timeout=None, **options):
+        timeout = self.timeout if timeout is None else timeout
+        return await self._run(
+            timeout,
+            functools.partial(
+                self.vector_db.search_many,
+                collections,
+                queries,
+                top_k,
+                timeout=timeout,
+                **options,
+            ),
+        )
+
+    async def load(self, location, timeout=LOAD_TIMEOUT):
+        """
+        Waits until the collection of a location is loaded, starting the load if needed. A timeout only
+        stops the wait: the load itself goes on, shared with every other caller.
+        """
+        future = self.vector_db.residency.ensure_loaded(location)
+        return await asyncio.wait_for(
+            asyncio.shield(asyncio.wrap_future(future)), timeout
+        )
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+        self.vector_db.connection_pool = None
+        self.pool.close()
@@ -0,0 +1,269 @@
+import json
+import os
+
+import numpy as np
+
+from nlp.poi_formats import StringColumn
+
+# rows are split into chunks of 2**16; a chunk holding more rows than this is stored as a dense bitmap
+CHUNK_BITS = 16
+ARRAY_CONTAINER_LIMIT = 4096
+_CHUNK_SIZE = 1 << CHUNK_BITS
+# longest mbx_id list a Milvus category expression may carry; broader filters are applied after the search
+MILVUS_EXPR_MAX_IDS = int(os.environ.get("VECTOR_DB_CATEGORY_EXPR_MAX_IDS", "1000"))
+
+
+def split_categories(categories):
+    """
+    The normalized category tokens of a POI's ";"-separated categories field
+    """
+    return [
+        token for token in (t.strip().lower() for t in categories.split(";")) if token
+    ]
+
+
+class RoaringBitmap:
+    """
+    Compressed set of row numbers in the style of roaring bitmaps: rows are grouped by their high 16 bits,
+    and each group (chunk) is stored either as a sorted uint16 array of its low bits, when it holds at most
+    ARRAY_CONTAINER_LIMIT rows, or as a 2**16 bit dense bitmap.
+    """
+
+    def __init__(self, containers=None):
+        # chunk number -> uint16 array (sparse) or bool array of _CHUNK_SIZE (dense)
+        self.containers = containers or {}
+
+    @classmethod
+    def from_rows(cls, rows):
+        rows = np.unique(np.asarray(rows, dtype=np.int64))
+        chunks = rows >> CHUNK_BITS
+        bounds = np.flatnonzero(np.diff(chunks)) + 1
+        containers = {}
+        for part in np.split(rows, bounds) if len(rows) else []:
+            containers[int(part[0] >> CHUNK_BITS)] = _optimize(
+                (part & (_CHUNK_SIZE - 1)).astype(np.uint16)
+            )
+        return cls(containers)
+
+    def __len__(self):
+        return sum(
+            int(container.sum()) if container.dtype == bool else len(container)
+            for container in self.containers.values()
+        )
+
+    def _combine(self, other, operation, keep_left_only, keep_right_only):
+        containers = {}
+        for chunk in set(self.containers) | set(other.containers):
+            left = self.containers.get(chunk)
+            right = other.containers.get(chunk)
+            if right is None:
+                if keep_left_only:
+                    containers[chunk] = left
+                continue
+            if left is None:
+                if keep_right_only:
+                    containers[chunk] = right
+                continue
+            combined = _optimize(operation(_dense(left), _dense(right)))
+            if len(combined):
+                containers[chunk] = combined
+        return RoaringBitmap(containers)
+
+    def __or__(self, other):
+        return self._combine(other, np.logical_or, True, True)
+
+    def __and__(self, other):
+        return self._combine(other, np.logical_and, False, False)
+
+    def __sub__(self, other):
+        return self._combine(other, lambda left, right: left & ~right, True, False)
+
+    def contains(self, rows):
+        """
+        A boolean array telling whether each of rows is in the set
+        """
+        rows = np.asarray(rows, dtype=np.int64)
+        found = np.zeros(len(rows), dtype=bool)
+        chunks = rows >> CHUNK_BITS
+        for chunk in np.unique(chunks):
+            container = self.containers.get(int(chunk))
+            if container is None:
+                continue
+            in_chunk = chunks == chunk
+            low = rows[in_chunk] & (_CHUNK_SIZE - 1)
+            found[in_chunk] = (
+                container[low] if container.dtype == bool else np.isin(low, container)
+            )
+        return found
+
+    def to_rows(self):
+        """
+        The row numbers in the set, sorted
+        """
+        parts = [
+            (
+                np.flatnonzero(container) if container.dtype == bool else container
+            ).astype(np.int64)
+            + (chunk << CHUNK_BITS)
+            for chunk, container in sorted(self.containers.items())
+        ]
+        return np.concatenate(parts + [np.zeros(0, dtype=np.int64)])
+
+
+def _dense(container):
+    if container.dtype == bool:
+        return container
+    dense = np.zeros(_CHUNK_SIZE, dtype=bool)
+    dense[container] = True
+    return dense
+
+
+def _optimize(container):
+    """
+    Picks the smaller representation for a chunk; an empty chunk becomes an empty array
+    """
+    if container.dtype == bool:
+        if container.sum() > ARRAY_CONTAINER_LIMIT:
+            return container
+        return np.flatnonzero(container).astype(np.uint16)
+    if len(container) > ARRAY_CONTAINER_LIMIT:
+        return _dense(container)
+    return container
+
+
+class CategoryFilter:
+    """
+    Keeps POIs having any of the include categories (all POIs when include is empty) and none of the
+    exclude categories. Categories are matched on normalized tokens, e.g. "coffee" or "bar".
+    """
+
+    def __init__(self, include=(), exclude=()):
+        self.include = sorted({token.strip().lower() for token in include})
+        self.exclude = sorted({token.strip().lower() for token in exclude})
+
+    def key(self):
+        return (tuple(self.include), tuple(self.exclude))
+
+
+class CategoryBuilder:
+    """
+    Dictionary-encodes the category tokens of PoiBatches as they are ingested.
+
+    With store_ids=True the mbx_ids are kept too, so filters can be turned into id expressions for
+    collections whose rows live in Milvus.
+    """
+
+    def __init__(self, store_ids=False):
+        self.vocabulary = {}
+        self.store_ids = store_ids
+        self._rows, self._codes, self._ids = [], [], []
+        self.n_docs = 0
+
+    def add(self, batch):
+        rows, codes = [], []
+        for i, categories in enumerate(batch["categories"].to_list()):
+            for token in set(split_categories(categories)):
+                rows.append(self.n_docs + i)
+                codes.append(self.vocabulary.setdefault(token, len(self.vocabulary)))
+        self._rows.append(np.array(rows, dtype=np.int64))
+        self._codes.append(np.array(codes, dtype=np.int64))
+        if self.store_ids:
+            self._ids.append(batch["mbx_id"])
+        self.n_docs += len(batch)
+
+    def build(self):
+        rows = np.concatenate(self._rows + [np.zeros(0, dtype=np.int64)])
+        codes = np.concatenate(self._codes + [np.zeros(0, dtype=np.int64)])
+        order = np.lexsort((rows, codes))
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(codes, minlength=len(self.vocabulary)), out=offsets[1:])
+        ids = StringColumn.concat(self._ids) if self.store_ids and self._ids else None
+        return CategoryIndex(
+            sorted(self.vocabulary, key=self.vocabulary.get),
+            offsets,
+            rows[order],
+            self.n_docs,
+            ids,
+        )
+
+
+class CategoryIndex:
+    """
+    One RoaringBitmap of rows per category of the vocabulary.
+
+    The dictionary encoding (category i owns rows[offsets[i]:offsets[i + 1]]) is what gets saved;
+    the bitmaps are rebuilt from it when the index is created.
+    """
+
+    def __init__(self, categories, offsets, rows, n_docs, ids=None):
+        self.categories = categories
+        self.offsets = offsets
+        self.rows = rows
+        self.n_docs = n_docs
+        self.ids = ids
+        self.bitmaps = {
+            category: RoaringBitmap.from_rows(rows[offsets[i] : offsets[i + 1]])
+            for i, category in enumerate(categories)
+        }
+        self.all_rows = RoaringBitmap.from_rows(np.arange(n_docs))
+
+    def counts(self):
+        return {category: len(bitmap) for category, bitmap in self.bitmaps.items()}
+
+    def _union(self, categories):
+        result = RoaringBitmap()
+        for category in categories:
+            result = result | self.bitmaps.get(category, RoaringBitmap())
+        return result
+
+    def matching(self, category_filter):
+        """
+        The RoaringBitmap of the rows passing category_filter
+        """
+        result = (
+            self._union(category_filter.include)
+            if category_filter.include
+            else self.all_rows
+        )
+        if category_filter.exclude:
+            result = result - self._union(category_filter.exclude)
+        return result
+
+    def milvus_expr(self, category_filter, max_ids=MILVUS_EXPR_MAX_IDS):
+        """
+        An mbx_id expression selecting the rows passing category_filter: an "in" list of the matching ids,
+        or a "not in" list of the others, whichever is shorter. None when both lists are longer than
+        max_ids, as the expression would then grow with the partition: the search has to over-fetch and
+        filter its hits against matching() instead. Needs an index built with store_ids=True.
+        """
+        rows = self.matching(category_filter).to_rows()
+        if min(len(rows), self.n_docs - len(rows)) > max_ids:
+            return None
+        if len(rows) <= self.n_docs - len(rows):
+            return f"mbx_id in {json.dumps(self.ids.take(rows).to_list())}"
+        others = np.setdiff1d(np.arange(self.n_docs), rows, assume_unique=True)
+        return f"mbx_id not in {json.dumps(self.ids.take(others).to_list())}"
+
+    def save(self, directory):
+        with open(os.path.join(directory, "category.vocabulary.json"), "w") as f:
+            json.dump(self.categories, f)
+        np.save(os.path.join(directory, "category.offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "category.rows.npy"), self.rows)
+
+
+def load_category_index(directory, n_docs):
+    """
+    Opens the category index saved in a snapshot or document store directory, or returns None if there is
+    none
+    """
+    vocabulary_path = os.path.join(directory, "category.vocabulary.json")
+    if not os.path.exists(vocabulary_path):
+        return None
+    with open(vocabulary_path, "r") as f:
+        categories = json.load(f)
+    return CategoryIndex(
+        categories,
+        np.load(os.path.join(directory, "category.offsets.npy")),
+        np.load(os.path.join(directory, "category.rows.npy")),
+        n_docs,
+    )
@@ -1,13 +1,112 @@
-from transformers import pipeline
+import gc
+import io
+import multiprocessing
+import os
+import resource
+import sys
+import threading
 import time
 import logging
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from nlp.intent import NO_RECOMMENDATION_LABEL
+from nlp.intent import RECOMMENDATION_LABEL
+from nlp.intent import get_prototype_classifier
+from nlp.intent import load_examples
+from nlp.zero_shot_batching import ZeroShotBatcher
 
 logging.basicConfig(level=logging.INFO)
 
-zero_shot_classifier = pipeline(
-    "zero-shot-classification",
-    model="MoritzLaurer/DeBERTa-v3-large-mnli-fever-anli-ling-wanli",
-)
+ZERO_SHOT_MODEL_NAME = "MoritzLaurer/DeBERTa-v3-large-mnli-fever-anli-ling-wanli"
+
+# "cascade" first asks the embedding-prototype classifier (nlp.intent), and only escalates messages it is
+# unsure about to the zero-shot model; "zero_shot" sends every message to the zero-shot model
+INTENT_CLASSIFIER = os.environ.get("INTENT_CLASSIFIER", "cascade")
+# prototype probabilities at or above INTENT_ACCEPT are recommendation requests, at or below INTENT_REJECT
+# they are not, and in between the zero-shot model decides (see make intent-report for their precision)
+INTENT_ACCEPT = float(os.environ.get("INTENT_ACCEPT", "0.9"))
+INTENT_REJECT = float(os.environ.get("INTENT_REJECT", "0.1"))
+# "1" queues zero-shot requests and classifies concurrent ones in shared batches (see nlp.zero_shot_batching),
+# "0" calls the pipeline once per request
+ZERO_SHOT_BATCHING = os.environ.get("ZERO_SHOT_BATCHING", "1") == "1"
+# "fp32" runs the model as published; "int8" quantizes its linear layers to int8 on load (dynamic
+# quantization, CPU only), for hosts without a GPU. make benchmark-zero-shot compares the two.
+ZERO_SHOT_BACKEND = os.environ.get("ZERO_SHOT_BACKEND", "fp32")
+# torch intra-op threads used by the zero-shot model; 0 keeps torch's default (one per core)
+ZERO_SHOT_THREADS = int(os.environ.get("ZERO_SHOT_THREADS", "0"))
+ZERO_SHOT_BACKENDS = ("fp32", "int8")
+
+# loaded on first use (or by warm_up), so importing this module does not load DeBERTa
+_zero_shot_classifier = None
+_classifier_lock = threading.Lock()
+
+
+def get_zero_shot_classifier():
+    """
+    Returns the zero-shot classification pipeline, loading it on the first call
+    """
+    global _zero_shot_classifier
+    with _classifier_lock:
+        if _zero_shot_classifier is None:
+            _zero_shot_classifier = load_zero_shot_pipeline(ZERO_SHOT_BACKEND)
+        return _zero_shot_classifier
+
+
+def load_zero_shot_pipeline(backend="fp32", threads=ZERO_SHOT_THREADS):
+    """
+    Loads the zero-shot classification pipeline with one of ZERO_SHOT_BACKENDS
+    """
+    if backend not in ZERO_SHOT_BACKENDS:
+        raise ValueError(
+            f"Unknown zero-shot backend {backend}, expected one of {list(ZERO_SHOT_BACKENDS)}"
+        )
+    import torch
+    from transformers import pipeline
+
+    if threads > 0:
+        torch.set_num_threads(threads)
+    start_time = time.time()
+    if backend == "int8":
+        classifier = pipeline(
+            "zero-shot-classification", model=ZERO_SHOT_MODEL_NAME, device="cpu"
+        )
+        classifier.model = torch.ao.quantization.quantize_dynamic(
+            classifier.model, {torch.nn.Linear}, dtype=torch.qint8
+        )
+    else:
+        classifier = pipeline("zero-shot-classification", model=ZERO_SHOT_MODEL_NAME)
+    classifier.model.eval()
+    logging.info(
+        f"Loaded {ZERO_SHOT_MODEL_NAME} ({backend}, {torch.get_num_threads()} threads) in {time.time() - start_time:.2f} seconds"
+    )
+    return classifier
+
+
+# every zero_shot_classification call goes through this batcher when ZERO_SHOT_BATCHING is on;
+# ZERO_SHOT_BATCHER.stats() reports its queue waits and batch fill
+ZERO_SHOT_BATCHER = ZeroShotBatcher(get_zero_shot_classifier)
+
+
+def _load_classifiers():
+    if INTENT_CLASSIFIER == "cascade":
+        get_prototype_classifier()
+    get_zero_shot_classifier()
+
+
+def warm_up(background=True):
+    """
+    Loads the classifiers ahead of the first message, on a daemon thread unless background is False
+    """
+    if not background:
+        _load_classifiers()
+        return None
+    thread = threading.Thread(
+        target=_load_classifiers, name="classifier-warm-up", daemon=True
+    )
+    thread.start()
+    return thread
 
 
 def zero_shot_classification(text, labels, multi_label=False):
@@ -26,7 +125,10 @@ def zero_shot_classification(text, labels, multi_label=False):
         + str(labels)
     )
     start_time = time.time()
-    output = zero_shot_classifier(text, labels, multi_label=multi_label)
+    if ZERO_SHOT_BATCHING:
+        output = ZERO_SHOT_BATCHER.classify(text, labels, multi_label=multi_label)
+    else:
+        output = get_zero_shot_classifier()(text, labels, multi_label=multi_label)
     stop_time = time.time()
     logging.info(
         "Zero-shot classification took " + str(stop_time - start_time) + " seconds"
@@ -35,22 +137,143 @@ def zero_shot_classification(text, labels, multi_label=False):
     return output
 
 
-def is_recommendation_request(text, confidence_threshold=0.9):
+def recommendation_score(text):
+    """
+    The zero-shot model's confidence that a text is a recommendation request
     """
-    This function sends a text to the zero-shot classifier and returns True if the text is a recommendation request
+    output = zero_shot_classification(
+        text, [RECOMMENDATION_LABEL, NO_RECOMMENDATION_LABEL]
+    )
+    return dict(zip(output["labels"], output["scores"]))[RECOMMENDATION_LABEL]
+
+
+def is_recommendation_request(text, confidence_threshold=0.9, embedding=None):
+    """
+    This function classifies a text and returns True if the text is a recommendation request
     and False if it is not.
 
+    With the cascade, the MiniLM embedding of the text (computed unless given) is first scored against the
+    intent prototypes, and the zero-shot classifier only runs when that score is between INTENT_REJECT
+    and INTENT_ACCEPT.
+
     :param text: The text to be classified
+    :param embedding: The MiniLM embedding of the text, if the caller already has it
     :return: True if the text is a recommendation request (> confidence thresholde to maintain high precision) and False if it is not
     """
-    labels = ["location_recommendations_request", "no_location_recommendations_request"]
-    output = zero_shot_classification(text, labels)
-    if (
-        output["labels"][0] == "location_recommendations_request"
-        and output["scores"][0] > confidence_threshold
-    ):
+    if INTENT_CLASSIFIER == "cascade":
+        if embedding is None:
+            from utils import embed
+
+            embedding = embed([text], use_cache=False)
+        probability = float(get_prototype_classifier().predict_proba(embedding)[0])
+        if probability >= INTENT_ACCEPT or probability <= INTENT_REJECT:
+            detected = probability >= INTENT_ACCEPT
+            logging.info(
+                f"Prototype intent probability {probability:.3f}: "
+                + (
+                    "recommendation request"
+                    if detected
+                    else "no recommendation request"
+                )
+            )
+            return detected
+        logging.info(
+            f"Prototype intent probability {probability:.3f}, escalating to zero-shot"
+        )
+    if recommendation_score(text) > confidence_threshold:
         logging.info("Recommendation request detected")
         return True
     else:
         logging.info("No recommendation request detected")
         return False
+
+
+def _resident_bytes():
+    with open("/proc/self/statm", "r") as f:
+        return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+
+
+def _peak_resident_bytes():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _serialized_bytes(model):
+    import torch
+
+    buffer = io.BytesIO()
+    torch.save(model.state_dict(), buffer)
+    return buffer.getbuffer().nbytes
+
+
+def _benchmark_backend(backend, texts):
+    """
+    Loads the zero-shot model with one backend and classifies every text one at a time, in a fresh process
+    (see benchmark_zero_shot_backends). Returns its measurements and the recommendation score of each text.
+    """
+    # imported before the baseline, so the memory of the libraries is not counted as the model's
+    import torch
+    import transformers
+
+    candidate_labels = [RECOMMENDATION_LABEL, NO_RECOMMENDATION_LABEL]
+    baseline = _resident_bytes()
+    start = time.time()
+    classifier = load_zero_shot_pipeline(backend)
+    load_time = time.time() - start
+    gc.collect()
+    resident = _resident_bytes() - baseline
+    latencies, scores = [], []
+    for text in texts:
+        start = time.perf_counter()
+        output = classifier(text, candidate_labels)
+        latencies.append(time.perf_counter() - start)
+        scores.append(
+            dict(zip(output["labels"], output["scores"]))[RECOMMENDATION_LABEL]
+        )
+    row = {
+        "backend": backend,
+        "load_s": load_time,
+        "resident_mb": resident / 2**20,
+        "peak_resident_mb": _peak_resident_bytes() / 2**20,
+        "model_mb": _serialized_bytes(classifier.model) / 2**20,
+        "p50_ms": float(np.percentile(latencies, 50) * 1000),
+        "p95_ms": float(np.percentile(latencies, 95) * 1000),
+    }
+    return row, scores
+
+
+def benchmark_zero_shot_backends(
+    texts, labels, backends=ZERO_SHOT_BACKENDS, confidence_threshold=0.9
+):
+    """
+    Benchmarks each backend in a fresh process, so that no backend's memory is measured on top of another's:
+    load time, resident memory added by the load once it settles, peak resident memory of the process
+    (int8 first loads the fp32 model and quantizes a copy of it), serialized model size, p50/p95 latency
+    classifying every labelled message one at a time, and accuracy against the labels. Backends after the
+    first also report their agreement with it: the share of messages given the same decision at
+    confidence_threshold, and the mean absolute score difference.
+    """
+    report, reference = [], None
+    for backend in backends:
+        with ProcessPoolExecutor(
+            max_workers=1, mp_context=multiprocessing.get_context("spawn")
+        ) as executor:
+            row, scores = executor.submit(_benchmark_backend, backend, texts).result()
+        scores = np.array(scores)
+        decisions = scores > confidence_threshold
+        row["accuracy"] = float((decisions == (np.asarray(labels) == 1)).mean())
+        if reference is None:
+            reference = (scores, decisions)
+        else:
+            row["agreement"] = float((decisions == reference[1]).mean())
+            row["mean_score_difference"] = float(np.abs(scores - reference[0]).mean())
+        logging.info(f"BENCHMARKING ZERO-SHOT: {row}")
+        report.append(row)
+    return report
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=app python app/nlp/classifiers.py [backend ...]
+    # compares the backends on the labelled intent examples (see nlp.intent)
+    texts, labels = load_examples()
+    benchmark_zero_shot_backends(texts, labels, sys.argv[1:] or ZERO_SHOT_BACKENDS)
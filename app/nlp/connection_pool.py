@@ -0,0 +1,56 @@
+import logging
+import threading
+
+from pymilvus import Collection, connections
+
+logging.basicConfig(level=logging.INFO)
+
+
+class MilvusConnectionPool:
+    """
+    A fixed set of pymilvus connections, each with its own alias (and so its own channel to the server).
+
+    Every thread that searches through the pool is pinned to one connection, handed out round robin on
+    its first call, so a pool of n connections used from n worker threads never shares a channel between
+    two in-flight calls. Connections are opened on first use.
+    """
+
+    def __init__(self, size, host, port, alias_prefix="vector-db-pool"):
+        self.size = size
+        self.host = host
+        self.port = port
+        self.aliases = [f"{alias_prefix}-{i}" for i in range(size)]
+        self._next = 0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        # (alias, collection name) -> Collection bound to that connection
+        self._collections = {}
+
+    def _alias(self):
+        alias = getattr(self._local, "alias", None)
+        if alias is None:
+            with self._lock:
+                alias = self.aliases[self._next % self.size]
+                self._next += 1
+                if not connections.has_connection(alias):
+                    logging.info(f"Opening pooled Milvus connection {alias}...")
+                    connections.connect(alias, host=self.host, port=self.port)
+            self._local.alias = alias
+        return alias
+
+    def collection(self, name):
+        """
+        The collection called name, bound to the calling thread's connection
+        """
+        key = (self._alias(), name)
+        with self._lock:
+            if key not in self._collections:
+                self._collections[key] = Collection(name, using=key[0])
+            return self._collections[key]
+
+    def close(self):
+        with self._lock:
+            for alias in self.aliases:
+                if connections.has_connection(alias):
+                    connections.disconnect(alias)
+            self._collections.clear()
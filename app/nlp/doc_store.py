@@ -0,0 +1,214 @@
+import logging
+import os
+import shutil
+
+import numpy as np
+
+from nlp.poi_formats import GEO_FIELDS
+from nlp.poi_formats import POI_FIELDS
+from nlp.poi_formats import PoiBatch
+from nlp.poi_formats import StringColumn
+
+logging.basicConfig(level=logging.INFO)
+
+# where the document stores of Milvus locales are written at ingestion, one directory per locale
+DOC_STORE_DIR = os.environ.get("VECTOR_DB_DOC_STORE_DIR", ".cache/doc_stores")
+
+# Doc store layout:
+#   doc.<field>.offsets, doc.<field>.bytes   int64 offsets and utf-8 data of each string field
+#   doc.<field>.f64                          latitude and longitude
+#   doc.id_order                             int64 row numbers sorted by mbx_id, for id -> row lookups; written
+#                                            last, so its presence marks a complete store
+
+
+def doc_store_path(name):
+    return os.path.join(DOC_STORE_DIR, name)
+
+
+class DocStore:
+    """
+    Read-only store of POI documents by mbx_id, so searches only need to return ids and scores and the
+    prompt builder hydrates just the fields it shows.
+
+    Documents are the columns of a PoiBatch (without embeddings), plus the rows sorted by mbx_id. A saved
+    store is memory-mapped when loaded, so only the pages of the documents actually hydrated are read.
+    """
+
+    def __init__(self, batch, id_order=None):
+        self.batch = batch
+        if id_order is None:
+            id_order = sorted_id_order(batch["mbx_id"])
+        self.id_order = np.asarray(id_order, dtype=np.int64)
+
+    def __len__(self):
+        return len(self.batch)
+
+    def row_of(self, mbx_id):
+        """
+        Returns the row number of an mbx_id, or None, by binary search over the sorted id order
+        """
+        ids = self.batch["mbx_id"]
+        low, high = 0, len(self.id_order)
+        while low < high:
+            middle = (low + high) // 2
+            if ids[self.id_order[middle]] < mbx_id:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.id_order) and ids[self.id_order[low]] == mbx_id:
+            return int(self.id_order[low])
+        return None
+
+    def hydrate(self, ids, fields):
+        """
+        The {"mbx_id", *fields} documents of the given ids, in order, with None for unknown ids.
+        Each field is gathered for all ids at once.
+        """
+        rows = [self.row_of(mbx_id) for mbx_id in ids]
+        found = np.array([row for row in rows if row is not None], dtype=np.int64)
+        values = {}
+        for field in fields:
+            column = self.batch[field]
+            if field in GEO_FIELDS:
+                values[field] = column[found].tolist()
+            else:
+                values[field] = column.take(found).to_list()
+        documents, position = [], 0
+        for mbx_id, row in zip(ids, rows):
+            if row is None:
+                documents.append(None)
+                continue
+            document = {"mbx_id": mbx_id}
+            for field in fields:
+                document[field] = values[field][position]
+            documents.append(document)
+            position += 1
+        return documents
+
+
+def sorted_id_order(ids):
+    """
+    The row numbers of a StringColumn of mbx_ids, sorted by mbx_id
+    """
+    ids = ids.to_list()
+    return np.array(sorted(range(len(ids)), key=ids.__getitem__), dtype=np.int64)
+
+
+class PoiColumnWriter:
+    """
+    Appends the columns of PoiBatches (not their embeddings) to raw files as they are ingested, so a whole
+    locale is never held in memory: <prefix><field>.f64 for the coordinates, <prefix><field>.offsets and
+    <prefix><field>.bytes (int64 offsets and utf-8 data) for the strings
+    """
+
+    def __init__(self, directory, prefix=""):
+        self.directory = directory
+        self.prefix = prefix
+        self.count = 0
+        self._files = {}
+        self._string_sizes = {}
+        for field in POI_FIELDS:
+            if field in GEO_FIELDS:
+                self._files[field] = self._open(f"{field}.f64")
+            else:
+                self._files[field] = (
+                    self._open(f"{field}.offsets"),
+                    self._open(f"{field}.bytes"),
+                )
+                self._files[field][0].write(np.zeros(1, dtype=np.int64).tobytes())
+                self._string_sizes[field] = 0
+
+    def _open(self, filename):
+        return open(os.path.join(self.directory, self.prefix + filename), "wb")
+
+    def add(self, batch):
+        for field in POI_FIELDS:
+            column = batch[field]
+            if field in GEO_FIELDS:
+                self._files[field].write(column.astype(np.float64).tobytes())
+                continue
+            offsets_file, bytes_file = self._files[field]
+            offsets_file.write(
+                (column.offsets[1:] + self._string_sizes[field]).tobytes()
+            )
+            bytes_file.write(bytes(column.data))
+            self._string_sizes[field] += int(column.offsets[-1])
+        self.count += len(batch)
+
+    def close(self):
+        for handle in self._files.values():
+            for f in handle if isinstance(handle, tuple) else (handle,):
+                f.close()
+
+    def id_order(self):
+        """
+        The rows written so far sorted by mbx_id, once the writer is closed
+        """
+        return sorted_id_order(
+            read_columns(self.directory, self.count, self.prefix)["mbx_id"]
+        )
+
+
+def _map(path, dtype):
+    if os.path.getsize(path) == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(path, dtype=dtype, mode="r")
+
+
+def read_columns(directory, count, prefix=""):
+    """
+    The columns of count rows written by a PoiColumnWriter, memory-mapped
+    """
+    columns = {}
+    for field in POI_FIELDS:
+        path = os.path.join(directory, prefix + field)
+        if field in GEO_FIELDS:
+            columns[field] = _map(path + ".f64", np.float64)[:count]
+        else:
+            columns[field] = StringColumn(
+                _map(path + ".offsets", np.int64)[: count + 1],
+                _map(path + ".bytes", np.uint8),
+            )
+    return columns
+
+
+class DocStoreWriter:
+    """
+    Streams the documents of ingested PoiBatches into the document store directory of a locale (see
+    doc_store_path), then opens it memory-mapped
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.staging = directory + ".tmp"
+        if os.path.exists(self.staging):
+            shutil.rmtree(self.staging)
+        os.makedirs(self.staging)
+        self._columns = PoiColumnWriter(self.staging, prefix="doc.")
+
+    def add(self, batch):
+        self._columns.add(batch)
+
+    def finish(self):
+        self._columns.close()
+        self._columns.id_order().tofile(os.path.join(self.staging, "doc.id_order"))
+        if os.path.exists(self.directory):
+            shutil.rmtree(self.directory)
+        os.replace(self.staging, self.directory)
+        logging.info(
+            f"Saved document store {self.directory} with {self._columns.count} POIs"
+        )
+        return load_doc_store(self.directory)
+
+
+def load_doc_store(directory):
+    """
+    Opens the document store saved in a directory, or returns None if there is none
+    """
+    id_order_path = os.path.join(directory, "doc.id_order")
+    if not os.path.exists(id_order_path):
+        return None
+    id_order = _map(id_order_path, np.int64)
+    return DocStore(
+        PoiBatch(read_columns(directory, len(id_order), prefix="doc.")), id_order
+    )
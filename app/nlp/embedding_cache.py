@@ -0,0 +1,120 @@
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+KEY_SIZE = 20  # sha1 digest size in bytes
+
+
+class EmbeddingCache:
+    """
+    Append-only, content-addressed embedding store on disk.
+
+    Each entry is keyed by sha1(model name + text). Vectors are appended to a raw float32 file
+    (<model>.f32) that is memory-mapped for reads, and the keys are appended in the same order
+    to <model>.keys, one digest per row. Any number of processes can read a cache directory, but only one
+    should write to it at a time.
+    """
+
+    def __init__(self, directory, model_name, dim):
+        self.model_name = model_name
+        self.dim = dim
+        os.makedirs(directory, exist_ok=True)
+        stem = os.path.join(directory, model_name.replace("/", "_"))
+        self.keys_path = stem + ".keys"
+        self.vectors_path = stem + ".f32"
+        self._index = {}
+        self._rows = 0
+        self._vectors = None
+        self._truncated = False
+        self._lock = threading.Lock()
+        self._open()
+
+    def __len__(self):
+        return self._rows
+
+    def _open(self):
+        if not os.path.exists(self.keys_path) or not os.path.exists(self.vectors_path):
+            return
+        row_bytes = self.dim * np.dtype(np.float32).itemsize
+        n_rows = min(
+            os.path.getsize(self.keys_path) // KEY_SIZE,
+            os.path.getsize(self.vectors_path) // row_bytes,
+        )
+        with open(self.keys_path, "rb") as f:
+            keys = f.read(n_rows * KEY_SIZE)
+        for row in range(n_rows):
+            self._index[keys[row * KEY_SIZE : (row + 1) * KEY_SIZE]] = row
+        self._rows = n_rows
+        self._remap()
+        logging.info(
+            f"Opened embedding cache {self.vectors_path} with {n_rows} entries"
+        )
+
+    def _remap(self):
+        if self._rows == 0:
+            self._vectors = None
+            return
+        self._vectors = np.memmap(
+            self.vectors_path, dtype=np.float32, mode="r", shape=(self._rows, self.dim)
+        )
+
+    def key(self, text):
+        return hashlib.sha1((self.model_name + "\0" + text).encode("utf-8")).digest()
+
+    def lookup(self, texts):
+        """
+        Returns a float32 matrix with the cached rows filled in, and the positions of the texts that missed
+        """
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        hits, rows, misses = [], [], []
+        with self._lock:
+            for i, text in enumerate(texts):
+                row = self._index.get(self.key(text))
+                if row is None:
+                    misses.append(i)
+                else:
+                    hits.append(i)
+                    rows.append(row)
+            if hits:
+                vectors[hits] = self._vectors[rows]
+        return vectors, misses
+
+    def add(self, texts, vectors):
+        """
+        Appends the embeddings for texts that are not cached yet
+        """
+        vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        with self._lock:
+            new_keys, new_rows = [], []
+            for i, text in enumerate(texts):
+                key = self.key(text)
+                if key in self._index:
+                    continue
+                self._index[key] = self._rows + len(new_keys)
+                new_keys.append(key)
+                new_rows.append(i)
+            if not new_keys:
+                return
+            if not self._truncated:
+                # drop any half-written tail so the two files stay aligned for our appends
+                row_bytes = self.dim * np.dtype(np.float32).itemsize
+                for path, size in (
+                    (self.keys_path, KEY_SIZE),
+                    (self.vectors_path, row_bytes),
+                ):
+                    if os.path.exists(path):
+                        os.truncate(path, self._rows * size)
+                self._truncated = True
+            # vectors first: a crash between the two writes leaves an unreferenced row, which is
+            # ignored on open and truncated before the next append
+            with open(self.vectors_path, "ab") as f:
+                f.write(vectors[new_rows].tobytes())
+            with open(self.keys_path, "ab") as f:
+                f.write(b"".join(new_keys))
+            self._rows += len(new_keys)
+            self._remap()
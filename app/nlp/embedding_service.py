@@ -0,0 +1,138 @@
+import asyncio
+import logging
+import os
+import time
+from collections import deque
+from concurrent.futures import Future
+
+import numpy as np
+
+from nlp.micro_batching import STATS_WINDOW
+from nlp.micro_batching import MicroBatcher
+
+logging.basicConfig(level=logging.INFO)
+
+# texts encoded together in one forward pass, at most
+EMBEDDING_MAX_BATCH = int(os.environ.get("EMBEDDING_MAX_BATCH", "64"))
+# milliseconds the worker waits for more texts after the first request of a batch arrives
+EMBEDDING_MAX_WAIT_MS = float(os.environ.get("EMBEDDING_MAX_WAIT_MS", "2"))
+
+
+class _Request:
+    def __init__(self, texts):
+        self.texts = texts
+        self.future = Future()
+        self.embeddings = None
+        self.pending = 0
+        self.submitted = time.monotonic()
+
+
+class EmbeddingService(MicroBatcher):
+    """
+    Owns the sentence encoder and serves every embedding request of the process, from threads
+    (encode) or asyncio tasks (encode_async).
+
+    A worker thread (see nlp.micro_batching) coalesces the texts of concurrent requests: it takes the first
+    queued piece, waits up to max_wait_ms for more (up to max_batch texts in all), sorts the texts by length
+    and encodes them in length buckets of max_batch, so short queries are not padded to the length of long
+    POI descriptions. Requests of more than max_batch texts (ingestion) are split into pieces that queue
+    behind the pieces of small (interactive) requests, so a bulk load does not hold up queries.
+
+    load_model returns the encoder of dim-dimensional embeddings, loaded by the worker on the first request.
+    """
+
+    def __init__(
+        self,
+        load_model,
+        dim,
+        max_batch=EMBEDDING_MAX_BATCH,
+        max_wait_ms=EMBEDDING_MAX_WAIT_MS,
+    ):
+        super().__init__(max_batch, max_wait_ms, "embedding-service", unit="texts")
+        self.load_model = load_model
+        self.dim = dim
+        self._latencies = deque(maxlen=STATS_WINDOW)
+        self.requests = 0
+
+    def submit(self, texts):
+        """
+        Queues texts for encoding; returns a Future of their (len(texts), dim) float32 embeddings
+        """
+        texts = list(texts)
+        request = _Request(texts)
+        if not texts:
+            request.future.set_result(np.zeros((0, self.dim), dtype=np.float32))
+            return request.future
+        priority = 0 if len(texts) <= self.max_batch else 1
+        offsets = range(0, len(texts), self.max_batch)
+        request.pending = len(offsets)
+        for offset in offsets:
+            piece = texts[offset : offset + self.max_batch]
+            self.put((request, offset, piece), size=len(piece), priority=priority)
+        return request.future
+
+    def encode(self, texts, timeout=None):
+        return self.submit(texts).result(timeout)
+
+    async def encode_async(self, texts):
+        return await asyncio.wrap_future(self.submit(texts))
+
+    def process_batch(self, pieces):
+        texts = [text for _, _, piece_texts in pieces for text in piece_texts]
+        embeddings = self._encode_bucketed(texts)
+        position = 0
+        finished = []
+        for request, offset, piece_texts in pieces:
+            if request.future.done():
+                # an earlier piece of the request failed
+                position += len(piece_texts)
+                continue
+            if request.embeddings is None:
+                request.embeddings = np.empty(
+                    (len(request.texts), self.dim), dtype=np.float32
+                )
+            request.embeddings[offset : offset + len(piece_texts)] = embeddings[
+                position : position + len(piece_texts)
+            ]
+            position += len(piece_texts)
+            request.pending -= 1
+            if request.pending == 0:
+                request.future.set_result(request.embeddings)
+                finished.append(request)
+        now = time.monotonic()
+        with self._lock:
+            self._latencies.extend(now - request.submitted for request in finished)
+            self.requests += len(finished)
+
+    def fail_batch(self, pieces, error):
+        for request, _, _ in pieces:
+            if not request.future.done():
+                request.future.set_exception(error)
+
+    def _encode_bucketed(self, texts):
+        model = self.load_model()
+        order = np.argsort([len(text) for text in texts], kind="stable")
+        embeddings = np.empty((len(texts), self.dim), dtype=np.float32)
+        for start in range(0, len(texts), self.max_batch):
+            bucket = order[start : start + self.max_batch]
+            embeddings[bucket] = model.encode(
+                [texts[i] for i in bucket], batch_size=len(bucket)
+            )
+        return embeddings
+
+    def stats(self):
+        """
+        The MicroBatcher statistics (texts_per_second being the encoding throughput), plus the requests
+        served and their latency (milliseconds, from submission to result) over the last STATS_WINDOW
+        """
+        stats = super().stats()
+        with self._lock:
+            latencies = np.array(self._latencies) * 1000
+            stats["requests"] = self.requests
+        stats["latency_ms_p50"] = (
+            float(np.percentile(latencies, 50)) if len(latencies) else None
+        )
+        stats["latency_ms_p95"] = (
+            float(np.percentile(latencies, 95)) if len(latencies) else None
+        )
+        return stats
@@ -0,0 +1,184 @@
+import math
+
+import numpy as np
+
+# mean Earth radius, in meters
+EARTH_RADIUS_M = 6371008.8
+# side of a GridIndex cell, in degrees (about 1.1 km of latitude)
+GRID_CELL_DEGREES = 0.01
+# beyond this many grid cells a query just scans every point
+MAX_GRID_CELLS = 4096
+
+
+def haversine(latitude, longitude, latitudes, longitudes):
+    """
+    Great-circle distances in meters from one point to arrays of points; NaN where a coordinate is unknown
+    """
+    lat1, lon1 = np.radians(latitude), np.radians(longitude)
+    lat2 = np.radians(np.asarray(latitudes, dtype=np.float64))
+    lon2 = np.radians(np.asarray(longitudes, dtype=np.float64))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_M * np.arcsin(np.sqrt(np.minimum(a, 1.0)))
+
+
+class GeoFilter:
+    """
+    Restricts a search to a circle (center and radius in meters) or to a bounding box.
+
+    Use GeoFilter.radius(latitude, longitude, meters) or
+    GeoFilter.bounding_box(min_latitude, min_longitude, max_latitude, max_longitude).
+    Points without coordinates never match.
+    """
+
+    def __init__(self, center=None, radius_m=None, box=None):
+        if (center is None or radius_m is None) and box is None:
+            raise ValueError("A GeoFilter needs either a center and a radius, or a box")
+        self.center = center
+        self.radius_m = radius_m
+        self.box = box if box is not None else self._radius_box(center, radius_m)
+
+    @classmethod
+    def radius(cls, latitude, longitude, radius_m):
+        return cls(center=(latitude, longitude), radius_m=radius_m)
+
+    @classmethod
+    def bounding_box(cls, min_latitude, min_longitude, max_latitude, max_longitude):
+        return cls(box=(min_latitude, min_longitude, max_latitude, max_longitude))
+
+    @staticmethod
+    def _radius_box(center, radius_m):
+        latitude, longitude = center
+        delta_lat = math.degrees(radius_m / EARTH_RADIUS_M)
+        cos_lat = math.cos(math.radians(latitude))
+        delta_lon = (
+            180.0
+            if cos_lat < 1e-6
+            else min(180.0, math.degrees(radius_m / (EARTH_RADIUS_M * cos_lat)))
+        )
+        return (
+            max(-90.0, latitude - delta_lat),
+            max(-180.0, longitude - delta_lon),
+            min(90.0, latitude + delta_lat),
+            min(180.0, longitude + delta_lon),
+        )
+
+    def reference(self):
+        """
+        The point distances are measured from: the center, or the middle of the box
+        """
+        if self.center is not None:
+            return self.center
+        min_lat, min_lon, max_lat, max_lon = self.box
+        return (min_lat + max_lat) / 2, (min_lon + max_lon) / 2
+
+    def scale_m(self):
+        """
+        The distance that counts as "far" when blending with similarity: the radius, or half the box diagonal
+        """
+        if self.radius_m is not None:
+            return max(self.radius_m, 1.0)
+        min_lat, min_lon, max_lat, max_lon = self.box
+        return max(float(haversine(min_lat, min_lon, max_lat, max_lon)) / 2, 1.0)
+
+    def distances(self, latitudes, longitudes):
+        return haversine(*self.reference(), latitudes, longitudes)
+
+    def contains(self, latitudes, longitudes):
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        min_lat, min_lon, max_lat, max_lon = self.box
+        with np.errstate(invalid="ignore"):
+            inside = (
+                (latitudes >= min_lat)
+                & (latitudes <= max_lat)
+                & (longitudes >= min_lon)
+                & (longitudes <= max_lon)
+            )
+            if self.radius_m is not None:
+                inside &= self.distances(latitudes, longitudes) <= self.radius_m
+        return inside
+
+    def milvus_expr(self):
+        """
+        Boolean expression selecting the bounding box in a Milvus collection with DOUBLE coordinates
+        """
+        min_lat, min_lon, max_lat, max_lon = self.box
+        return (
+            f"latitude >= {min_lat!r} && latitude <= {max_lat!r} && "
+            f"longitude >= {min_lon!r} && longitude <= {max_lon!r}"
+        )
+
+    def key(self):
+        return (self.center, self.radius_m, self.box)
+
+
+def blend_scores(vector_distances, geo_distances, weight, scale_m):
+    """
+    Lower is better: (1 - weight) * vector distance + weight * geo distance / scale_m
+    """
+    return (1 - weight) * np.asarray(vector_distances) + weight * np.asarray(
+        geo_distances
+    ) / scale_m
+
+
+class GridIndex:
+    """
+    Buckets points into square cells of cell_degrees, so a GeoFilter only looks at the points of the
+    cells its bounding box overlaps.
+
+    Cells are numbered latitude-major, so the cells of one latitude band form a single contiguous run of
+    the sorted cell ids and each band costs one pair of binary searches.
+    """
+
+    def __init__(self, latitudes, longitudes, cell_degrees=GRID_CELL_DEGREES):
+        self.cell_degrees = cell_degrees
+        self.latitudes = latitudes
+        self.longitudes = longitudes
+        latitudes = np.asarray(latitudes, dtype=np.float64)
+        longitudes = np.asarray(longitudes, dtype=np.float64)
+        known = np.flatnonzero(~(np.isnan(latitudes) | np.isnan(longitudes)))
+        cells = self._cells(latitudes[known], longitudes[known])
+        order = np.argsort(cells, kind="stable")
+        self.cells = cells[order]
+        self.rows = known[order]
+
+    def _band(self, latitudes):
+        return np.floor((np.asarray(latitudes) + 90.0) / self.cell_degrees).astype(
+            np.int64
+        )
+
+    def _column(self, longitudes):
+        return np.floor((np.asarray(longitudes) + 180.0) / self.cell_degrees).astype(
+            np.int64
+        )
+
+    def _cells(self, latitudes, longitudes):
+        return self._band(latitudes) * (1 << 32) + self._column(longitudes)
+
+    def candidates(self, geo_filter):
+        """
+        Sorted row numbers of the points inside geo_filter
+        """
+        min_lat, min_lon, max_lat, max_lon = geo_filter.box
+        first_band, last_band = self._band(min_lat), self._band(max_lat)
+        first_column, last_column = self._column(min_lon), self._column(max_lon)
+        n_cells = (last_band - first_band + 1) * (last_column - first_column + 1)
+        if n_cells > MAX_GRID_CELLS:
+            rows = np.sort(self.rows)
+        else:
+            bands = np.arange(first_band, last_band + 1) * (1 << 32)
+            starts = np.searchsorted(self.cells, bands + first_column, side="left")
+            stops = np.searchsorted(self.cells, bands + last_column, side="right")
+            rows = np.sort(
+                np.concatenate(
+                    [self.rows[start:stop] for start, stop in zip(starts, stops)]
+                    + [np.zeros(0, dtype=np.int64)]
+                )
+            )
+        inside = geo_filter.contains(
+            np.asarray(self.latitudes[rows]), np.asarray(self.longitudes[rows])
+        )
+        return rows[inside]
@@ -0,0 +1,260 @@
+import json
+import logging
+import math
+import os
+import sys
+import time
+
+import numpy as np
+
+from nlp.quantization import recall_at_k
+
+logging.basicConfig(level=logging.INFO)
+
+# where tune_collection writes, and VectorDB reads, the tuned index of each collection
+INDEX_CONFIG_DIR = os.environ.get("VECTOR_DB_INDEX_CONFIG_DIR", ".cache/index_configs")
+# the tuned configuration is the fastest one reaching this recall@k against exact search
+TARGET_RECALL = float(os.environ.get("VECTOR_DB_TARGET_RECALL", "0.95"))
+
+# locales whose POIs the queries tuning a shared Milvus collection are sampled from, at most
+TUNING_LOCALES = int(os.environ.get("VECTOR_DB_TUNING_LOCALES", "10"))
+
+# collection name -> (modification time, tuned config), so configs are only read again once rewritten
+_INDEX_CONFIGS = {}
+
+
+def index_config_path(name):
+    return os.path.join(INDEX_CONFIG_DIR, f"{name}.json")
+
+
+def load_index_config(name):
+    """
+    Returns the tuned {"index": index params, "search": search params, ...} of a collection, or None.
+    A config rewritten by another process (make tune-indexes) is picked up on the next call.
+    """
+    path = index_config_path(name)
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        mtime = None
+    cached = _INDEX_CONFIGS.get(name)
+    if cached is None or cached[0] != mtime:
+        config = None
+        if mtime is not None:
+            with open(path, "r") as f:
+                config = json.load(f)
+        _INDEX_CONFIGS[name] = cached = (mtime, config)
+    return cached[1]
+
+
+def save_index_config(name, config):
+    os.makedirs(INDEX_CONFIG_DIR, exist_ok=True)
+    path = index_config_path(name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(config, f, indent=2)
+    os.replace(path + ".tmp", path)
+    _INDEX_CONFIGS[name] = (os.stat(path).st_mtime_ns, config)
+
+
+def candidate_configs(n_entities, metric_type="L2"):
+    """
+    The (index params, search params) pairs worth trying for a collection of n_entities vectors:
+    exact search, IVF_FLAT and IVF_SQ8 with nlist around sqrt(n) and a sweep of nprobe, and HNSW with a
+    sweep of M and ef
+    """
+    configs = [({"index_type": "FLAT", "params": {}}, {"params": {}})]
+    root = max(1, int(math.sqrt(n_entities)))
+    nlists = sorted({max(1, min(nlist, n_entities)) for nlist in (root, 4 * root)})
+    for index_type in ("IVF_FLAT", "IVF_SQ8"):
+        for nlist in nlists:
+            nprobes = sorted({min(nprobe, nlist) for nprobe in (1, 4, 8, 16, 32, 64)})
+            for nprobe in nprobes:
+                configs.append(
+                    (
+                        {"index_type": index_type, "params": {"nlist": nlist}},
+                        {"params": {"nprobe": nprobe}},
+                    )
+                )
+    for m in (8, 16, 32):
+        for ef in (16, 32, 64, 128):
+            configs.append(
+                (
+                    {"index_type": "HNSW", "params": {"M": m, "efConstruction": 200}},
+                    {"params": {"ef": ef}},
+                )
+            )
+    return [
+        ({**index, "metric_type": metric_type}, {**search, "metric_type": metric_type})
+        for index, search in configs
+    ]
+
+
+def _hit_ids(results):
+    return [[hit.id for hit in hits] for hits in results]
+
+
+def _rebuild_index(collection, index_params):
+    """
+    Replaces the vector index of a Milvus or local collection, returning the build time in seconds
+    """
+    start = time.time()
+    collection.release()
+    if collection.has_index():
+        collection.drop_index()
+    collection.create_index("embedding", index_params)
+    collection.load()
+    return time.time() - start
+
+
+def pareto_front(rows):
+    """
+    The rows no other row beats on both recall (higher) and p50 latency (lower)
+    """
+    return [
+        row
+        for row in rows
+        if not any(
+            other["recall"] >= row["recall"]
+            and other["p50_ms"] <= row["p50_ms"]
+            and (other["recall"], other["p50_ms"]) != (row["recall"], row["p50_ms"])
+            for other in rows
+        )
+    ]
+
+
+def choose_config(rows, target_recall=TARGET_RECALL):
+    """
+    The fastest configuration of the Pareto front reaching target_recall, or the most accurate one
+    """
+    front = pareto_front(rows)
+    good = [row for row in front if row["recall"] >= target_recall]
+    if good:
+        return min(good, key=lambda row: row["p50_ms"])
+    return max(front, key=lambda row: (row["recall"], -row["p50_ms"]))
+
+
+def benchmark_configs(collection, queries, k=10, configs=None):
+    """
+    Builds each index configuration on the collection in turn and searches the queries one at a time,
+    reporting build time, p50/p99 latency and recall@k against the exact (FLAT) results.
+
+    Index types the collection does not support (e.g. HNSW for local collections) are skipped.
+    """
+    configs = configs or candidate_configs(collection.num_entities)
+    rows, expected, built = [], None, None
+    for index_params, search_params in configs:
+        index_key = json.dumps(index_params, sort_keys=True)
+        if index_key != built:
+            try:
+                build_time = _rebuild_index(collection, index_params)
+            except Exception as e:
+                logging.info(f"Skipping {index_params['index_type']}: {e}")
+                built = None
+                continue
+            built = index_key
+        latencies, results = [], []
+        for query in queries:
+            start = time.perf_counter()
+            results.extend(
+                collection.search(query[None, :], "embedding", search_params, limit=k)
+            )
+            latencies.append(time.perf_counter() - start)
+        found = _hit_ids(results)
+        if expected is None:
+            # configs start with FLAT, whose results are exact
+            expected = found
+        row = {
+            "index": index_params,
+            "search": search_params,
+            "recall": recall_at_k(found, expected),
+            "p50_ms": float(np.percentile(latencies, 50) * 1000),
+            "p99_ms": float(np.percentile(latencies, 99) * 1000),
+            "build_s": build_time,
+        }
+        logging.info(f"BENCHMARKING INDEX: {row}")
+        rows.append(row)
+    return rows
+
+
+def tune_collection(collection, queries, k=10, target_recall=TARGET_RECALL, name=None):
+    """
+    Benchmarks every candidate configuration on a collection, saves the chosen one and the Pareto front
+    as its index config (under name, by default its index_name), and leaves the collection indexed with
+    the chosen configuration
+    """
+    name = name or collection.index_name
+    rows = benchmark_configs(collection, queries, k)
+    chosen = choose_config(rows, target_recall)
+    config = {
+        "index": chosen["index"],
+        "search": chosen["search"],
+        "k": k,
+        "target_recall": target_recall,
+        "recall": chosen["recall"],
+        "p50_ms": chosen["p50_ms"],
+        "p99_ms": chosen["p99_ms"],
+        "build_s": chosen["build_s"],
+        "n_entities": collection.num_entities,
+        "pareto_front": pareto_front(rows),
+    }
+    _rebuild_index(collection, chosen["index"])
+    save_index_config(name, config)
+    logging.info(
+        f"Tuned {name}: {chosen['index']} searched with {chosen['search']}, recall@{k} {chosen['recall']:.3f}, p50 {chosen['p50_ms']:.2f} ms"
+    )
+    return config
+
+
+def sample_queries(embeddings, n_queries=100, noise=0.1, seed=0):
+    """
+    Query vectors for tuning: randomly chosen POI embeddings with a little gaussian noise added
+    """
+    rng = np.random.default_rng(seed)
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    queries = embeddings[
+        rng.choice(len(embeddings), min(n_queries, len(embeddings)), replace=False)
+    ]
+    return queries + rng.normal(scale=queries.std() * noise, size=queries.shape).astype(
+        np.float32
+    )
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=app python app/nlp/index_tuning.py [location ...]
+    # running VectorDBs pick the new configs up on their next search: search params are part of the result key.
+    # Milvus locales are tuned as they were last ingested, with queries sampled from their stored embeddings
+    import random
+
+    from nlp.vector_db import LOCATIONS
+    from nlp.vector_db import VECTOR_DB_SCHEMA
+    from nlp.vector_db import open_existing_collection
+    from nlp.vector_db import sample_stored_embeddings
+
+    # index name -> [opened collection]
+    groups = {}
+    for location in sys.argv[1:] or LOCATIONS:
+        collection = open_existing_collection(VECTOR_DB_SCHEMA, **LOCATIONS[location])
+        if collection is None:
+            logging.info(f"Skipping {location}: it has not been ingested yet")
+            continue
+        groups.setdefault(collection.index_name, []).append(collection)
+    for index_name, members in groups.items():
+        collection = members[0]
+        if collection.index_name != collection.name:
+            # Milvus partitions share the index of their collection: tune it over the whole collection, with
+            # queries sampled from the POIs of up to TUNING_LOCALES of its locales
+            collection = collection.collection
+            members = random.Random(0).sample(
+                members, min(TUNING_LOCALES, len(members))
+            )
+        per_locale = max(1, 100 // len(members))
+        for member in members:
+            # Milvus only queries loaded partitions
+            member.load()
+        queries = np.concatenate(
+            [
+                sample_queries(sample_stored_embeddings(member, per_locale), per_locale)
+                for member in members
+            ]
+        )
+        tune_collection(collection, queries, name=index_name)
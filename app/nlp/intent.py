@@ -0,0 +1,206 @@
+import json
+import logging
+import os
+import sys
+import threading
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+RECOMMENDATION_LABEL = "location_recommendations_request"
+NO_RECOMMENDATION_LABEL = "no_location_recommendations_request"
+
+# labelled messages the prototype classifier is fitted on, one {"text", "label"} object per line
+INTENT_EXAMPLES_PATH = os.environ.get(
+    "INTENT_EXAMPLES_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_examples.jsonl"),
+)
+
+
+def load_examples(path=INTENT_EXAMPLES_PATH):
+    """
+    Returns the (texts, labels) of a labelled message file, labels being 1 for recommendation requests
+    """
+    texts, labels = [], []
+    with open(path, "r") as f:
+        for line in f:
+            if line.strip():
+                example = json.loads(line)
+                texts.append(example["text"])
+                labels.append(int(example["label"] == RECOMMENDATION_LABEL))
+    return texts, np.array(labels, dtype=np.int64)
+
+
+def _normalize(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    vectors = vectors.reshape(-1, vectors.shape[-1])
+    return vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+
+
+def fit_platt(margins, labels, iterations=50):
+    """
+    Platt scaling: the (a, b) of sigmoid(a * margin + b) best fitting the labels, by Newton's method on the
+    log loss with Platt's smoothed targets
+    """
+    positives = labels.sum()
+    negatives = len(labels) - positives
+    targets = np.where(
+        labels == 1, (positives + 1) / (positives + 2), 1 / (negatives + 2)
+    )
+    features = np.stack([margins, np.ones_like(margins)], axis=1).astype(np.float64)
+    weights = np.zeros(2)
+    for _ in range(iterations):
+        probabilities = 1 / (1 + np.exp(-features @ weights))
+        gradient = features.T @ (probabilities - targets)
+        hessian = (features.T * probabilities * (1 - probabilities)) @ features
+        step = np.linalg.solve(hessian + 1e-9 * np.eye(2), gradient)
+        weights -= step
+        if np.abs(step).max() < 1e-9:
+            break
+    return float(weights[0]), float(weights[1])
+
+
+class PrototypeClassifier:
+    """
+    Nearest-prototype intent classifier over MiniLM sentence embeddings: each class is the normalized mean
+    embedding of its examples, a message's margin is its cosine similarity to the recommendation prototype
+    minus the one to the other prototype, and Platt scaling turns the margin into a probability.
+    """
+
+    def fit(self, embeddings, labels):
+        embeddings = _normalize(embeddings)
+        self.prototypes = _normalize(
+            np.stack(
+                [
+                    embeddings[labels == 1].mean(axis=0),
+                    embeddings[labels == 0].mean(axis=0),
+                ]
+            )
+        )
+        self.a, self.b = fit_platt(self.margins(embeddings), labels)
+        return self
+
+    def margins(self, embeddings):
+        similarities = _normalize(embeddings) @ self.prototypes.T
+        return similarities[:, 0] - similarities[:, 1]
+
+    def predict_proba(self, embeddings):
+        """
+        The probability that each embedded message is a recommendation request
+        """
+        return 1 / (1 + np.exp(-(self.a * self.margins(embeddings) + self.b)))
+
+
+_prototype_classifier = None
+_prototype_lock = threading.Lock()
+
+
+def get_prototype_classifier():
+    """
+    Returns the prototype classifier, fitted on the labelled examples on the first call
+    """
+    global _prototype_classifier
+    with _prototype_lock:
+        if _prototype_classifier is None:
+            from utils import embed
+
+            texts, labels = load_examples()
+            # the on-disk embedding cache is for POI contexts only
+            _prototype_classifier = PrototypeClassifier().fit(
+                embed(texts, use_cache=False), labels
+            )
+            logging.info(f"Fitted intent prototypes on {len(texts)} examples")
+        return _prototype_classifier
+
+
+def cross_validated_probabilities(embeddings, labels, folds=5, seed=0):
+    """
+    The probability given to each example by a classifier fitted on the other folds
+    """
+    order = np.random.default_rng(seed).permutation(len(labels))
+    probabilities = np.empty(len(labels))
+    for held_out in np.array_split(order, folds):
+        train = np.setdiff1d(order, held_out)
+        classifier = PrototypeClassifier().fit(embeddings[train], labels[train])
+        probabilities[held_out] = classifier.predict_proba(embeddings[held_out])
+    return probabilities
+
+
+def _precision(predicted, labels):
+    return float(labels[predicted].mean()) if predicted.any() else None
+
+
+def _recall(predicted, labels):
+    return float(predicted[labels == 1].mean()) if (labels == 1).any() else None
+
+
+def calibration_report(
+    texts, labels, embeddings, accept, reject, zero_shot_scores=None, threshold=0.9
+):
+    """
+    Cross-validated precision and recall of the prototype tier and of the cascade, at each accept threshold
+    and at the configured (accept, reject) pair, with the share of messages escalated to the zero-shot
+    model. zero_shot_scores (the zero-shot recommendation score of every message) gives the precision of
+    the zero-shot model alone at threshold, and lets the cascade's precision be measured end to end.
+    """
+    probabilities = cross_validated_probabilities(embeddings, labels)
+    report = {"examples": len(labels), "positives": int(labels.sum()), "sweep": []}
+    for candidate in (0.5, 0.6, 0.7, 0.8, 0.9, 0.95, 0.99):
+        accepted = probabilities >= candidate
+        report["sweep"].append(
+            {
+                "accept": candidate,
+                "prototype_precision": _precision(accepted, labels),
+                "prototype_recall": _recall(accepted, labels),
+            }
+        )
+    accepted = probabilities >= accept
+    escalated = (probabilities > reject) & ~accepted
+    configured = {
+        "accept": accept,
+        "reject": reject,
+        "escalated": float(escalated.mean()),
+        "prototype_precision": _precision(accepted, labels),
+        "false_rejections": int(((probabilities <= reject) & (labels == 1)).sum()),
+    }
+    if zero_shot_scores is not None:
+        zero_shot = np.asarray(zero_shot_scores) > threshold
+        cascade = accepted | (escalated & zero_shot)
+        report["zero_shot"] = {
+            "threshold": threshold,
+            "precision": _precision(zero_shot, labels),
+            "recall": _recall(zero_shot, labels),
+        }
+        configured["cascade_precision"] = _precision(cascade, labels)
+        configured["cascade_recall"] = _recall(cascade, labels)
+    report["configured"] = configured
+    report["misclassified"] = [
+        {"text": text, "label": int(label), "probability": round(float(p), 3)}
+        for text, label, p in zip(texts, labels, probabilities)
+        if (p >= accept and label == 0) or (p <= reject and label == 1)
+    ]
+    return report
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=app python app/nlp/intent.py [--zero-shot]
+    # --zero-shot also scores every example with the DeBERTa model, for the end to end cascade precision
+    from utils import embed
+    from nlp.classifiers import INTENT_ACCEPT
+    from nlp.classifiers import INTENT_REJECT
+    from nlp.classifiers import recommendation_score
+
+    texts, labels = load_examples()
+    zero_shot_scores = None
+    if "--zero-shot" in sys.argv[1:]:
+        zero_shot_scores = [recommendation_score(text) for text in texts]
+    report = calibration_report(
+        texts,
+        labels,
+        embed(texts, use_cache=False),
+        INTENT_ACCEPT,
+        INTENT_REJECT,
+        zero_shot_scores,
+    )
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,210 @@
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter
+
+import numpy as np
+
+from nlp.poi_formats import GEO_FIELDS
+from nlp.poi_formats import PoiBatch
+from nlp.poi_formats import StringColumn
+
+logging.basicConfig(level=logging.INFO)
+
+# indexed fields and how much one occurrence of a term in each counts towards its frequency
+LEXICAL_FIELD_WEIGHTS = {"name": 3.0, "category": 1.5, "description": 1.0}
+# fields kept next to the postings so hits can be built and geo filtered without going back to the
+# collection; their other fields are hydrated from the doc store (see nlp.doc_store)
+STORED_FIELDS = ["mbx_id", "latitude", "longitude"]
+# reciprocal rank fusion constant: larger values flatten the advantage of the top ranks
+RRF_K = 60
+
+_TOKEN = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    return _TOKEN.findall(text.lower())
+
+
+class BM25Builder:
+    """
+    Accumulates the term frequencies of PoiBatches as they are ingested, then packs them into a BM25Index.
+
+    With store=True the STORED_FIELDS of every batch are kept too, for collections whose rows live elsewhere
+    (in Milvus); a LocalCollection passes its own batch to build() instead.
+    """
+
+    def __init__(self, store=False):
+        self.vocabulary = {}
+        self.store = store
+        self._rows, self._terms, self._frequencies, self._lengths = [], [], [], []
+        self._stored = []
+        self.n_docs = 0
+
+    def add(self, batch):
+        columns = {field: batch[field].to_list() for field in LEXICAL_FIELD_WEIGHTS}
+        rows, terms, frequencies = [], [], []
+        lengths = np.zeros(len(batch), dtype=np.float32)
+        for i in range(len(batch)):
+            counts = Counter()
+            for field, weight in LEXICAL_FIELD_WEIGHTS.items():
+                for token in tokenize(columns[field][i]):
+                    counts[
+                        self.vocabulary.setdefault(token, len(self.vocabulary))
+                    ] += weight
+            rows.extend([self.n_docs + i] * len(counts))
+            terms.extend(counts.keys())
+            frequencies.extend(counts.values())
+            lengths[i] = sum(counts.values())
+        self._rows.append(np.array(rows, dtype=np.int64))
+        self._terms.append(np.array(terms, dtype=np.int64))
+        self._frequencies.append(np.array(frequencies, dtype=np.float32))
+        self._lengths.append(lengths)
+        if self.store:
+            # only the stored columns, so the embeddings of the batch can be freed
+            self._stored.append({field: batch[field] for field in STORED_FIELDS})
+        self.n_docs += len(batch)
+
+    def build(self, batch=None):
+        if self.store and batch is None:
+            batch = _stored_batch(self._stored)
+        rows = np.concatenate(self._rows + [np.zeros(0, dtype=np.int64)])
+        terms = np.concatenate(self._terms + [np.zeros(0, dtype=np.int64)])
+        frequencies = np.concatenate(
+            self._frequencies + [np.zeros(0, dtype=np.float32)]
+        )
+        # postings sorted by term, then row: term t owns entries offsets[t]:offsets[t + 1]
+        order = np.lexsort((rows, terms))
+        offsets = np.zeros(len(self.vocabulary) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(terms, minlength=len(self.vocabulary)), out=offsets[1:])
+        terms_by_id = sorted(self.vocabulary, key=self.vocabulary.get)
+        return BM25Index(
+            terms_by_id,
+            offsets,
+            rows[order].astype(np.int32),
+            frequencies[order],
+            np.concatenate(self._lengths + [np.zeros(0, dtype=np.float32)]),
+            batch,
+        )
+
+
+def _stored_batch(batches):
+    columns = {}
+    for field in STORED_FIELDS:
+        parts = [batch[field] for batch in batches]
+        if field in GEO_FIELDS:
+            columns[field] = np.concatenate(parts + [np.zeros(0)])
+        else:
+            columns[field] = StringColumn.concat(parts or [StringColumn.from_list([])])
+    return PoiBatch(columns)
+
+
+class BM25Index:
+    """
+    Okapi BM25 over the name, category and description of POIs, stored as compact CSR postings:
+    int32 row numbers and float32 (field weighted) term frequencies, grouped by term.
+
+    batch holds at least the STORED_FIELDS of the indexed rows, in row order.
+    """
+
+    def __init__(
+        self, terms, offsets, rows, frequencies, lengths, batch, k1=1.2, b=0.75
+    ):
+        self.terms = terms
+        self.vocabulary = {term: i for i, term in enumerate(terms)}
+        self.offsets = offsets
+        self.rows = rows
+        self.frequencies = frequencies
+        self.lengths = lengths
+        self.batch = batch
+        self.k1 = k1
+        self.b = b
+        self.average_length = float(np.mean(lengths)) if len(lengths) else 0.0
+
+    def __len__(self):
+        return len(self.lengths)
+
+    def search(self, query, limit, allowed=None):
+        """
+        Returns the (rows, scores) of the limit best matching rows, best first, optionally restricted
+        to the sorted row numbers in allowed
+        """
+        term_ids = sorted(
+            {self.vocabulary[t] for t in tokenize(query) if t in self.vocabulary}
+        )
+        if not term_ids or not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        rows, contributions = [], []
+        for term_id in term_ids:
+            start, stop = self.offsets[term_id], self.offsets[term_id + 1]
+            term_rows = self.rows[start:stop]
+            frequencies = self.frequencies[start:stop]
+            idf = math.log(
+                1 + (len(self) - (stop - start) + 0.5) / (stop - start + 0.5)
+            )
+            norm = self.k1 * (
+                1 - self.b + self.b * self.lengths[term_rows] / self.average_length
+            )
+            rows.append(term_rows)
+            contributions.append(
+                idf * frequencies * (self.k1 + 1) / (frequencies + norm)
+            )
+        matched, inverse = np.unique(np.concatenate(rows), return_inverse=True)
+        scores = np.bincount(inverse, weights=np.concatenate(contributions))
+        if allowed is not None:
+            keep = np.isin(matched, allowed, assume_unique=True)
+            matched, scores = matched[keep], scores[keep]
+        best = np.argsort(-scores, kind="stable")[:limit]
+        return matched[best].astype(np.int64), scores[best].astype(np.float32)
+
+    def save(self, directory):
+        with open(os.path.join(directory, "lexical.terms.json"), "w") as f:
+            json.dump(self.terms, f)
+        np.save(os.path.join(directory, "lexical.offsets.npy"), self.offsets)
+        np.save(os.path.join(directory, "lexical.rows.npy"), self.rows)
+        np.save(os.path.join(directory, "lexical.frequencies.npy"), self.frequencies)
+        np.save(os.path.join(directory, "lexical.lengths.npy"), self.lengths)
+
+
+def load_bm25(directory, batch):
+    """
+    Opens the BM25 postings saved in a snapshot directory (memory-mapped), or returns None if there are none
+    """
+    terms_path = os.path.join(directory, "lexical.terms.json")
+    if not os.path.exists(terms_path):
+        return None
+    with open(terms_path, "r") as f:
+        terms = json.load(f)
+
+    def load(name):
+        return np.load(os.path.join(directory, f"lexical.{name}.npy"), mmap_mode="r")
+
+    return BM25Index(
+        terms,
+        load("offsets"),
+        load("rows"),
+        load("frequencies"),
+        np.asarray(load("lengths")),
+        batch,
+    )
+
+
+def reciprocal_rank_fusion(rankings, limit, k=RRF_K):
+    """
+    Merges ranked lists of hits: each hit scores the sum of 1 / (k + rank) over the lists it appears in
+    (hits are matched by id), and the limit best scoring hits are returned. Their distance is minus that
+    score, as the lists' own distances (e.g. L2 and BM25) cannot be compared.
+    """
+    from nlp.local_index import LocalHit
+
+    scores, hits = {}, {}
+    for ranking in rankings:
+        for rank, hit in enumerate(ranking):
+            scores[hit.id] = scores.get(hit.id, 0.0) + 1.0 / (k + rank + 1)
+            hits.setdefault(hit.id, hit)
+    return [
+        LocalHit(id, -scores[id], hits[id].entity)
+        for id in sorted(scores, key=scores.get, reverse=True)[:limit]
+    ]
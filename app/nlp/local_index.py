@@ -0,0 +1,344 @@
+import logging
+import time
+
+import numpy as np
+
+from nlp.categories import CategoryBuilder
+from nlp.doc_store import DocStore
+from nlp.geo import GridIndex
+from nlp.lexical import BM25Builder
+from nlp.quantization import SCAN_CHUNK
+from nlp.quantization import Int8Quantizer
+from nlp.quantization import quantized_search
+from nlp.quantization import top_k
+
+logging.basicConfig(level=logging.INFO)
+
+
+def _squared_norms(vectors):
+    norms = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), SCAN_CHUNK):
+        chunk = np.asarray(vectors[start : start + SCAN_CHUNK], dtype=np.float32)
+        norms[start : start + SCAN_CHUNK] = np.einsum("ij,ij->i", chunk, chunk)
+    return norms
+
+
+def l2_distances(queries, vectors, norms):
+    """
+    Squared L2 distances between every query and every vector, the same distance Milvus reports for metric_type L2
+    """
+    return (
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        - 2 * queries @ vectors.T
+        + norms[None, :]
+    )
+
+
+def kmeans(vectors, k, iterations=10, sample_size=None, seed=0):
+    """
+    Lloyd's k-means on (a sample of) the vectors, returning k float32 centroids
+    """
+    rng = np.random.default_rng(seed)
+    sample_size = sample_size or 256 * k
+    if len(vectors) > sample_size:
+        vectors = vectors[np.sort(rng.choice(len(vectors), sample_size, replace=False))]
+    vectors = np.asarray(vectors, dtype=np.float32)
+    centroids = vectors[rng.choice(len(vectors), k, replace=False)].copy()
+    for i in range(iterations):
+        assignment = np.argmin(
+            l2_distances(vectors, centroids, _squared_norms(centroids)), axis=1
+        )
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        counts = np.bincount(assignment, minlength=k)
+        # empty clusters keep their previous centroid
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class BruteForceIndex:
+    """
+    Exact search: one vectorized distance computation against the whole float32 matrix
+    """
+
+    index_type = "FLAT"
+
+    def __init__(self, vectors, norms=None):
+        self.vectors = vectors
+        self.norms = _squared_norms(vectors) if norms is None else norms
+
+    def search(self, queries, limit, params=None):
+        return top_k(l2_distances(queries, self.vectors, self.norms), limit)
+
+
+class IVFIndex:
+    """
+    Inverted file index: vectors are clustered around nlist k-means centroids and stored contiguously per
+    cluster, and a query only scans the nprobe clusters whose centroids are closest to it.
+
+    With a quantizer (IVF_SQ8) only the quantized codes are kept and scanned instead of the float32 vectors.
+    """
+
+    def __init__(self, vectors, nlist=128, nprobe=10, quantizer=None):
+        start = time.time()
+        vectors = np.asarray(vectors, dtype=np.float32)
+        self.nlist = max(1, min(nlist, len(vectors)))
+        self.nprobe = nprobe
+        self.centroids = kmeans(vectors, self.nlist)
+        self.centroid_norms = _squared_norms(self.centroids)
+        assignment = np.empty(len(vectors), dtype=np.int64)
+        for chunk_start in range(0, len(vectors), SCAN_CHUNK):
+            chunk = vectors[chunk_start : chunk_start + SCAN_CHUNK]
+            assignment[chunk_start : chunk_start + SCAN_CHUNK] = np.argmin(
+                l2_distances(chunk, self.centroids, self.centroid_norms), axis=1
+            )
+        # rows sorted by cluster; cluster c owns rows order[list_offsets[c]:list_offsets[c + 1]]
+        self.order = np.argsort(assignment, kind="stable")
+        self.list_offsets = np.zeros(self.nlist + 1, dtype=np.int64)
+        np.cumsum(
+            np.bincount(assignment, minlength=self.nlist), out=self.list_offsets[1:]
+        )
+        self.quantizer = quantizer
+        if quantizer is None:
+            self.index_type = "IVF_FLAT"
+            self.vectors = np.ascontiguousarray(vectors[self.order])
+            self.norms = _squared_norms(self.vectors)
+        else:
+            self.index_type = "IVF_SQ8"
+            self.codes = quantizer.fit(vectors).encode(vectors[self.order])
+        logging.info(
+            f"Built {self.index_type} index with {self.nlist} lists over {len(vectors)} vectors in {time.time() - start:.2f} seconds"
+        )
+
+    def search(self, queries, limit, params=None):
+        nprobe = min((params or {}).get("nprobe", self.nprobe), self.nlist)
+        probes, _ = top_k(
+            l2_distances(queries, self.centroids, self.centroid_norms), nprobe
+        )
+        rows, distances = [], []
+        for query, query_probes in zip(queries, probes):
+            candidates = np.concatenate(
+                [
+                    np.arange(self.list_offsets[probe], self.list_offsets[probe + 1])
+                    for probe in query_probes
+                ]
+            )
+            if self.quantizer is None:
+                candidate_distances = l2_distances(
+                    query[None, :], self.vectors[candidates], self.norms[candidates]
+                )
+            else:
+                candidate_distances = self.quantizer.distances(
+                    self.codes[candidates], query[None, :]
+                )
+            query_rows, query_distances = top_k(candidate_distances, limit)
+            rows.append(self.order[candidates[query_rows[0]]])
+            distances.append(query_distances[0])
+        return rows, distances
+
+
+class QuantizedIndex:
+    """
+    Scans quantized codes and rescores the best candidates against the full precision vectors
+    """
+
+    def __init__(self, quantizer, codes, vectors, oversample=4):
+        self.index_type = f"FLAT_{quantizer.name.upper()}"
+        self.quantizer = quantizer
+        self.codes = codes
+        self.vectors = vectors
+        self.oversample = oversample
+
+    def search(self, queries, limit, params=None):
+        return quantized_search(
+            self.quantizer, self.codes, self.vectors, queries, limit, self.oversample
+        )
+
+
+class LocalHit:
+    """
+    Mimics a pymilvus Hit, so VectorDB can consume results that did not come from Milvus
+    """
+
+    def __init__(self, id, distance, entity):
+        self.id = id
+        self.distance = distance
+        self.entity = entity
+
+    def __str__(self):
+        return f"id: {self.id}, distance: {self.distance}, entity: {self.entity}"
+
+
+def batch_hits(batch, rows, distances, output_fields):
+    """
+    LocalHits for the given rows of a PoiBatch
+    """
+    return [
+        LocalHit(
+            batch["mbx_id"][row],
+            float(distance),
+            {field: batch[field][row] for field in output_fields},
+        )
+        for row, distance in zip(rows, distances)
+    ]
+
+
+class LocalCollection:
+    """
+    In-process stand-in for a pymilvus Collection over an embedded PoiBatch.
+
+    search(), load(), create_index(), has_index() and num_entities behave like their Collection
+    counterparts, so VectorDB can use either without knowing which one it holds. Searches are exact
+    until an IVF_FLAT index is created.
+
+    search() also takes a nlp.geo.GeoFilter and a nlp.categories.CategoryFilter: the grid index and the
+    category bitmaps then narrow the rows down to the ones passing both, and only those are scored, exactly.
+    """
+
+    def __init__(self, name, batch, norms=None):
+        self.name = name
+        # what its index config is saved under (see nlp.index_tuning); Milvus partitions share their collection's
+        self.index_name = name
+        self.batch = batch
+        self.index = BruteForceIndex(batch.embedding, norms)
+        self._grid = None
+        self._lexical = None
+        self._categories = None
+        self._doc_store = None
+
+    @property
+    def num_entities(self):
+        return len(self.batch)
+
+    def load(self):
+        # the data is always in memory; this only mirrors Collection.load
+        return None
+
+    def release(self):
+        # mirrors Collection.release; the arrays are freed once VectorDB forgets the evicted collection
+        return None
+
+    def memory_size(self):
+        """
+        Bytes of vector data held in process memory; memory-mapped snapshot pages are left to the page cache
+        """
+        arrays = {
+            id(array): array
+            for array in (
+                self.batch.embedding,
+                getattr(self.index, "vectors", None),
+                getattr(self.index, "codes", None),
+            )
+            if array is not None and not isinstance(array, np.memmap)
+        }
+        return sum(array.nbytes for array in arrays.values())
+
+    def has_index(self):
+        return self.index.index_type != "FLAT"
+
+    def create_index(self, field_name, index_params):
+        params = index_params.get("params", {})
+        if index_params["index_type"] == "IVF_FLAT":
+            self.index = IVFIndex(self.batch.embedding, nlist=params.get("nlist", 128))
+        elif index_params["index_type"] == "IVF_SQ8":
+            self.index = IVFIndex(
+                self.batch.embedding,
+                nlist=params.get("nlist", 128),
+                quantizer=Int8Quantizer(),
+            )
+        elif index_params["index_type"] == "FLAT":
+            self.index = BruteForceIndex(self.batch.embedding)
+        else:
+            raise ValueError(
+                f"Local collections support FLAT, IVF_FLAT and IVF_SQ8 indexes, not {index_params['index_type']}"
+            )
+
+    def drop_index(self):
+        self.index = BruteForceIndex(self.batch.embedding)
+
+    def spatial_index(self):
+        """
+        The GridIndex over the POI coordinates, built on first use
+        """
+        if self._grid is None:
+            self._grid = GridIndex(self.batch["latitude"], self.batch["longitude"])
+        return self._grid
+
+    def lexical_index(self):
+        """
+        The nlp.lexical.BM25Index over the POI texts, built on first use
+        """
+        if self._lexical is None:
+            builder = BM25Builder()
+            builder.add(self.batch)
+            self._lexical = builder.build(self.batch)
+        return self._lexical
+
+    def category_index(self):
+        """
+        The nlp.categories.CategoryIndex over the POI category tokens, built on first use
+        """
+        if self._categories is None:
+            builder = CategoryBuilder()
+            builder.add(self.batch)
+            self._categories = builder.build()
+        return self._categories
+
+    def doc_store(self):
+        """
+        The nlp.doc_store.DocStore of the POIs, to hydrate hits by id, built on first use
+        """
+        if self._doc_store is None:
+            self._doc_store = DocStore(self.batch)
+        return self._doc_store
+
+    def allowed_rows(self, geo=None, categories=None):
+        """
+        Sorted row numbers passing the geo and category filters, or None when there are no filters
+        """
+        rows = None
+        if categories is not None:
+            rows = self.category_index().matching(categories).to_rows()
+        if geo is not None:
+            candidates = self.spatial_index().candidates(geo)
+            rows = (
+                candidates
+                if rows is None
+                else np.intersect1d(rows, candidates, assume_unique=True)
+            )
+        return rows
+
+    def _search_rows(self, queries, limit, rows):
+        vectors = np.asarray(self.batch.embedding[rows], dtype=np.float32)
+        found, distances = top_k(
+            l2_distances(queries, vectors, _squared_norms(vectors)), limit
+        )
+        return rows[found], distances
+
+    def hits(self, rows, distances, output_fields):
+        return batch_hits(self.batch, rows, distances, output_fields)
+
+    def search(
+        self,
+        data,
+        anns_field,
+        param,
+        limit,
+        output_fields=None,
+        geo=None,
+        categories=None,
+        **kwargs,
+    ):
+        queries = np.asarray(data, dtype=np.float32).reshape(
+            -1, self.batch.embedding.shape[1]
+        )
+        allowed = self.allowed_rows(geo, categories)
+        if allowed is not None:
+            rows, distances = self._search_rows(queries, limit, allowed)
+        else:
+            rows, distances = self.index.search(queries, limit, param.get("params"))
+        return [
+            self.hits(query_rows, query_distances, output_fields or [])
+            for query_rows, query_distances in zip(rows, distances)
+        ]
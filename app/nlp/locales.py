@@ -0,0 +1,60 @@
+import json
+import logging
+import os
+import re
+
+logging.basicConfig(level=logging.INFO)
+
+# every *.json file in this directory is a locale's POI data
+DATA_DIR = os.environ.get("VECTOR_DB_DATA_DIR", "data")
+# optional file in DATA_DIR naming locales: data file name -> {"location", "name", "description", "fmt"}
+LOCALES_FILE = "locales.json"
+
+
+def _locale_id(filename):
+    """
+    Default partition name of a data file: its stem, lowercased, without "_with_details"
+    """
+    stem = os.path.splitext(filename)[0].lower().replace("_with_details", "")
+    return re.sub(r"[^a-z0-9_]", "_", stem)
+
+
+def discover_locales(data_dir=DATA_DIR):
+    """
+    The locale registry: location shown in the client -> {"name", "filepath", "description", "fmt"} for
+    every data file found in data_dir.
+
+    name is the locale's partition (and snapshot) name. Locales listed in LOCALES_FILE take their location,
+    name, description and format from it; others are named after their file, and their format is detected
+    from their first record.
+    """
+    overrides = {}
+    overrides_path = os.path.join(data_dir, LOCALES_FILE)
+    if os.path.exists(overrides_path):
+        with open(overrides_path, "r") as f:
+            overrides = json.load(f)
+
+    locales = {}
+    if not os.path.isdir(data_dir):
+        logging.warning(f"No data directory {data_dir}, no locales to search")
+        return locales
+    for filename in sorted(os.listdir(data_dir)):
+        if not filename.endswith(".json") or filename == LOCALES_FILE:
+            continue
+        name = _locale_id(filename)
+        spec = {
+            "location": name.replace("_", " ").title(),
+            "name": name,
+            "description": f"{name} POIs",
+            "fmt": None,
+            **overrides.get(filename, {}),
+        }
+        location = spec.pop("location")
+        if location in locales:
+            logging.warning(
+                f"Ignoring {filename}: location {location} is already served by {locales[location]['filepath']}"
+            )
+            continue
+        locales[location] = {**spec, "filepath": os.path.join(data_dir, filename)}
+    logging.info(f"Discovered locales: {list(locales)}")
+    return locales
@@ -0,0 +1,131 @@
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+from collections import deque
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+# recent items (queue wait) and batches (size, latency) the statistics are computed over
+STATS_WINDOW = 1000
+
+
+class MicroBatcher:
+    """
+    Worker thread serving work queued from any number of threads in micro-batches: it takes the first queued
+    item, waits up to max_wait_ms for more (up to max_batch units in all, each item counting for its size),
+    and hands them to process_batch in one call. Items are taken by priority (lower first), then in the
+    order they were queued.
+
+    Subclasses implement process_batch(items), which resolves the futures the items carry, and
+    fail_batch(items, error), called when process_batch raises. unit names what sizes count in stats().
+    """
+
+    def __init__(self, max_batch, max_wait_ms, name, unit="requests"):
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self.name = name
+        self.unit = unit
+        self._sequence = itertools.count()
+        self._start_fresh()
+        # forked processes (e.g. nlp.parallel_ingest workers) get their own queue and worker thread
+        os.register_at_fork(after_in_child=self._start_fresh)
+        self._queue_waits = deque(maxlen=STATS_WINDOW)
+        self._batch_sizes = deque(maxlen=STATS_WINDOW)
+        self._batch_times = deque(maxlen=STATS_WINDOW)
+        self.units = 0
+        self.batches = 0
+        self.busy_time = 0.0
+
+    def _start_fresh(self):
+        # (priority, sequence number, queued at, size, item)
+        self._queue = queue.PriorityQueue()
+        self._worker = None
+        self._lock = threading.Lock()
+
+    def put(self, item, size=1, priority=0):
+        with self._lock:
+            if self._worker is None:
+                self._worker = threading.Thread(
+                    target=self._run, name=self.name, daemon=True
+                )
+                self._worker.start()
+        self._queue.put((priority, next(self._sequence), time.monotonic(), size, item))
+
+    def _next_batch(self):
+        entries = [self._queue.get()]
+        size = entries[0][3]
+        deadline = time.monotonic() + self.max_wait
+        while size < self.max_batch:
+            remaining = deadline - time.monotonic()
+            try:
+                entry = (
+                    self._queue.get(timeout=remaining)
+                    if remaining > 0
+                    else self._queue.get_nowait()
+                )
+            except queue.Empty:
+                break
+            entries.append(entry)
+            size += entry[3]
+        return entries
+
+    def _run(self):
+        while True:
+            entries = self._next_batch()
+            start = time.monotonic()
+            items = [entry[4] for entry in entries]
+            try:
+                self.process_batch(items)
+            except Exception as e:
+                logging.exception(f"{self.name} batch failed")
+                self.fail_batch(items, e)
+                continue
+            size = sum(entry[3] for entry in entries)
+            now = time.monotonic()
+            with self._lock:
+                self._queue_waits.extend(start - entry[2] for entry in entries)
+                self._batch_sizes.append(size)
+                self._batch_times.append(now - start)
+                self.units += size
+                self.batches += 1
+                self.busy_time += now - start
+
+    def process_batch(self, items):
+        raise NotImplementedError
+
+    def fail_batch(self, items, error):
+        raise NotImplementedError
+
+    def stats(self):
+        """
+        Queue wait (milliseconds), batch size and fill (share of max_batch), batch latency and throughput
+        (units per second of processing) over the last STATS_WINDOW items and batches
+        """
+        with self._lock:
+            waits = np.array(self._queue_waits) * 1000
+            sizes = np.array(self._batch_sizes)
+            times = np.array(self._batch_times) * 1000
+            return {
+                self.unit: self.units,
+                "batches": self.batches,
+                "queued": self._queue.qsize(),
+                "queue_wait_ms_p50": (
+                    float(np.percentile(waits, 50)) if len(waits) else None
+                ),
+                "queue_wait_ms_p95": (
+                    float(np.percentile(waits, 95)) if len(waits) else None
+                ),
+                "batch_size_mean": float(sizes.mean()) if len(sizes) else None,
+                "batch_fill": (
+                    float(sizes.mean() / self.max_batch) if len(sizes) else None
+                ),
+                "batch_ms_p50": float(np.percentile(times, 50)) if len(times) else None,
+                f"{self.unit}_per_second": (
+                    self.units / self.busy_time if self.busy_time else None
+                ),
+            }
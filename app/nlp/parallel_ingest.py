@@ -0,0 +1,124 @@
+import logging
+import multiprocessing
+import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from utils import DEFAULT_BATCH_SIZE
+from utils import get_embedding_cache
+from utils import get_embedding_model
+from utils import embed_batch
+from utils import encoding_contexts
+from nlp.poi_formats import PoiBatch
+from nlp.poi_formats import PoiBatchBuilder
+from nlp.poi_formats import get_format
+from nlp.poi_formats import resolve_format
+
+logging.basicConfig(level=logging.INFO)
+
+# each task parses and embeds roughly this many bytes of the input file
+CHUNK_BYTES = 1 << 20
+# how worker processes are started. Not fork: the parent has threads (model warm-up, collection loading, the
+# embedding service) whose locks, if held at fork time, would stay held forever in the children
+START_METHOD = "spawn"
+
+
+def shard_byte_ranges(filepath, n_shards):
+    """
+    Splits a file into at most n_shards contiguous (start, end) byte ranges that begin on line boundaries
+    """
+    size = os.path.getsize(filepath)
+    boundaries = [0]
+    with open(filepath, "rb") as f:
+        for i in range(1, n_shards):
+            target = size * i // n_shards
+            if target <= boundaries[-1]:
+                continue
+            # finish the line containing the byte before target, so the shard starts on a fresh line
+            f.seek(target - 1)
+            f.readline()
+            if f.tell() >= size:
+                break
+            if f.tell() > boundaries[-1]:
+                boundaries.append(f.tell())
+    boundaries.append(size)
+    return list(zip(boundaries[:-1], boundaries[1:]))
+
+
+def _init_worker(threads):
+    import torch
+
+    torch.set_num_threads(threads)
+    # load the encoder once per worker, before its first task
+    get_embedding_model()
+
+
+def _ingest_range(filepath, start, end, fmt):
+    """
+    Parses each line of a byte range once into a PoiBatch and embeds it in this worker process.
+    The parent owns the embedding cache, so the worker only reads from it.
+    """
+    poi_format = get_format(fmt)
+    with open(filepath, "rb") as f:
+        f.seek(start)
+        lines = f.read(end - start).splitlines()
+    builder = PoiBatchBuilder()
+    for line in lines:
+        if line.strip():
+            builder.append(poi_format.parse_line(line))
+    return embed_batch(builder.build(), update_cache=False)
+
+
+def iter_parallel_embedded_batches(
+    filepath, batch_size=DEFAULT_BATCH_SIZE, duplication=1, fmt=None, workers=None
+):
+    """
+    Same output as utils.iter_embedded_batches, but parsing and encoding are spread over a pool of worker processes.
+
+    The file is sharded by byte range, each line is parsed and embedded exactly once (duplicates are copied
+    afterwards), and batches come back in file order. At most 2 * workers shards are in flight at a time.
+    """
+    workers = workers or os.cpu_count()
+    fmt = resolve_format(filepath, fmt).name
+    n_shards = max(workers, os.path.getsize(filepath) // CHUNK_BYTES + 1)
+    shards = iter(shard_byte_ranges(filepath, n_shards))
+    threads = max(1, os.cpu_count() // workers)
+    cache = get_embedding_cache()
+    logging.info(
+        f"Ingesting {filepath} with {workers} workers, {threads} torch threads each"
+    )
+
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(START_METHOD),
+        initializer=_init_worker,
+        initargs=(threads,),
+    ) as executor:
+        pending = deque()
+
+        def submit_next():
+            shard = next(shards, None)
+            if shard is not None:
+                pending.append(executor.submit(_ingest_range, filepath, *shard, fmt))
+
+        for _ in range(2 * workers):
+            submit_next()
+
+        # starts as None rather than an empty PoiBatch, which has no embedding and would drop those of the
+        # batches concatenated to it
+        buffered = None
+        while pending:
+            batch = pending.popleft().result()
+            submit_next()
+            if cache is not None and len(batch):
+                cache.add(encoding_contexts(batch), batch.embedding)
+            if duplication > 1:
+                batch = batch.take(np.repeat(np.arange(len(batch)), duplication))
+            buffered = batch if buffered is None else PoiBatch.concat([buffered, batch])
+            while len(buffered) >= batch_size:
+                yield buffered.slice(0, batch_size)
+                buffered = buffered.slice(batch_size, len(buffered))
+        if buffered is not None and len(buffered):
+            yield buffered
@@ -0,0 +1,72 @@
+from pymilvus import Partition
+
+# 384 float32s per embedding plus roughly a kilobyte of text fields
+ENTITY_SIZE_ESTIMATE = 384 * 4 + 1024
+
+
+class MilvusPartition:
+    """
+    One locale's partition of the shared Milvus POI collection, with the surface of a Collection.
+
+    search() is routed to the partition only, and load()/release() load and release just its segments,
+    so VectorDB and the residency manager handle a partition like any other collection. name is the
+    locale's name; index_name is the collection's, whose vector index all partitions share.
+    """
+
+    def __init__(self, collection, name):
+        self.collection = collection
+        self.name = name
+        self.index_name = collection.name
+        self._handle = None
+
+    def bound_to(self, collection):
+        """
+        The same partition, reached through another Collection object (e.g. on a pooled connection)
+        """
+        return MilvusPartition(collection, self.name)
+
+    def _partition(self):
+        # pymilvus checks (and creates) the partition when a Partition is constructed, so do it once
+        if self._handle is None:
+            self._handle = Partition(self.collection, self.name)
+        return self._handle
+
+    @property
+    def num_entities(self):
+        return self._partition().num_entities
+
+    def memory_size(self):
+        return self.num_entities * ENTITY_SIZE_ESTIMATE
+
+    def load(self):
+        self._partition().load()
+
+    def release(self):
+        self._partition().release()
+
+    def has_index(self):
+        return self.collection.has_index()
+
+    def create_index(self, field_name, index_params):
+        self.collection.create_index(field_name, index_params)
+
+    def drop_index(self):
+        # the index is shared by every partition, and can only be dropped once all of them are released
+        self.collection.release()
+        self.collection.drop_index()
+
+    def search(self, data, anns_field, param, limit, output_fields=None, **kwargs):
+        return self.collection.search(
+            data,
+            anns_field,
+            param,
+            limit=limit,
+            output_fields=output_fields,
+            partition_names=[self.name],
+            **kwargs,
+        )
+
+    def query(self, expr, output_fields=None, **kwargs):
+        return self.collection.query(
+            expr, output_fields=output_fields, partition_names=[self.name], **kwargs
+        )
@@ -0,0 +1,279 @@
+import json
+import logging
+import math
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+POI_FIELDS = [
+    "mbx_id",
+    "latitude",
+    "longitude",
+    "name",
+    "addr_full",
+    "addr_street",
+    "category",
+    "description",
+    # the raw ";"-separated category tokens, for nlp.categories
+    "categories",
+]
+GEO_FIELDS = {"latitude", "longitude"}
+
+POI_FORMATS = {}
+
+
+class StringColumn:
+    """
+    Arrow-style string array: the utf-8 bytes of every value back to back in data, and
+    offsets such that value i is data[offsets[i]:offsets[i + 1]].
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = data
+
+    @classmethod
+    def from_list(cls, values):
+        encoded = [value.encode("utf-8") for value in values]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        np.cumsum([len(value) for value in encoded], out=offsets[1:])
+        return cls(offsets, b"".join(encoded))
+
+    @classmethod
+    def concat(cls, columns):
+        sizes = [int(column.offsets[-1]) for column in columns]
+        shifts = np.cumsum([0] + sizes[:-1])
+        offsets = np.concatenate(
+            [[0]]
+            + [column.offsets[1:] + shift for column, shift in zip(columns, shifts)]
+        ).astype(np.int64)
+        return cls(offsets, b"".join(bytes(column.data) for column in columns))
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, i):
+        return bytes(self.data[self.offsets[i] : self.offsets[i + 1]]).decode("utf-8")
+
+    def take(self, indices):
+        starts = self.offsets[:-1][indices]
+        ends = self.offsets[1:][indices]
+        offsets = np.zeros(len(starts) + 1, dtype=np.int64)
+        np.cumsum(ends - starts, out=offsets[1:])
+        view = memoryview(self.data)
+        return StringColumn(
+            offsets, b"".join(view[start:end] for start, end in zip(starts, ends))
+        )
+
+    def to_list(self):
+        return [self[i] for i in range(len(self))]
+
+
+class PoiBatch:
+    """
+    Columnar batch of POIs with one array per field of POI_FIELDS: a StringColumn for text fields and
+    float64 arrays for latitude/longitude (NaN when unknown). embedding is a float32 matrix once the batch is embedded.
+    """
+
+    def __init__(self, columns, embedding=None):
+        self.columns = columns
+        self.embedding = embedding
+
+    @classmethod
+    def concat(cls, batches):
+        if not batches:
+            return PoiBatchBuilder().build()
+        columns = {}
+        for field in POI_FIELDS:
+            parts = [batch.columns[field] for batch in batches]
+            if field in GEO_FIELDS:
+                columns[field] = np.concatenate(parts)
+            else:
+                columns[field] = StringColumn.concat(parts)
+        embedding = None
+        if all(batch.embedding is not None for batch in batches):
+            embedding = np.concatenate([batch.embedding for batch in batches])
+        return cls(columns, embedding)
+
+    def __len__(self):
+        return len(self.columns["mbx_id"])
+
+    def __getitem__(self, field):
+        if field == "embedding":
+            return self.embedding
+        return self.columns[field]
+
+    def take(self, indices):
+        indices = np.asarray(indices, dtype=np.int64)
+        columns = {
+            field: column[indices] if field in GEO_FIELDS else column.take(indices)
+            for field, column in self.columns.items()
+        }
+        embedding = None if self.embedding is None else self.embedding[indices]
+        return PoiBatch(columns, embedding)
+
+    def slice(self, start, stop):
+        return self.take(np.arange(start, min(stop, len(self))))
+
+    def to_pydict(self, fields=None):
+        """
+        Returns {field: list of values}, e.g. to build a DataFrame
+        """
+        if fields is None:
+            fields = POI_FIELDS + ([] if self.embedding is None else ["embedding"])
+        data = {}
+        for field in fields:
+            column = self[field]
+            if field == "embedding":
+                data[field] = list(column)
+            elif field in GEO_FIELDS:
+                data[field] = column.tolist()
+            else:
+                data[field] = column.to_list()
+        return data
+
+
+class PoiBatchBuilder:
+    """
+    Accumulates parsed POIs as one python list per field, then packs them into a PoiBatch
+    """
+
+    def __init__(self):
+        self._values = [[] for field in POI_FIELDS]
+
+    def __len__(self):
+        return len(self._values[0])
+
+    def append(self, values):
+        for column, value in zip(self._values, values):
+            column.append(value)
+
+    def build(self):
+        columns = {}
+        for field, values in zip(POI_FIELDS, self._values):
+            if field in GEO_FIELDS:
+                columns[field] = np.array(values, dtype=np.float64)
+            else:
+                columns[field] = StringColumn.from_list(values)
+        return PoiBatch(columns)
+
+
+def register_format(cls):
+    """
+    Class decorator that adds a POI format adapter to the registry under its name.
+
+    An adapter has a name, a matches(record) method used to sniff undeclared files, and a
+    parse_line(line) method returning one value per field of POI_FIELDS.
+    """
+    POI_FORMATS[cls.name] = cls()
+    return cls
+
+
+@register_format
+class MapboxPoiFormat:
+    """
+    Mapbox POI sample, one GeoJSON feature per line (the Georgetown DC dataset)
+    """
+
+    name = "mapbox"
+
+    def matches(self, record):
+        return "properties" in record and "geometry" in record
+
+    def parse_line(self, line):
+        feature = json.loads(line)
+        properties = feature["properties"]
+        # GeoJSON coordinates are [longitude, latitude]
+        longitude, latitude = feature["geometry"]["coordinates"][:2]
+        description = ""
+        if "description" in properties:
+            description = properties["tripadvisor"]["description"]
+        return (
+            str(properties["mapbox:id"]),
+            float(latitude),
+            float(longitude),
+            str(properties["name"]),
+            str(properties.get("addr:full", "")),
+            str(properties.get("addr:street", "")),
+            " and ".join(properties["mapbox:search:categories"].split(";")),
+            str(description),
+            str(properties["mapbox:search:categories"]),
+        )
+
+
+@register_format
+class SimplePoiFormat:
+    """
+    Hand curated POIs, one flat json object per line without coordinates or addresses (the Duvall dataset)
+    """
+
+    name = "simple"
+
+    def matches(self, record):
+        return "mbx_id" in record
+
+    def parse_line(self, line):
+        record = json.loads(line)
+        return (
+            str(record["mbx_id"]),
+            math.nan,
+            math.nan,
+            str(record["name"]),
+            "N/A",
+            "N/A",
+            str(record["category"]),
+            str(record["description"]),
+            str(record["category"]),
+        )
+
+
+def get_format(name):
+    if name not in POI_FORMATS:
+        raise ValueError(
+            f"Unknown POI format {name}, expected one of {list(POI_FORMATS)}"
+        )
+    return POI_FORMATS[name]
+
+
+def detect_format(filepath):
+    """
+    Picks the adapter for a data file that did not declare its format, by looking at its first record
+    """
+    with open(filepath, "rb") as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                break
+        else:
+            raise ValueError(f"{filepath} is empty")
+    for poi_format in POI_FORMATS.values():
+        if poi_format.matches(record):
+            logging.info(f"Detected {poi_format.name} POI format for {filepath}")
+            return poi_format
+    raise ValueError(f"Could not detect the POI format of {filepath}")
+
+
+def resolve_format(filepath, fmt=None):
+    return get_format(fmt) if fmt else detect_format(filepath)
+
+
+def iter_poi_batches(filepath, batch_size, duplication=1, fmt=None):
+    """
+    Parses a data file into PoiBatches of at most batch_size rows. Each line is parsed once,
+    and repeated duplication times (used to scale up datasets for benchmarking).
+    """
+    poi_format = resolve_format(filepath, fmt)
+    builder = PoiBatchBuilder()
+    with open(filepath, "rb") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            values = poi_format.parse_line(line)
+            for i in range(duplication):
+                builder.append(values)
+                if len(builder) == batch_size:
+                    yield builder.build()
+                    builder = PoiBatchBuilder()
+    if len(builder):
+        yield builder.build()
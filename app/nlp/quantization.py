@@ -0,0 +1,273 @@
+import logging
+import os
+import sys
+import time
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+# rows decoded at a time while scanning codes, to bound the temporary float32 copies
+SCAN_CHUNK = 1 << 16
+
+_POPCOUNT = np.array([bin(i).count("1") for i in range(256)], dtype=np.uint8)
+
+
+def _chunks(n_rows):
+    for start in range(0, n_rows, SCAN_CHUNK):
+        yield start, min(start + SCAN_CHUNK, n_rows)
+
+
+class Float16Quantizer:
+    """
+    Stores each component as a half precision float: half the memory, almost no loss
+    """
+
+    name = "float16"
+
+    def fit(self, vectors):
+        return self
+
+    def encode(self, vectors):
+        return np.asarray(vectors, dtype=np.float16)
+
+    def distances(self, codes, queries):
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        query_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+        for start, stop in _chunks(len(codes)):
+            chunk = codes[start:stop].astype(np.float32)
+            out[:, start:stop] = (
+                query_norms
+                - 2 * queries @ chunk.T
+                + np.einsum("ij,ij->i", chunk, chunk)[None, :]
+            )
+        return out
+
+    def state(self):
+        return {}
+
+    def load_state(self, state):
+        return self
+
+
+class Int8Quantizer:
+    """
+    Scalar quantization to int8 with a per-dimension scale and offset fitted on the data: a quarter of the memory
+    """
+
+    name = "int8"
+
+    def fit(self, vectors):
+        low = np.asarray(vectors.min(axis=0), dtype=np.float32)
+        high = np.asarray(vectors.max(axis=0), dtype=np.float32)
+        self.scale = np.maximum(high - low, 1e-12) / 255.0
+        self.offset = low + 128.0 * self.scale
+        return self
+
+    def encode(self, vectors):
+        codes = np.rint(
+            (np.asarray(vectors, dtype=np.float32) - self.offset) / self.scale
+        )
+        return np.clip(codes, -128, 127).astype(np.int8)
+
+    def decode(self, codes):
+        return codes.astype(np.float32) * self.scale + self.offset
+
+    def distances(self, codes, queries):
+        # ||q - x||^2 with x = codes * scale + offset, without materializing the decoded matrix
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        scaled_queries = queries * self.scale
+        query_terms = (
+            np.einsum("ij,ij->i", queries, queries) - 2 * queries @ self.offset
+        )[:, None]
+        for start, stop in _chunks(len(codes)):
+            decoded = self.decode(codes[start:stop])
+            out[:, start:stop] = (
+                query_terms
+                - 2 * scaled_queries @ codes[start:stop].T.astype(np.float32)
+                + np.einsum("ij,ij->i", decoded, decoded)[None, :]
+            )
+        return out
+
+    def state(self):
+        return {"scale": self.scale, "offset": self.offset}
+
+    def load_state(self, state):
+        self.scale = state["scale"]
+        self.offset = state["offset"]
+        return self
+
+
+class BinaryQuantizer:
+    """
+    One bit per dimension (the sign of the centered component), compared by Hamming distance.
+    1/32 of the memory; only good enough to shortlist candidates for a full precision rescore.
+    """
+
+    name = "binary"
+
+    def fit(self, vectors):
+        self.mean = np.asarray(vectors.mean(axis=0), dtype=np.float32)
+        return self
+
+    def encode(self, vectors):
+        return np.packbits(np.asarray(vectors) > self.mean, axis=1)
+
+    def distances(self, codes, queries):
+        query_codes = self.encode(queries)
+        out = np.empty((len(queries), len(codes)), dtype=np.float32)
+        for start, stop in _chunks(len(codes)):
+            chunk = codes[start:stop]
+            for i, query_code in enumerate(query_codes):
+                out[i, start:stop] = _POPCOUNT[chunk ^ query_code].sum(axis=1)
+        return out
+
+    def state(self):
+        return {"mean": self.mean}
+
+    def load_state(self, state):
+        self.mean = state["mean"]
+        return self
+
+
+QUANTIZERS = {
+    quantizer.name: quantizer
+    for quantizer in (Float16Quantizer, Int8Quantizer, BinaryQuantizer)
+}
+
+
+def get_quantizer(name):
+    if name not in QUANTIZERS:
+        raise ValueError(
+            f"Unknown quantization {name}, expected one of {list(QUANTIZERS)}"
+        )
+    return QUANTIZERS[name]()
+
+
+def top_k(distances, k):
+    """
+    Returns the (indices, distances) of the k smallest distances in each row, sorted ascending
+    """
+    k = min(k, distances.shape[1])
+    if k == 0:
+        empty = np.zeros((len(distances), 0))
+        return empty.astype(np.int64), empty
+    candidates = np.argpartition(distances, k - 1, axis=1)[:, :k]
+    candidate_distances = np.take_along_axis(distances, candidates, axis=1)
+    order = np.argsort(candidate_distances, axis=1)
+    return (
+        np.take_along_axis(candidates, order, axis=1),
+        np.take_along_axis(candidate_distances, order, axis=1),
+    )
+
+
+def quantized_search(quantizer, codes, vectors, queries, limit, oversample=4):
+    """
+    Scans the quantized codes for limit * oversample candidates per query, then rescores only those
+    candidates against the full precision vectors. vectors is typically a memmap, so only the candidate
+    rows are ever paged in.
+    """
+    queries = np.asarray(queries, dtype=np.float32)
+    candidates, _ = top_k(quantizer.distances(codes, queries), limit * oversample)
+    rows, distances = [], []
+    for query, query_candidates in zip(queries, candidates):
+        # sorted row numbers read the memmap front to back
+        query_candidates = np.sort(query_candidates)
+        difference = np.asarray(vectors[query_candidates]) - query
+        exact = np.einsum("ij,ij->i", difference, difference)
+        order = np.argsort(exact)[:limit]
+        rows.append(query_candidates[order])
+        distances.append(exact[order])
+    return rows, distances
+
+
+def exact_search(vectors, queries, limit):
+    queries = np.asarray(queries, dtype=np.float32)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    distances = (
+        np.einsum("ij,ij->i", queries, queries)[:, None]
+        - 2 * queries @ vectors.T
+        + np.einsum("ij,ij->i", vectors, vectors)[None, :]
+    )
+    return top_k(distances, limit)
+
+
+def recall_at_k(found, expected):
+    return float(
+        np.mean(
+            [
+                len(set(np.asarray(f).tolist()) & set(np.asarray(e).tolist()))
+                / max(len(e), 1)
+                for f, e in zip(found, expected)
+            ]
+        )
+    )
+
+
+def benchmark_quantization(vectors, n_queries=100, k=10, oversample=4, seed=0):
+    """
+    Reports, for each quantizer, the memory saved against float32 and the recall@k lost against exact search,
+    both from the quantized scan alone and after the full precision rescore.
+
+    Queries are randomly chosen rows with a little gaussian noise added.
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    rng = np.random.default_rng(seed)
+    queries = vectors[
+        rng.choice(len(vectors), min(n_queries, len(vectors)), replace=False)
+    ]
+    queries = queries + rng.normal(
+        scale=queries.std() * 0.1, size=queries.shape
+    ).astype(np.float32)
+    expected, _ = exact_search(vectors, queries, k)
+
+    report = []
+    for name in QUANTIZERS:
+        quantizer = get_quantizer(name).fit(vectors)
+        codes = quantizer.encode(vectors)
+        start = time.time()
+        scanned, _ = top_k(quantizer.distances(codes, queries), k)
+        scan_time = time.time() - start
+        start = time.time()
+        rescored, _ = quantized_search(
+            quantizer, codes, vectors, queries, k, oversample
+        )
+        rescore_time = time.time() - start
+        row = {
+            "quantization": name,
+            "bytes": codes.nbytes,
+            "memory_saved": 1 - codes.nbytes / vectors.nbytes,
+            f"recall@{k}": recall_at_k(scanned, expected),
+            f"recall@{k}_rescored": recall_at_k(rescored, expected),
+            "scan_ms_per_query": scan_time * 1000 / len(queries),
+            "rescored_ms_per_query": rescore_time * 1000 / len(queries),
+        }
+        logging.info(f"BENCHMARKING QUANTIZATION: {row}")
+        report.append(row)
+    return report
+
+
+def save_quantized(directory, quantizer, codes):
+    np.save(os.path.join(directory, f"embedding.{quantizer.name}.npy"), codes)
+    np.savez(
+        os.path.join(directory, f"quantizer.{quantizer.name}.npz"), **quantizer.state()
+    )
+
+
+def load_quantized(directory, name):
+    """
+    Returns (quantizer, memory-mapped codes) from a snapshot directory, or None if it was built without them
+    """
+    codes_path = os.path.join(directory, f"embedding.{name}.npy")
+    if not os.path.exists(codes_path):
+        return None
+    with np.load(os.path.join(directory, f"quantizer.{name}.npz")) as state:
+        quantizer = get_quantizer(name).load_state(dict(state))
+    return quantizer, np.load(codes_path, mmap_mode="r")
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=app python app/nlp/quantization.py <snapshot directory>
+    from nlp.snapshot import PoiSnapshot
+
+    benchmark_quantization(PoiSnapshot(sys.argv[1]).batch.embedding)
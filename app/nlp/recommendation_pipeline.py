@@ -0,0 +1,91 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from nlp.classifiers import is_recommendation_request
+from utils import PROMPT_FIELDS
+
+logging.basicConfig(level=logging.INFO)
+
+# "1" starts retrieving recommendations while the message is still being classified, "0" only retrieves
+# once the classifier has said the message is a recommendation request
+SPECULATIVE_RETRIEVAL = os.environ.get("SPECULATIVE_RETRIEVAL", "1") == "1"
+
+
+class RecommendationPipeline:
+    """
+    Classifies a chat message and retrieves recommendations for it concurrently, so a recommendation turn
+    takes max(classify, retrieve) instead of their sum.
+
+    Retrieval (loading the location, searching, hydrating the prompt fields) runs speculatively on a
+    worker thread. When the classifier says the message is not a recommendation request, retrieval is
+    cancelled if it has not started, and otherwise stops at its next stage and its result is dropped.
+
+    When the message is the query, it is embedded once, up front: the classifier gets that embedding and
+    the search finds it in the VectorDB query embedding cache.
+    """
+
+    def __init__(
+        self,
+        vector_db,
+        classify=is_recommendation_request,
+        fields=PROMPT_FIELDS,
+        speculative=SPECULATIVE_RETRIEVAL,
+        workers=2,
+    ):
+        self.vector_db = vector_db
+        self.classify = classify
+        self.fields = fields
+        self.speculative = speculative
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="speculative-retrieval"
+        )
+        self.stats = {"retrieved": 0, "cancelled": 0, "discarded": 0}
+
+    def _retrieve(self, location, query, cancelled):
+        self.vector_db.set_idx_by_location(location)
+        if cancelled.is_set():
+            return None
+        results = self.vector_db.search(collection=location, query=query)
+        if cancelled.is_set():
+            return None
+        return self.vector_db.hydrate(location, results[0], self.fields)
+
+    def recommendations(self, message, location, query=None):
+        """
+        Returns the documents (with the pipeline's fields) of the POIs found for query (by default the
+        message itself) in location, or None when message is not a recommendation request
+        """
+        start = time.time()
+        query = message if query is None else query
+        embedding = self.vector_db.embed_query(query) if query == message else None
+        if not self.speculative:
+            if not self.classify(message, embedding=embedding):
+                return None
+            self.stats["retrieved"] += 1
+            return self._retrieve(location, query, threading.Event())
+
+        cancelled = threading.Event()
+        retrieval = self._executor.submit(self._retrieve, location, query, cancelled)
+        try:
+            is_request = self.classify(message, embedding=embedding)
+        except Exception:
+            cancelled.set()
+            retrieval.cancel()
+            raise
+        classified = time.time()
+        if not is_request:
+            cancelled.set()
+            self.stats["cancelled" if retrieval.cancel() else "discarded"] += 1
+            logging.info(
+                f"\tClassified in {classified - start:.3f} seconds, speculative retrieval dropped"
+            )
+            return None
+        documents = retrieval.result()
+        self.stats["retrieved"] += 1
+        logging.info(
+            f"\tClassified in {classified - start:.3f} seconds, recommendations ready after {time.time() - start:.3f} seconds"
+        )
+        return documents
@@ -0,0 +1,137 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError
+
+import numpy as np
+
+logging.basicConfig(level=logging.INFO)
+
+RERANK_MODEL_NAME = os.environ.get(
+    "VECTOR_DB_RERANK_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2"
+)
+# candidates fetched from the vector (and lexical) search and scored by the cross-encoder
+RERANK_CANDIDATES = int(os.environ.get("VECTOR_DB_RERANK_CANDIDATES", "30"))
+# milliseconds a search may spend reranking before falling back to the vector order
+RERANK_BUDGET_MS = float(os.environ.get("VECTOR_DB_RERANK_BUDGET_MS", "250"))
+# share of relevance (vs. novelty) in maximal marginal relevance; 1 disables the de-duplication
+MMR_LAMBDA = float(os.environ.get("VECTOR_DB_MMR_LAMBDA", "0.7"))
+
+_cross_encoder = None
+_cross_encoder_lock = threading.Lock()
+
+
+def get_cross_encoder():
+    """
+    Returns the cross-encoder, loading it on the first call
+    """
+    global _cross_encoder
+    with _cross_encoder_lock:
+        if _cross_encoder is None:
+            import sentence_transformers
+
+            _cross_encoder = sentence_transformers.CrossEncoder(RERANK_MODEL_NAME)
+        return _cross_encoder
+
+
+# document fields hit_context reads, hydrated by VectorDB before reranking
+CONTEXT_FIELDS = ["name", "category"]
+
+
+def hit_context(document):
+    """
+    The text of a hit the cross-encoder reads next to the query, from its hydrated document
+    """
+    if document is None:
+        return ""
+    name = document["name"]
+    category = document["category"].replace(";", ", ")
+    return f"{name} ({category})" if category else name
+
+
+def mmr(relevance, embeddings, k, diversity_lambda=MMR_LAMBDA):
+    """
+    Greedy maximal marginal relevance: picks k positions, each maximizing diversity_lambda * relevance
+    minus (1 - diversity_lambda) * its highest cosine similarity to the positions already picked.
+    relevance is expected in [0, 1].
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+    normalized = embeddings / np.maximum(norms, 1e-12)
+    similarity = normalized @ normalized.T
+    # highest similarity of each candidate to the picked ones (none picked yet)
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    picked = []
+    for _ in range(min(k, len(relevance))):
+        scores = diversity_lambda * relevance - (1 - diversity_lambda) * redundancy
+        best = int(np.argmax(np.where(available, scores, -np.inf)))
+        picked.append(best)
+        available[best] = False
+        redundancy = np.maximum(redundancy, similarity[best])
+    return picked
+
+
+class Reranker:
+    """
+    Reorders search candidates by a cross-encoder's (query, POI) relevance, all candidates scored in one
+    batched forward pass, then optionally de-duplicates them with maximal marginal relevance.
+
+    Each call gets a time budget: when scoring has not finished by then (e.g. while the model is still
+    loading, or the scoring thread is busy), the candidates are returned in their original order.
+    """
+
+    def __init__(self, budget_ms=RERANK_BUDGET_MS, mmr_lambda=MMR_LAMBDA):
+        self.budget_ms = budget_ms
+        self.mmr_lambda = mmr_lambda
+        # one scoring thread: the model already uses every core, and a backlog turns into fallbacks
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+        self.stats = {"reranked": 0, "fallbacks": 0}
+
+    def _scores(self, query, contexts):
+        return np.asarray(
+            get_cross_encoder().predict(
+                [(query, context) for context in contexts], batch_size=len(contexts)
+            ),
+            dtype=np.float32,
+        )
+
+    def _order(self, query, contexts, top_k, embeddings):
+        scores = self._scores(query, contexts)
+        if self.mmr_lambda >= 1 or embeddings is None:
+            return np.argsort(-scores, kind="stable")
+        span = scores.max() - scores.min()
+        relevance = (scores - scores.min()) / span if span > 0 else np.ones_like(scores)
+        return mmr(relevance, embeddings(), top_k, self.mmr_lambda)
+
+    def rerank(self, query, hits, documents, top_k, budget_ms=None, embeddings=None):
+        """
+        Returns (the top_k hits, whether they were reranked) within budget_ms milliseconds.
+        documents are the hydrated CONTEXT_FIELDS of the hits, in the same order. embeddings returns the
+        stored vectors of the hits for the MMR step, which is skipped without it; scoring and MMR both
+        run within the budget.
+        """
+        start = time.monotonic()
+        hits = list(hits)
+        if len(hits) <= 1:
+            return hits[:top_k], True
+        contexts = [hit_context(document) for document in documents]
+        future = self._executor.submit(self._order, query, contexts, top_k, embeddings)
+        budget_ms = self.budget_ms if budget_ms is None else budget_ms
+        try:
+            order = future.result(timeout=budget_ms / 1000)
+        except TimeoutError:
+            future.cancel()
+            self.stats["fallbacks"] += 1
+            logging.info("Rerank budget exhausted, keeping the vector order")
+            return hits[:top_k], False
+        self.stats["reranked"] += 1
+        logging.info(
+            f"\tReranked {len(hits)} candidates in {(time.monotonic() - start) * 1000:.1f} ms"
+        )
+        return [hits[i] for i in order[:top_k]], True
+
+    def warm_up(self):
+        get_cross_encoder()
@@ -0,0 +1,147 @@
+import logging
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+
+logging.basicConfig(level=logging.INFO)
+
+
+class ResidencyManager:
+    """
+    Tracks which collections are loaded, and loads each one only once, on a background thread.
+
+    Collections are obtained from open_collection(location), which may be slow (it can build them), so
+    it is only ever called from a loader thread. When the loaded collections take more than memory_budget
+    bytes (as measured by size_of), the least recently used ones are released, and handed to on_evict so the
+    owner can drop its own references to them. Recent requests are kept to predict, and pre-warm, the locations
+    that are likely to be asked for next.
+    """
+
+    def __init__(
+        self,
+        open_collection,
+        memory_budget,
+        size_of,
+        history_size=1000,
+        workers=2,
+        on_evict=None,
+    ):
+        self.open_collection = open_collection
+        self.memory_budget = memory_budget
+        self.size_of = size_of
+        self.on_evict = on_evict
+        # location -> Future of its load, least recently used first
+        self._resident = OrderedDict()
+        self._sizes = {}
+        self._history = deque(maxlen=history_size)
+        self._lock = threading.RLock()
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="collection-loader"
+        )
+
+    def ensure_loaded(self, location, record=True):
+        """
+        Returns a Future that resolves to the collection once it is loaded, starting the load if needed
+        """
+        with self._lock:
+            if record:
+                self._history.append(location)
+            future = self._resident.get(location)
+            if future is None:
+                future = self._executor.submit(self._load, location)
+                self._resident[location] = future
+            self._resident.move_to_end(location)
+            return future
+
+    def wait(self, location, timeout=None):
+        return self.ensure_loaded(location).result(timeout)
+
+    def is_resident(self, location):
+        with self._lock:
+            future = self._resident.get(location)
+            return future is not None and future.done() and future.exception() is None
+
+    def _load(self, location):
+        start = time.time()
+        try:
+            collection = self.open_collection(location)
+            collection.load()
+        except Exception:
+            with self._lock:
+                self._resident.pop(location, None)
+            raise
+        size = self.size_of(collection)
+        with self._lock:
+            self._sizes[location] = size
+        logging.info(
+            f"Loaded {location} ({size / 2**20:.1f} MB) in {time.time() - start:.2f} seconds"
+        )
+        self._evict(keep=location)
+        return collection
+
+    def resident_bytes(self):
+        with self._lock:
+            return sum(
+                self._sizes.get(location, 0)
+                for location, future in self._resident.items()
+                if future.done()
+            )
+
+    def _evict(self, keep):
+        with self._lock:
+            # keep is still loading (this runs at the end of its load), but its size is known
+            total = sum(self._sizes.get(location, 0) for location in self._resident)
+            for location in list(self._resident):
+                if total <= self.memory_budget:
+                    break
+                if location == keep or not self._resident[location].done():
+                    continue
+                logging.info(f"Releasing {location} to stay under the memory budget")
+                collection = self._resident[location].result()
+                collection.release()
+                del self._resident[location]
+                total -= self._sizes.get(location, 0)
+                if self.on_evict is not None:
+                    self.on_evict(location, collection)
+
+    def predicted_locations(self, n, decay=0.98):
+        """
+        Ranks locations by recency-weighted request counts: each past request counts decay ** age
+        """
+        with self._lock:
+            history = list(self._history)
+        scores = {}
+        for age, location in enumerate(reversed(history)):
+            scores[location] = scores.get(location, 0.0) + decay**age
+        return sorted(scores, key=scores.get, reverse=True)[:n]
+
+    def prewarm(self, n=2, headroom=0.8):
+        """
+        Starts loading the n most likely next locations, as long as loaded collections use less than
+        headroom of the memory budget, so that pre-warming never evicts something in use
+        """
+        for location in self.predicted_locations(n):
+            if self.resident_bytes() >= headroom * self.memory_budget:
+                break
+            with self._lock:
+                if location not in self._resident:
+                    logging.info(f"Pre-warming {location}")
+                    self.ensure_loaded(location, record=False)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "resident": [
+                    location
+                    for location, future in self._resident.items()
+                    if future.done()
+                ],
+                "loading": [
+                    location
+                    for location, future in self._resident.items()
+                    if not future.done()
+                ],
+                "resident_bytes": self.resident_bytes(),
+                "memory_budget": self.memory_budget,
+            }
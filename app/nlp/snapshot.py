@@ -0,0 +1,245 @@
+import json
+import logging
+import os
+import shutil
+import sys
+import time
+
+import numpy as np
+
+from utils import DEFAULT_BATCH_SIZE
+from utils import EMBEDDING_MODEL_NAME
+from utils import iter_embedded_batches
+from nlp.categories import CategoryBuilder
+from nlp.categories import load_category_index
+from nlp.doc_store import DocStore
+from nlp.doc_store import PoiColumnWriter
+from nlp.doc_store import read_columns
+from nlp.lexical import BM25Builder
+from nlp.lexical import load_bm25
+from nlp.local_index import LocalCollection
+from nlp.local_index import QuantizedIndex
+from nlp.poi_formats import PoiBatch
+from nlp.quantization import QUANTIZERS
+from nlp.quantization import SCAN_CHUNK
+from nlp.quantization import get_quantizer
+from nlp.quantization import load_quantized
+from nlp.quantization import save_quantized
+
+logging.basicConfig(level=logging.INFO)
+
+SNAPSHOT_DIR = os.environ.get("VECTOR_DB_SNAPSHOT_DIR", ".cache/snapshots")
+# float16, int8 or binary: search the quantized codes and rescore the candidates at full precision
+QUANTIZATION = os.environ.get("VECTOR_DB_QUANTIZATION", "")
+# bumped whenever the layout changes; snapshots of another version are ignored until rebuilt
+SNAPSHOT_VERSION = 3
+
+# Snapshot layout, one directory per collection:
+#   meta.json                  version, count, dim, model, and source file with its size and mtime when the snapshot was
+#                              built; written last, so its presence marks a complete snapshot
+#   embedding.f32              count x dim float32 matrix
+#   embedding_norms.f32        squared L2 norm of each embedding row
+#   latitude.f64, longitude.f64
+#   <field>.offsets, <field>.bytes   int64 offsets and utf-8 data of each string field
+#   mbx_id.order               int64 row numbers sorted by mbx_id, for id -> row lookups
+#   embedding.<quantization>.npy, quantizer.<quantization>.npz   optional quantized codes (see nlp.quantization)
+#   lexical.*                  BM25 postings over the POI texts (see nlp.lexical)
+#   category.*                 dictionary-encoded category tokens (see nlp.categories)
+
+
+def snapshot_path(name):
+    return os.path.join(SNAPSHOT_DIR, name)
+
+
+def source_stamp(filepath):
+    """
+    The size and modification time of a data file, which change whenever it is rewritten
+    """
+    stat = os.stat(filepath)
+    return {"source_size": stat.st_size, "source_mtime_ns": stat.st_mtime_ns}
+
+
+def has_snapshot(name, filepath=None):
+    """
+    Whether a complete snapshot of the current layout exists for a collection, and, given the data file it
+    is meant to serve, whether it was built from that file as it is now
+    """
+    meta_path = os.path.join(snapshot_path(name), "meta.json")
+    if not os.path.exists(meta_path):
+        return False
+    with open(meta_path, "r") as f:
+        meta = json.load(f)
+    version = meta.get("version", 1)
+    if version != SNAPSHOT_VERSION:
+        logging.warning(
+            f"Ignoring snapshot {snapshot_path(name)}: version {version}, expected {SNAPSHOT_VERSION}. Rebuild it with make snapshots"
+        )
+        return False
+    if filepath is not None and any(
+        meta.get(key) != value for key, value in source_stamp(filepath).items()
+    ):
+        logging.warning(
+            f"Ignoring snapshot {snapshot_path(name)}: it was built from another version of {filepath}. Rebuild it with make snapshots"
+        )
+        return False
+    return True
+
+
+def build_snapshot(
+    name, filepath, fmt=None, batch_size=DEFAULT_BATCH_SIZE, quantizations=()
+):
+    """
+    Streams a data file through the embedding pipeline and writes a self-contained, mmap-able snapshot for it,
+    plus quantized codes for each of the given quantizations
+    """
+    start = time.time()
+    # taken before reading, so a file rewritten during the build leaves the snapshot stale
+    stamp = source_stamp(filepath)
+    directory = snapshot_path(name)
+    staging = directory + ".tmp"
+    if os.path.exists(staging):
+        shutil.rmtree(staging)
+    os.makedirs(staging)
+
+    def open_file(filename):
+        return open(os.path.join(staging, filename), "wb")
+
+    files = {"embedding": open_file("embedding.f32")}
+    files["embedding_norms"] = open_file("embedding_norms.f32")
+    columns = PoiColumnWriter(staging)
+
+    lexical = BM25Builder()
+    categories = CategoryBuilder()
+    count, dim = 0, 0
+    try:
+        for batch in iter_embedded_batches(filepath, batch_size=batch_size, fmt=fmt):
+            embedding = np.ascontiguousarray(batch.embedding, dtype=np.float32)
+            dim = embedding.shape[1]
+            files["embedding"].write(embedding.tobytes())
+            files["embedding_norms"].write(
+                np.einsum("ij,ij->i", embedding, embedding).astype(np.float32).tobytes()
+            )
+            columns.add(batch)
+            lexical.add(batch)
+            categories.add(batch)
+            count += len(batch)
+    finally:
+        for f in files.values():
+            f.close()
+        columns.close()
+
+    columns.id_order().tofile(os.path.join(staging, "mbx_id.order"))
+
+    lexical.build().save(staging)
+    categories.build().save(staging)
+
+    if count and quantizations:
+        embedding = _map(staging, "embedding.f32", np.float32, (count, dim))
+        for quantization in quantizations:
+            quantizer = get_quantizer(quantization).fit(embedding)
+            codes = np.concatenate(
+                [
+                    quantizer.encode(embedding[start : start + SCAN_CHUNK])
+                    for start in range(0, count, SCAN_CHUNK)
+                ]
+            )
+            save_quantized(staging, quantizer, codes)
+
+    with open(os.path.join(staging, "meta.json"), "w") as f:
+        json.dump(
+            {
+                "version": SNAPSHOT_VERSION,
+                "count": count,
+                "dim": dim,
+                "model": EMBEDDING_MODEL_NAME,
+                "source": filepath,
+                **stamp,
+                "format": fmt,
+            },
+            f,
+        )
+    if os.path.exists(directory):
+        shutil.rmtree(directory)
+    os.replace(staging, directory)
+    logging.info(
+        f"Built snapshot {directory} with {count} POIs in {time.time() - start:.2f} seconds"
+    )
+    return directory
+
+
+def _map(directory, filename, dtype, shape):
+    if shape[0] == 0:
+        return np.zeros(shape, dtype=dtype)
+    return np.memmap(
+        os.path.join(directory, filename), dtype=dtype, mode="r", shape=shape
+    )
+
+
+class PoiSnapshot(LocalCollection):
+    """
+    A locale snapshot opened read-only as a LocalCollection. Every array is memory-mapped, so opening
+    costs a few syscalls and the pages are shared by every process that opens the same snapshot.
+
+    Searches are exact, or scan quantized codes and rescore the candidates at full precision when opened
+    with a quantization the snapshot was built with.
+    """
+
+    def __init__(self, directory, quantization=None):
+        start = time.time()
+        self.directory = directory
+        with open(os.path.join(directory, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        count, dim = self.meta["count"], self.meta["dim"]
+        super().__init__(
+            os.path.basename(os.path.normpath(directory)),
+            PoiBatch(
+                read_columns(directory, count),
+                _map(directory, "embedding.f32", np.float32, (count, dim)),
+            ),
+            norms=_map(directory, "embedding_norms.f32", np.float32, (count,)),
+        )
+        self.id_order = _map(directory, "mbx_id.order", np.int64, (count,))
+        self._lexical = load_bm25(directory, self.batch)
+        self._categories = load_category_index(directory, count)
+        self._doc_store = DocStore(self.batch, self.id_order)
+        if quantization:
+            quantized = load_quantized(directory, quantization)
+            if quantized is None:
+                logging.warning(
+                    f"Snapshot {directory} has no {quantization} codes, searching at full precision"
+                )
+            else:
+                self.index = QuantizedIndex(*quantized, self.batch.embedding)
+        logging.info(
+            f"Opened snapshot {directory} with {count} POIs in {(time.time() - start) * 1000:.1f} ms"
+        )
+
+    def row_of(self, mbx_id):
+        """
+        Returns the row number of an mbx_id, or None, by binary search over the sorted id order
+        """
+        return self._doc_store.row_of(mbx_id)
+
+
+def open_snapshot(name):
+    return PoiSnapshot(snapshot_path(name), quantization=QUANTIZATION)
+
+
+if __name__ == "__main__":
+    # PYTHONPATH=app python app/nlp/snapshot.py [<collection name> <data file> [format]]
+    # without arguments, builds a snapshot of every locale discovered in the data directory.
+    # builds codes for every quantization, so VECTOR_DB_QUANTIZATION can be switched without a rebuild
+    from nlp.locales import discover_locales
+
+    if len(sys.argv) > 2:
+        fmt = sys.argv[3] if len(sys.argv) > 3 else None
+        locales = [{"name": sys.argv[1], "filepath": sys.argv[2], "fmt": fmt}]
+    else:
+        locales = discover_locales().values()
+    for spec in locales:
+        build_snapshot(
+            spec["name"],
+            spec["filepath"],
+            fmt=spec["fmt"],
+            quantizations=list(QUANTIZERS),
+        )
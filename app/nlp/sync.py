@@ -0,0 +1,66 @@
+import hashlib
+import json
+import logging
+import os
+
+from nlp.poi_formats import POI_FIELDS
+
+logging.basicConfig(level=logging.INFO)
+
+MANIFEST_DIR = os.environ.get("VECTOR_DB_MANIFEST_DIR", ".cache/manifests")
+
+
+def content_hashes(batch):
+    """
+    Hashes every field of each POI in a PoiBatch except its embedding, so any edit to the source data changes the hash
+    """
+    values = batch.to_pydict(POI_FIELDS).values()
+    return [
+        hashlib.sha1(json.dumps(row).encode("utf-8")).hexdigest()
+        for row in zip(*values)
+    ]
+
+
+def _manifest_path(name):
+    return os.path.join(MANIFEST_DIR, f"{name}.json")
+
+
+def load_manifest(name):
+    """
+    Returns the {mbx_id: content hash} manifest last written for a collection, or None if there is none
+    """
+    path = _manifest_path(name)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as f:
+        return json.load(f)
+
+
+def save_manifest(name, manifest):
+    os.makedirs(MANIFEST_DIR, exist_ok=True)
+    path = _manifest_path(name)
+    with open(path + ".tmp", "w") as f:
+        json.dump(manifest, f)
+    os.replace(path + ".tmp", path)
+    logging.info(f"Saved manifest for {name} with {len(manifest)} entries")
+
+
+def drop_manifest(name):
+    path = _manifest_path(name)
+    if os.path.exists(path):
+        os.remove(path)
+
+
+def diff_batch(manifest, batch, new_manifest):
+    """
+    Records the hashes of a PoiBatch in new_manifest and returns the positions of the POIs that are new
+    or changed relative to manifest
+    """
+    changed = []
+    for i, (mbx_id, digest) in enumerate(
+        zip(batch["mbx_id"].to_list(), content_hashes(batch))
+    ):
+        new_manifest[mbx_id] = digest
+        if manifest.get(mbx_id) != digest:
+            changed.append(i)
+    return changed
@@ -1,4 +1,10 @@
+import copy
+import json
+import math
+import os
+import threading
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 import numpy as np
 from pymilvus import (
@@ -9,44 +15,474 @@ from pymilvus import (
     DataType,
     Collection,
 )
-import pandas as pd
 from utils import load_data
 from utils import embed
+from utils import get_embedding_model
+from utils import embed_batch
+from utils import iter_batches
+from utils import iter_embedded_batches
+from utils import DEFAULT_BATCH_SIZE
+from utils import EMBEDDING_DIM
+from nlp.parallel_ingest import iter_parallel_embedded_batches
+from nlp.caches import LRUCache
+from nlp.categories import CategoryBuilder
+from nlp.categories import load_category_index
+from nlp.doc_store import DocStoreWriter
+from nlp.doc_store import doc_store_path
+from nlp.doc_store import load_doc_store
+from nlp.geo import blend_scores
+from nlp.index_tuning import load_index_config
+from nlp.lexical import BM25Builder
+from nlp.lexical import reciprocal_rank_fusion
+from nlp.local_index import LocalCollection
+from nlp.local_index import LocalHit
+from nlp.local_index import batch_hits
+from nlp.locales import discover_locales
+from nlp.partitions import MilvusPartition
+from nlp.rerank import CONTEXT_FIELDS
+from nlp.rerank import RERANK_CANDIDATES
+from nlp.rerank import Reranker
+from nlp.residency import ResidencyManager
+from nlp.poi_formats import GEO_FIELDS
+from nlp.poi_formats import PoiBatch
+from nlp.snapshot import has_snapshot, open_snapshot
+from nlp.sync import (
+    content_hashes,
+    diff_batch,
+    drop_manifest,
+    load_manifest,
+    save_manifest,
+)
 
 import logging
 
 logging.basicConfig(level=logging.INFO)
 
-logging.info("Connecting to Milvus deployment...")
-connections.connect("default", host="localhost", port="19530")
+# "rebuild" drops and re-indexes every collection at start up (DEMO ONLY: we want to start fresh),
+# "incremental" only applies what changed in the data files since the last indexed manifest
+SYNC_MODE = os.environ.get("VECTOR_DB_SYNC_MODE", "rebuild")
+# "milvus" keeps collections in the Milvus deployment, "local" searches them in process with
+# nlp.local_index, so no services are needed. Locales with a snapshot are always searched locally.
+BACKEND = os.environ.get("VECTOR_DB_BACKEND", "milvus")
+# the Milvus collection holding every locale, each in its own partition
+POI_COLLECTION = os.environ.get("VECTOR_DB_COLLECTION", "pois")
+# FLAT (exact) or IVF_FLAT, for collections searched in process
+LOCAL_INDEX_TYPE = os.environ.get("VECTOR_DB_LOCAL_INDEX", "FLAT")
+# size limits and result time-to-live (seconds) of the VectorDB query caches
+QUERY_CACHE_SIZE = int(os.environ.get("VECTOR_DB_QUERY_CACHE_SIZE", "10000"))
+RESULT_CACHE_SIZE = int(os.environ.get("VECTOR_DB_RESULT_CACHE_SIZE", "10000"))
+RESULT_CACHE_TTL = float(os.environ.get("VECTOR_DB_RESULT_CACHE_TTL", "3600"))
+# loaded collections beyond this many megabytes get released, least recently used first
+MEMORY_BUDGET_MB = float(os.environ.get("VECTOR_DB_MEMORY_BUDGET_MB", "2048"))
+# how many locations predicted from recent traffic to pre-warm on each location change
+PREWARM_LOCATIONS = int(os.environ.get("VECTOR_DB_PREWARM_LOCATIONS", "2"))
+# number of processes used to parse and embed data files when (re)building a collection
+INGEST_WORKERS = int(os.environ.get("INGEST_WORKERS", "1"))
+MILVUS_HOST = os.environ.get("MILVUS_HOST", "localhost")
+MILVUS_PORT = os.environ.get("MILVUS_PORT", "19530")
+# share of the ranking given to distance from the search center in geo searches (0 ranks by similarity only)
+GEO_WEIGHT = float(os.environ.get("VECTOR_DB_GEO_WEIGHT", "0.3"))
+# geo searches fetch this many times top_k candidates to rerank by blended similarity and distance
+GEO_OVERSAMPLE = 4
+# "1" also runs each search against the BM25 index of the collection and fuses both rankings
+HYBRID_SEARCH = os.environ.get("VECTOR_DB_HYBRID", "1") == "1"
+# hybrid searches fetch this many times top_k hits from each index before fusing them
+HYBRID_OVERSAMPLE = 2
+# Milvus category filters too broad for an id expression fetch this many times the hits expected to pass
+CATEGORY_OVERSAMPLE = 2
+# most hits Milvus returns for one query
+MILVUS_MAX_TOPK = 16384
+# "1" reranks the RERANK_CANDIDATES best candidates of each search with a cross-encoder (see nlp.rerank)
+RERANK = os.environ.get("VECTOR_DB_RERANK", "0") == "1"
 
-# DEMO ONLY: Drop collections if they exist. We want to start fresh.
-if utility.has_collection("dc_pois"):
-    logging.info("Deleting collection dc_pois...")
-    utility.drop_collection("dc_pois")
+# bumped every time a collection is (re)indexed, so cached search results for it stop matching
+COLLECTION_GENERATIONS = {}
 
-if utility.has_collection("duvall_pois"):
-    logging.info("Deleting collection duvall_pois...")
-    utility.drop_collection("duvall_pois")
 
+# serializes creating, migrating and re-indexing POI_COLLECTION between locales opened concurrently
+_poi_collection_lock = threading.Lock()
+
+# Milvus locale name -> nlp.lexical.BM25Index and nlp.categories.CategoryIndex built while its data was
+# last streamed in (the category index is also saved with the document store, and loaded from there when
+# the partition was left as is); local collections carry their own (LocalCollection.lexical_index and
+# category_index)
+LEXICAL_INDEXES = {}
+CATEGORY_INDEXES = {}
+# Milvus locale name -> nlp.doc_store.DocStore written while its data was last streamed in, or loaded from
+# DOC_STORE_DIR when the partition was left as is; local collections carry their own (LocalCollection.doc_store)
+DOC_STORES = {}
+
+
+def mark_reindexed(name):
+    COLLECTION_GENERATIONS[name] = COLLECTION_GENERATIONS.get(name, 0) + 1
+
+
+def index_params_for(name):
+    """
+    The vector index of a collection: the one tuned by nlp.index_tuning if any, VECTOR_INDEX otherwise
+    """
+    config = load_index_config(name)
+    return VECTOR_INDEX if config is None else config["index"]
+
+
+def search_params_for(name):
+    config = load_index_config(name)
+    return SEARCH_PARAMS if config is None else config["search"]
+
+
+def _has_index_params(collection, index_params):
+    current = collection.index().params
+    params = current.get("params", {})
+    if isinstance(params, str):
+        params = json.loads(params)
+    return current.get("index_type") == index_params["index_type"] and {
+        key: str(value) for key, value in params.items()
+    } == {key: str(value) for key, value in index_params.get("params", {}).items()}
+
+
+def lexical_index_of(collection):
+    if isinstance(collection, LocalCollection):
+        return collection.lexical_index()
+    return LEXICAL_INDEXES.get(collection.name)
+
+
+def doc_store_of(collection):
+    if isinstance(collection, LocalCollection):
+        return collection.doc_store()
+    if collection.name not in DOC_STORES:
+        DOC_STORES[collection.name] = load_doc_store(doc_store_path(collection.name))
+    return DOC_STORES[collection.name]
+
+
+def category_index_of(collection):
+    """
+    The CategoryIndex of a Milvus locale. Raises ValueError when it has none, so that a category filter is
+    never silently ignored.
+    """
+    if collection.name not in CATEGORY_INDEXES:
+        store = doc_store_of(collection)
+        index = None
+        if store is not None:
+            index = load_category_index(doc_store_path(collection.name), len(store))
+        if index is None:
+            raise ValueError(
+                f"{collection.name} has no category index, ingest it again to filter it by category"
+            )
+        # the rows of the document store and of the category index are in the same ingestion order
+        index.ids = store.batch["mbx_id"]
+        CATEGORY_INDEXES[collection.name] = index
+    return CATEGORY_INDEXES[collection.name]
+
+
+def hydrate_hits(collection, hits, fields):
+    store = doc_store_of(collection)
+    hits = list(hits)
+    if store is None:
+        return [None] * len(hits)
+    return store.hydrate([hit.id for hit in hits], fields)
 
-def index_collection(fields, name, filepath, description):
-    schema = CollectionSchema(fields, description)
 
-    logging.info(f"Creating collection {name}...")
-    collection = Collection(name, schema, consistency_level="Strong")
+def stored_embeddings(collection, hits):
+    """
+    The embeddings a collection stores for hits, in order (zeros for ids it does not know), so that query
+    time code can compare hits without encoding their texts again
+    """
+    ids = [hit.id for hit in hits]
+    embeddings = np.zeros((len(ids), EMBEDDING_DIM), dtype=np.float32)
+    if isinstance(collection, LocalCollection):
+        store = collection.doc_store()
+        for i, mbx_id in enumerate(ids):
+            row = store.row_of(mbx_id)
+            if row is not None:
+                embeddings[i] = collection.batch.embedding[row]
+        return embeddings
+    rows = collection.query(
+        f"mbx_id in {json.dumps(ids)}", output_fields=["mbx_id", "embedding"]
+    )
+    stored = {row["mbx_id"]: row["embedding"] for row in rows}
+    for i, mbx_id in enumerate(ids):
+        if mbx_id in stored:
+            embeddings[i] = stored[mbx_id]
+    return embeddings
 
-    logging.info(f"Loading pois data from {filepath}...")
-    entities = load_data(filepath=filepath)
 
-    insert_result = collection.insert(pd.DataFrame(entities))
+def sample_stored_embeddings(collection, n, seed=0):
+    """
+    The stored embeddings of up to n randomly chosen POIs of a collection, read back from it (picked from
+    its document store), so no data file has to be parsed or embedded again
+    """
+    store = doc_store_of(collection)
+    if store is None:
+        return np.zeros((0, EMBEDDING_DIM), dtype=np.float32)
+    rows = np.random.default_rng(seed).choice(
+        len(store), min(n, len(store)), replace=False
+    )
+    ids = store.batch["mbx_id"].take(rows).to_list()
+    return stored_embeddings(collection, [LocalHit(mbx_id, 0.0, {}) for mbx_id in ids])
+
+
+def connect():
+    """
+    Connects the default pymilvus alias, once, the first time a collection actually needs Milvus
+    """
+    if not connections.has_connection("default"):
+        logging.info("Connecting to Milvus deployment...")
+        connections.connect("default", host=MILVUS_HOST, port=MILVUS_PORT)
+
+
+def _milvus_columns(batch, fields):
+    """
+    Lays out a PoiBatch as one list per schema field, for Collection.insert.
+    The schema stores coordinates as DOUBLE, with NaN for unknown ones, which no range filter matches.
+    """
+    columns = []
+    for field in fields:
+        if field.name == "embedding":
+            columns.append(list(batch.embedding))
+        elif field.name in GEO_FIELDS:
+            columns.append(batch[field.name].astype(np.float64).tolist())
+        else:
+            columns.append(batch[field.name].to_list())
+    return columns
+
+
+def _schema_matches(collection, fields):
+    return [(field.name, field.dtype) for field in collection.schema.fields] == [
+        (field.name, field.dtype) for field in fields
+    ]
+
+
+def get_poi_collection(fields):
+    """
+    The Milvus collection holding the POIs of every locale, one partition each, created on first use.
+    A collection created with another schema is dropped first. Its vector index is only created when it
+    has none: rebuilding it would release every partition, so a live collection is re-indexed by
+    `make tune-indexes` (see nlp.index_tuning), never by the ingestion of a locale.
+    """
+    connect()
+    with _poi_collection_lock:
+        if utility.has_collection(POI_COLLECTION) and not _schema_matches(
+            Collection(POI_COLLECTION), fields
+        ):
+            logging.info(f"{POI_COLLECTION} has an outdated schema, dropping it...")
+            utility.drop_collection(POI_COLLECTION)
+        if not utility.has_collection(POI_COLLECTION):
+            logging.info(f"Creating collection {POI_COLLECTION}...")
+            Collection(
+                POI_COLLECTION,
+                CollectionSchema(fields, "POIs of every locale, one partition each"),
+                consistency_level="Strong",
+            )
+        collection = Collection(POI_COLLECTION)
+
+        index_params = index_params_for(POI_COLLECTION)
+        if collection.has_index() and not _has_index_params(collection, index_params):
+            logging.warning(
+                f"Index of {POI_COLLECTION} differs from its tuned config {index_params}, run make tune-indexes to rebuild it"
+            )
+        if not collection.has_index():
+            logging.info(f"Creating index on {POI_COLLECTION}: {index_params}...")
+            collection.create_index("embedding", index_params)
+            # the index is shared, so results cached for every locale are stale
+            for name in list(COLLECTION_GENERATIONS):
+                mark_reindexed(name)
+        return collection
+
+
+def drop_partition(collection, name):
+    logging.info(f"Deleting partition {name} of {collection.name}...")
+    MilvusPartition(collection, name).release()
+    collection.drop_partition(name)
+    drop_manifest(name)
+
+
+def index_partition(
+    collection,
+    fields,
+    name,
+    filepath,
+    description,
+    batch_size=DEFAULT_BATCH_SIZE,
+    fmt=None,
+):
+    """
+    Creates the partition of a locale and streams its data file into it in batches of batch_size rows.
+    Embedding of the next batch overlaps the insert of the current one, so memory stays flat.
+    The BM25 and category indexes and the document store of the locale are built from the same batches.
+    """
+    logging.info(f"Creating partition {name} of {collection.name} ({description})...")
+    collection.create_partition(name, description)
+
+    logging.info(f"Streaming pois data from {filepath} in batches of {batch_size}...")
+    if INGEST_WORKERS > 1:
+        batches = iter_parallel_embedded_batches(
+            filepath, batch_size=batch_size, fmt=fmt, workers=INGEST_WORKERS
+        )
+    else:
+        batches = iter_embedded_batches(filepath, batch_size=batch_size, fmt=fmt)
+    manifest = {}
+    lexical = BM25Builder(store=True)
+    categories = CategoryBuilder(store_ids=True)
+    documents = DocStoreWriter(doc_store_path(name))
+    for batch in batches:
+        collection.insert(_milvus_columns(batch, fields), partition_name=name)
+        manifest.update(zip(batch["mbx_id"].to_list(), content_hashes(batch)))
+        lexical.add(batch)
+        categories.add(batch)
+        documents.add(batch)
+        logging.info(f"Inserted {len(manifest)} entities into {name}")
 
     collection.flush()
-    logging.info(f"Number of entities in {name} index: {collection.num_entities}")
+    save_manifest(name, manifest)
+    LEXICAL_INDEXES[name] = lexical.build()
+    DOC_STORES[name] = documents.finish()
+    CATEGORY_INDEXES[name] = categories.build()
+    CATEGORY_INDEXES[name].save(doc_store_path(name))
+    mark_reindexed(name)
+    partition = MilvusPartition(collection, name)
+    logging.info(f"Number of entities in {name} partition: {partition.num_entities}")
+    return partition
+
+
+def sync_partition(
+    collection,
+    fields,
+    name,
+    filepath,
+    description,
+    batch_size=DEFAULT_BATCH_SIZE,
+    fmt=None,
+):
+    """
+    Incrementally brings the partition of a locale in line with its data file.
+
+    Rows are diffed against the manifest of mbx_id -> content hash written by the last sync, only added or
+    changed rows are embedded and (re-)inserted, and rows missing from the file are deleted. Without a partition
+    or manifest to diff against, this falls back to a full index_partition.
+    """
+    manifest = load_manifest(name)
+    exists = collection.has_partition(name)
+    if manifest is None or not exists:
+        if exists:
+            logging.info(f"No manifest for {name}, rebuilding its partition...")
+            drop_partition(collection, name)
+        return index_partition(
+            collection, fields, name, filepath, description, batch_size, fmt
+        )
+
+    new_manifest = {}
+    written = 0
+    # every row is read anyway, so the BM25 and category indexes and the document store are rebuilt in full
+    lexical = BM25Builder(store=True)
+    categories = CategoryBuilder(store_ids=True)
+    documents = DocStoreWriter(doc_store_path(name))
+    for batch in iter_batches(filepath, batch_size=batch_size, fmt=fmt):
+        lexical.add(batch)
+        categories.add(batch)
+        documents.add(batch)
+        changed = diff_batch(manifest, batch, new_manifest)
+        if changed:
+            changed_batch = embed_batch(batch.take(changed))
+            # Collection.upsert needs Milvus 2.3 (docker-compose.yml runs 2.2), so changed rows are
+            # deleted, then inserted again
+            stale = [
+                mbx_id
+                for mbx_id in changed_batch["mbx_id"].to_list()
+                if mbx_id in manifest
+            ]
+            if stale:
+                collection.delete(f"mbx_id in {json.dumps(stale)}", partition_name=name)
+            collection.insert(
+                _milvus_columns(changed_batch, fields), partition_name=name
+            )
+            written += len(changed)
+
+    removed = [mbx_id for mbx_id in manifest if mbx_id not in new_manifest]
+    for i in range(0, len(removed), batch_size):
+        collection.delete(
+            f"mbx_id in {json.dumps(removed[i : i + batch_size])}", partition_name=name
+        )
+
+    collection.flush()
+    save_manifest(name, new_manifest)
+    LEXICAL_INDEXES[name] = lexical.build()
+    DOC_STORES[name] = documents.finish()
+    CATEGORY_INDEXES[name] = categories.build()
+    CATEGORY_INDEXES[name].save(doc_store_path(name))
+    mark_reindexed(name)
+    logging.info(
+        f"Synced {name}: {written} added or changed, {len(removed)} removed, {len(new_manifest)} total"
+    )
+    return MilvusPartition(collection, name)
+
+
+def build_partition(fields, name, filepath, description, fmt=None):
+    """
+    Makes the partition of a locale reflect its data file according to SYNC_MODE. Only that partition
+    is written to: the other locales stay loaded and searchable while it is (re)built.
+    """
+    collection = get_poi_collection(fields)
+    if SYNC_MODE == "incremental":
+        return sync_partition(collection, fields, name, filepath, description, fmt=fmt)
+    if collection.has_partition(name):
+        drop_partition(collection, name)
+    return index_partition(collection, fields, name, filepath, description, fmt=fmt)
+
+
+def build_local_collection(name, filepath, fmt=None):
+    """
+    Embeds a data file into an in-process LocalCollection
+    """
+    logging.info(f"Loading pois data from {filepath} into local collection {name}...")
+    mark_reindexed(name)
+    return LocalCollection(
+        name, PoiBatch.concat(list(iter_embedded_batches(filepath, fmt=fmt)))
+    )
+
+
+def open_collection(fields, name, filepath, description, fmt=None):
+    """
+    Opens the prebuilt local snapshot of a locale if there is one (see nlp.snapshot),
+    which skips parsing, embedding and inserting entirely. Otherwise builds the locale in BACKEND:
+    a LocalCollection, or a partition of the Milvus POI_COLLECTION.
+    """
+    if has_snapshot(name, filepath):
+        collection = open_snapshot(name)
+    elif BACKEND == "local":
+        collection = build_local_collection(name, filepath, fmt=fmt)
+    else:
+        return build_partition(fields, name, filepath, description, fmt=fmt)
+    if load_index_config(name) is not None:
+        index_params = index_params_for(name)
+    else:
+        index_params = {**VECTOR_INDEX, "index_type": LOCAL_INDEX_TYPE}
+    if index_params["index_type"] != "FLAT" and not collection.has_index():
+        try:
+            collection.create_index("embedding", index_params)
+        except ValueError as e:
+            logging.warning(f"Searching {name} exactly: {e}")
+        mark_reindexed(name)
     return collection
 
 
+def open_existing_collection(fields, name, filepath, description, fmt=None):
+    """
+    Opens a locale like open_collection, except that nothing is written to Milvus: the partition of a
+    Milvus locale is opened as it was last ingested, or None when it has not been ingested yet
+    """
+    if has_snapshot(name, filepath) or BACKEND == "local":
+        return open_collection(fields, name, filepath, description, fmt=fmt)
+    connect()
+    if not utility.has_collection(POI_COLLECTION):
+        return None
+    collection = Collection(POI_COLLECTION)
+    if not collection.has_partition(name):
+        return None
+    return MilvusPartition(collection, name)
+
+
 def benchmark_index_collection(fields, name, filepath, description, iterations=5):
+    connect()
     schema = CollectionSchema(fields, description)
 
     for i in range(iterations):
@@ -60,7 +496,7 @@ def benchmark_index_collection(fields, name, filepath, description, iterations=5
         logging.info(f"Embedding time: {end_embedding - start_embedding}")
 
         start_indexing_time = time.time()
-        insert_result = collection.insert(pd.DataFrame(entities))
+        insert_result = collection.insert(_milvus_columns(entities, fields))
         end_indexing_time = time.time()
         logging.info(f"Indexing time: {end_indexing_time - start_indexing_time}")
 
@@ -79,8 +515,8 @@ VECTOR_DB_SCHEMA = [
         is_primary=True,
         auto_id=False,
     ),
-    FieldSchema(name="latitude", dtype=DataType.VARCHAR, max_length=500),
-    FieldSchema(name="longitude", dtype=DataType.VARCHAR, max_length=500),
+    FieldSchema(name="latitude", dtype=DataType.DOUBLE),
+    FieldSchema(name="longitude", dtype=DataType.DOUBLE),
     FieldSchema(name="name", dtype=DataType.VARCHAR, max_length=2000),
     FieldSchema(name="addr_full", dtype=DataType.VARCHAR, max_length=2000),
     FieldSchema(name="addr_street", dtype=DataType.VARCHAR, max_length=500),
@@ -97,64 +533,574 @@ VECTOR_DB_SCHEMA = [
 #     iterations=20,
 # )  # comment this out when you actually want to use the UI, otherwise you'll run bechmarking every time you start the app
 
-dc_pois = index_collection(
-    VECTOR_DB_SCHEMA,
-    "dc_pois",
-    "data/us_dc_georgetown_with_details.json",
-    description="Georgetown, Washington DC POIs",
-)
-duvall_pois = index_collection(
-    VECTOR_DB_SCHEMA,
-    "duvall_pois",
-    "data/us_duvall_wa_with_details.json",
-    description="Duvall, Washington POIs",
-)
-
-
-logging.info("Creating index: IVF_FLAT and L2...")
-index = {
+VECTOR_INDEX = {
     "index_type": "IVF_FLAT",
     "metric_type": "L2",
     "params": {"nlist": 128},
 }
-dc_pois.create_index("embedding", index)
-duvall_pois.create_index("embedding", index)
+SEARCH_PARAMS = {
+    "metric_type": "L2",
+    "params": {"nprobe": 10},
+}
+# searches only return ids and scores (and coordinates for geo reranking); VectorDB.hydrate fetches the
+# fields the caller shows from the document store
+OUTPUT_FIELDS = []
+GEO_OUTPUT_FIELDS = ["latitude", "longitude"]
+# queries sent to a collection per search call by VectorDB.search_many
+SEARCH_MANY_CHUNK = 1024
+
+# location shown in the client -> the locale (partition or local collection) that holds its POIs,
+# discovered from the data files in nlp.locales.DATA_DIR
+LOCATIONS = discover_locales()
+
+
+def refresh_locales():
+    """
+    Registers the data files added since start up, in place so every importer of LOCATIONS sees them.
+    Returns the newly found locations; they get built the first time they are opened.
+    """
+    found = discover_locales()
+    added = [location for location in found if location not in LOCATIONS]
+    LOCATIONS.update(found)
+    return added
+
+
+def collection_memory_size(collection):
+    """
+    Bytes a loaded collection occupies, from Milvus' query segment info for Milvus collections
+    """
+    if isinstance(collection, (LocalCollection, MilvusPartition)):
+        return collection.memory_size()
+    try:
+        segments = utility.get_query_segment_info(collection.name)
+        return sum(segment.mem_size for segment in segments)
+    except Exception:
+        # 384 float32s per embedding plus roughly a kilobyte of text fields
+        return collection.num_entities * (384 * 4 + 1024)
+
+
+def normalize_query(query):
+    # the MiniLM encoder is uncased, so this does not change the embedding
+    return " ".join(query.lower().split())
 
 
 class VectorDB:
-    def __init__(self) -> None:
-        self.collections = {
-            "Georgetown, DC": dc_pois,
-            "Duvall, WA": duvall_pois,
+    """
+    Semantic POI search over one locale per location: a partition of the Milvus POI_COLLECTION, or a
+    collection searched in process.
+
+    Creating a VectorDB is cheap: nothing is connected, embedded or loaded until a location is first
+    searched, or until start() warms the models up on a background thread. ready is set once the
+    warm-up has finished, and startup_timings holds the seconds spent in each phase.
+    """
+
+    def __init__(
+        self,
+        query_cache_size=QUERY_CACHE_SIZE,
+        result_cache_size=RESULT_CACHE_SIZE,
+        result_cache_ttl=RESULT_CACHE_TTL,
+        memory_budget_mb=MEMORY_BUDGET_MB,
+    ) -> None:
+        # location -> opened collection, filled in lazily by _open
+        self.collections = {}
+        # location -> lock serializing its opening; locations can be registered after start up
+        self._open_locks = {}
+        self._open_locks_lock = threading.Lock()
+        self.residency = ResidencyManager(
+            self._open,
+            memory_budget_mb * 2**20,
+            collection_memory_size,
+            on_evict=self._evicted,
+        )
+        # normalized query -> embedding
+        self.query_embeddings = LRUCache(query_cache_size)
+        # (collection name, generation, normalized query, top_k, search params) -> hits
+        self.results = LRUCache(result_cache_size, ttl=result_cache_ttl)
+        self.ready = threading.Event()
+        self.startup_timings = {}
+        self._warm_up_thread = None
+        # runs the lexical half of hybrid searches while the query is embedded and vector searched
+        self._lexical_executor = ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="lexical-search"
+        )
+        # an nlp.connection_pool.MilvusConnectionPool to search Milvus collections through, instead of
+        # the default connection (see nlp.async_vector_db)
+        self.connection_pool = None
+        self.reranker = Reranker()
+
+    def with_connection_pool(self, connection_pool):
+        """
+        A VectorDB sharing this one's collections, caches and workers, that searches Milvus through
+        connection_pool while this one keeps its own connection
+        """
+        pooled = copy.copy(self)
+        pooled.connection_pool = connection_pool
+        return pooled
+
+    def _timed(self, phase, function, *args):
+        start = time.time()
+        result = function(*args)
+        self.startup_timings[phase] = time.time() - start
+        return result
+
+    def _open(self, location):
+        """
+        Opens (building it first if needed) the collection of a location, once per process
+        """
+        with self._open_locks_lock:
+            lock = self._open_locks.setdefault(location, threading.Lock())
+        with lock:
+            if location not in self.collections:
+                self.collections[location] = self._timed(
+                    f"open {location}",
+                    lambda: open_collection(VECTOR_DB_SCHEMA, **LOCATIONS[location]),
+                )
+            return self.collections[location]
+
+    def _evicted(self, location, collection):
+        """
+        Forgets an evicted local collection, so its arrays are freed (and its snapshot unmapped) and it is
+        opened again on its next load. Milvus partitions were released on the server and keep their handle.
+        """
+        if isinstance(collection, LocalCollection):
+            self.collections.pop(location, None)
+
+    def start(self, locations=None, background=True):
+        """
+        Warms up the query encoder and the collections of the given locations (e.g. the one selected at
+        start up; none by default), on a background thread unless background is False. Other locations
+        are loaded by the residency manager when first asked for, so start up does not grow with the
+        number of locales. Returns immediately in the background case; use ready or wait_until_ready() to
+        know when the warm-up is done.
+        """
+        if self._warm_up_thread is not None:
+            return self.ready
+        locations = [] if locations is None else locations
+        self._warm_up_thread = threading.Thread(
+            target=self._warm_up,
+            args=(locations,),
+            name="vector-db-warm-up",
+            daemon=True,
+        )
+        self._warm_up_thread.start()
+        if not background:
+            self._warm_up_thread.join()
+        return self.ready
+
+    def _warm_up(self, locations):
+        start = time.time()
+        try:
+            self._timed("embedding model", get_embedding_model)
+            if RERANK:
+                self._timed("rerank model", self.reranker.warm_up)
+            for location in locations:
+                self._timed(f"load {location}", self.residency.wait, location)
+        except Exception:
+            logging.exception("VectorDB warm-up failed")
+        self.startup_timings["total"] = time.time() - start
+        logging.info(f"VectorDB warm-up finished: {self.startup_timings}")
+        self.ready.set()
+
+    def wait_until_ready(self, timeout=None):
+        return self.ready.wait(timeout)
+
+    def cache_stats(self):
+        return {
+            "query_embeddings": self.query_embeddings.stats(),
+            "results": self.results.stats(),
         }
 
+    def _result_key(
+        self,
+        collection,
+        query,
+        top_k,
+        geo=None,
+        geo_weight=None,
+        hybrid=False,
+        categories=None,
+        rerank=False,
+    ):
+        name = LOCATIONS[collection]["name"]
+        # the search params of a Milvus partition are the shared collection's, known once it is opened
+        opened = self.collections.get(collection)
+        return (
+            name,
+            COLLECTION_GENERATIONS.get(name, 0),
+            normalize_query(query),
+            top_k,
+            json.dumps(
+                search_params_for(name if opened is None else opened.index_name),
+                sort_keys=True,
+            ),
+            None if geo is None else (geo.key(), geo_weight),
+            hybrid,
+            None if categories is None else categories.key(),
+            rerank,
+        )
+
+    def _embed_queries(self, queries):
+        """
+        Embeds queries, encoding the ones missing from the query embedding cache in a single batch
+        """
+        keys = [normalize_query(query) for query in queries]
+        embeddings = [self.query_embeddings.get(key) for key in keys]
+        missing = list(
+            dict.fromkeys(key for key, e in zip(keys, embeddings) if e is None)
+        )
+        if missing:
+            encoded = dict(zip(missing, embed(missing, use_cache=False)))
+            for key, embedding in encoded.items():
+                self.query_embeddings.put(key, embedding)
+            embeddings = [
+                encoded[key] if embedding is None else embedding
+                for key, embedding in zip(keys, embeddings)
+            ]
+        return np.asarray(embeddings, dtype=np.float32).reshape(
+            len(queries), EMBEDDING_DIM
+        )
+
+    def embed_query(self, query):
+        """
+        The (1, dim) embedding of a query, from (or added to) the query embedding cache search() reads
+        """
+        return self._embed_queries([query])
+
+    def _collection(self, location):
+        """
+        The loaded collection of a location, bound to this thread's pooled connection when there is a pool
+        """
+        collection = self.residency.wait(location)
+        if self.connection_pool is None or isinstance(collection, LocalCollection):
+            return collection
+        return collection.bound_to(
+            self.connection_pool.collection(collection.index_name)
+        )
+
     def set_idx_by_location(self, location):
+        """
+        Makes sure the location's collection is loaded (in the background, and only the first time),
+        and pre-warms the locations recent traffic suggests will be asked for next
+        """
         logging.info(f"Setting index to {location}")
-        if location == "Georgetown, DC":
-            self.idx = self.collections["Georgetown, DC"].load()
-        elif location == "Duvall, WA":
-            self.idx = self.collections["Duvall, WA"].load()
+        if location in LOCATIONS:
+            self.idx = self.residency.ensure_loaded(location)
+            self.residency.prewarm(PREWARM_LOCATIONS)
 
-    def search(self, collection, query, top_k=5):
+    def search(
+        self,
+        collection,
+        query,
+        top_k=5,
+        geo=None,
+        geo_weight=GEO_WEIGHT,
+        hybrid=HYBRID_SEARCH,
+        categories=None,
+        timeout=None,
+        rerank=RERANK,
+        rerank_budget_ms=None,
+    ):
         """
-        Searches the vector database for the top k results
+        Searches the vector database for the top k results, as hits holding only their id and distance
+        (see hydrate() for their fields)
+
+        geo (a nlp.geo.GeoFilter) restricts the search to a radius or bounding box: only POIs inside it are
+        scored, and the candidates are reranked by blending their vector distance with their distance from
+        the center, geo_weight being the share of the latter.
+
+        hybrid also looks the query up in the BM25 index of the collection, on another thread while the
+        query is embedded and vector searched, and merges both rankings by reciprocal rank fusion, so exact
+        name matches surface even when their embedding is not the closest. The distance of hybrid hits is
+        then minus their fused score, rather than a vector distance.
+
+        categories (a nlp.categories.CategoryFilter) keeps only POIs with any of its include categories and
+        none of its exclude ones, applied as a bitmap mask before any scoring.
+
+        timeout (seconds) bounds the Milvus search call.
+
+        rerank fetches RERANK_CANDIDATES candidates instead of top_k, and reorders them with a cross-encoder
+        (see nlp.rerank.Reranker). Past rerank_budget_ms milliseconds the candidates keep the vector order,
+        and that result is not cached.
         """
         logging.info(f"Searching {collection} for {query}...")
         start = time.time()
-        query_embedding = embed([query])
-        search_params = {
-            "metric_type": "L2",
-            "params": {"nprobe": 10},
-        }
-        results = self.collections[collection].search(
-            query_embedding,
-            "embedding",
-            search_params,
-            limit=top_k,
-            output_fields=["name", "category"],
+        key = self._result_key(
+            collection, query, top_k, geo, geo_weight, hybrid, categories, rerank
+        )
+        results = self.results.get(key)
+        if results is not None:
+            logging.info(
+                f"\tCached vectorDB lookup time: {(time.time() - start)} seconds"
+            )
+            return results
+        candidates = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+        limit = candidates * HYBRID_OVERSAMPLE if hybrid else candidates
+        lexical = None
+        if hybrid:
+            lexical = self._lexical_executor.submit(
+                self._lexical_search, collection, query, limit, geo, categories
+            )
+        query_embedding = self._embed_queries([query])
+        collection = self._collection(collection)
+        prefilter, category_rows = self._prefilter(collection, geo, categories)
+        prefilter["timeout"] = timeout
+        fetch = limit
+        if category_rows is not None:
+            fetch = self._category_fetch(collection, limit, category_rows, geo)
+        if geo is None:
+            results = collection.search(
+                query_embedding,
+                "embedding",
+                search_params_for(collection.index_name),
+                limit=fetch,
+                output_fields=OUTPUT_FIELDS,
+                **prefilter,
+            )
+        else:
+            results = self._geo_search(
+                collection, query_embedding, fetch, geo, geo_weight, prefilter
+            )
+        if category_rows is not None:
+            results = [
+                self._filter_categories(collection, hits, category_rows, limit)
+                for hits in results
+            ]
+        hits, reranked = self._fuse_and_rerank(
+            collection,
+            query,
+            results[0],
+            lexical,
+            candidates,
+            top_k,
+            rerank,
+            rerank_budget_ms,
         )
+        results = [hits]
+        if reranked:
+            self.results.put(key, results)
         end = time.time()
         logging.info(
             f"\tEmbedding query + vectorDB lookup time: {(end - start)} seconds"
         )
         return results
+
+    def _fuse_and_rerank(
+        self, collection, query, hits, lexical, candidates, top_k, rerank, budget_ms
+    ):
+        """
+        Merges the vector hits of a query with its lexical ones (a Future, or None when not hybrid) by
+        reciprocal rank fusion, then reranks them if asked. Returns (the hits, whether they may be cached).
+        """
+        if lexical is not None:
+            hits = reciprocal_rank_fusion([hits, lexical.result()], candidates)
+        if not rerank:
+            return hits, True
+        hits = list(hits)
+        return self.reranker.rerank(
+            query,
+            hits,
+            hydrate_hits(collection, hits, CONTEXT_FIELDS),
+            top_k,
+            budget_ms,
+            embeddings=lambda: stored_embeddings(collection, hits),
+        )
+
+    def hydrate(self, location, hits, fields):
+        """
+        The documents of hits of a location with the given fields (e.g. ["name", "addr_full"]), in order,
+        gathered in one batch from its document store, with None for hits it does not know
+        """
+        return hydrate_hits(self._collection(location), hits, fields)
+
+    def _prefilter(self, collection, geo=None, categories=None):
+        """
+        The search() keyword arguments applying the geo and category filters before vector scoring
+        (the filters themselves for local collections, a boolean expr for Milvus collections), and the
+        RoaringBitmap of rows the hits still have to be filtered against when the category filter was
+        too broad for an expr (see CategoryIndex.milvus_expr), or None
+        """
+        if isinstance(collection, LocalCollection):
+            return {"geo": geo, "categories": categories}, None
+        exprs = []
+        category_rows = None
+        if geo is not None:
+            exprs.append(geo.milvus_expr())
+        if categories is not None:
+            index = category_index_of(collection)
+            expr = index.milvus_expr(categories)
+            if expr is None:
+                category_rows = index.matching(categories)
+            else:
+                exprs.append(expr)
+        prefilter = (
+            {"expr": " && ".join(f"({expr})" for expr in exprs)} if exprs else {}
+        )
+        return prefilter, category_rows
+
+    def _category_fetch(self, collection, limit, category_rows, geo=None):
+        """
+        How many hits to fetch so that about limit of them pass a post-filter matching category_rows
+        """
+        share = max(len(category_rows), 1) / category_index_of(collection).n_docs
+        # geo searches fetch GEO_OVERSAMPLE times more
+        most = MILVUS_MAX_TOPK // (GEO_OVERSAMPLE if geo is not None else 1)
+        return min(most, max(limit, math.ceil(CATEGORY_OVERSAMPLE * limit / share)))
+
+    def _filter_categories(self, collection, hits, category_rows, limit):
+        """
+        The first limit hits whose row is in category_rows
+        """
+        hits = list(hits)
+        store = doc_store_of(collection)
+        rows = [store.row_of(hit.id) for hit in hits]
+        keep = category_rows.contains([-1 if row is None else row for row in rows])
+        return [hit for hit, kept in zip(hits, keep) if kept][:limit]
+
+    def _lexical_search(self, location, query, limit, geo=None, categories=None):
+        """
+        The limit best BM25 matches of the query in a location, as hits, restricted to the rows passing
+        the geo and category filters
+        """
+        collection = self._collection(location)
+        index = lexical_index_of(collection)
+        if index is None:
+            return []
+        if isinstance(collection, LocalCollection):
+            allowed = collection.allowed_rows(geo, categories)
+        else:
+            allowed = None
+            if geo is not None:
+                allowed = np.flatnonzero(
+                    geo.contains(index.batch["latitude"], index.batch["longitude"])
+                )
+            if categories is not None:
+                rows = category_index_of(collection).matching(categories).to_rows()
+                allowed = (
+                    rows
+                    if allowed is None
+                    else np.intersect1d(allowed, rows, assume_unique=True)
+                )
+        rows, scores = index.search(query, limit, allowed)
+        output_fields = OUTPUT_FIELDS if geo is None else GEO_OUTPUT_FIELDS
+        return batch_hits(index.batch, rows, -scores, output_fields)
+
+    def _geo_search(
+        self, collection, query_embeddings, top_k, geo, geo_weight, prefilter
+    ):
+        """
+        Searches with the geo (and category) prefilter, then reranks the candidates by blended vector and
+        great-circle distance
+        """
+        # Milvus only filters by bounding box, so a radius drops the hits in its corners afterwards
+        oversample = geo_weight > 0 or geo.center is not None
+        results = collection.search(
+            query_embeddings,
+            "embedding",
+            search_params_for(collection.index_name),
+            limit=top_k * GEO_OVERSAMPLE if oversample else top_k,
+            output_fields=GEO_OUTPUT_FIELDS,
+            **prefilter,
+        )
+        reranked = []
+        for hits in results:
+            hits = list(hits)
+            latitudes = np.array(
+                [hit.entity.get("latitude") for hit in hits], dtype=np.float64
+            )
+            longitudes = np.array(
+                [hit.entity.get("longitude") for hit in hits], dtype=np.float64
+            )
+            # Milvus only applied the bounding box
+            inside = np.flatnonzero(geo.contains(latitudes, longitudes))
+            scores = blend_scores(
+                np.array([hits[i].distance for i in inside], dtype=np.float64),
+                geo.distances(latitudes[inside], longitudes[inside]),
+                geo_weight,
+                geo.scale_m(),
+            )
+            reranked.append([hits[inside[i]] for i in np.argsort(scores)[:top_k]])
+        return reranked
+
+    def search_many(
+        self,
+        collections,
+        queries,
+        top_k=5,
+        timeout=None,
+        hybrid=HYBRID_SEARCH,
+        rerank=RERANK,
+        rerank_budget_ms=None,
+    ):
+        """
+        Searches many queries at once: all uncached queries are embedded in one encoder pass, then each
+        collection gets one vectorized search per SEARCH_MANY_CHUNK of its queries.
+
+        hybrid and rerank rank each query as search() does (and share its result cache), so offline
+        evaluations and log replays score the ranking users get; geo and category filters are not supported.
+
+        collections is either one location for every query, or a list of locations parallel to queries.
+        Returns one list of hits per query, in the order of queries.
+        """
+        if isinstance(collections, str):
+            collections = [collections] * len(queries)
+        logging.info(
+            f"Searching {len(queries)} queries across {len(set(collections))} collections..."
+        )
+        start = time.time()
+        keys = [
+            self._result_key(collection, query, top_k, hybrid=hybrid, rerank=rerank)
+            for collection, query in zip(collections, queries)
+        ]
+        # cached under the same keys as search(), so in its shape: a list holding the query's hit list
+        cached = [self.results.get(key) for key in keys]
+        results = [None if hits is None else hits[0] for hits in cached]
+        uncached = [position for position, hits in enumerate(results) if hits is None]
+        candidates = max(top_k, RERANK_CANDIDATES) if rerank else top_k
+        limit = candidates * HYBRID_OVERSAMPLE if hybrid else candidates
+        lexical = {}
+        if hybrid:
+            for position in uncached:
+                lexical[position] = self._lexical_executor.submit(
+                    self._lexical_search,
+                    collections[position],
+                    queries[position],
+                    limit,
+                )
+        query_embeddings = self._embed_queries([queries[i] for i in uncached])
+
+        rows_by_collection = {}
+        for row, position in enumerate(uncached):
+            rows_by_collection.setdefault(collections[position], []).append(row)
+
+        for collection, rows in rows_by_collection.items():
+            for chunk_start in range(0, len(rows), SEARCH_MANY_CHUNK):
+                chunk = rows[chunk_start : chunk_start + SEARCH_MANY_CHUNK]
+                opened = self._collection(collection)
+                chunk_results = opened.search(
+                    query_embeddings[chunk],
+                    "embedding",
+                    search_params_for(opened.index_name),
+                    limit=limit,
+                    output_fields=OUTPUT_FIELDS,
+                    timeout=timeout,
+                )
+                for row, hits in zip(chunk, chunk_results):
+                    position = uncached[row]
+                    hits, cacheable = self._fuse_and_rerank(
+                        opened,
+                        queries[position],
+                        hits,
+                        lexical.get(position),
+                        candidates,
+                        top_k,
+                        rerank,
+                        rerank_budget_ms,
+                    )
+                    results[position] = hits
+                    if cacheable:
+                        self.results.put(keys[position], [hits])
+        end = time.time()
+        logging.info(
+            f"\t{len(queries) - len(uncached)} cached, embedding {len(uncached)} queries + vectorDB lookup time: {(end - start)} seconds"
+        )
+        return results
@@ -0,0 +1,116 @@
+import logging
+import os
+from concurrent.futures import Future
+
+import numpy as np
+
+from nlp.micro_batching import MicroBatcher
+
+logging.basicConfig(level=logging.INFO)
+
+# requests classified together in one forward pass, at most
+ZERO_SHOT_MAX_BATCH = int(os.environ.get("ZERO_SHOT_MAX_BATCH", "16"))
+# milliseconds the worker waits for more requests after the first one of a batch arrives
+ZERO_SHOT_MAX_WAIT_MS = float(os.environ.get("ZERO_SHOT_MAX_WAIT_MS", "5"))
+# the hypothesis each label is slotted into, as in the transformers zero-shot pipeline
+HYPOTHESIS_TEMPLATE = "This example is {}."
+
+
+def _softmax(logits, axis=-1):
+    exponentials = np.exp(logits - logits.max(axis=axis, keepdims=True))
+    return exponentials / exponentials.sum(axis=axis, keepdims=True)
+
+
+class ZeroShotBatcher(MicroBatcher):
+    """
+    Queues zero-shot classification requests from any number of threads, and classifies them in batches.
+
+    A worker thread (see nlp.micro_batching) takes the first queued request, waits up to max_wait_ms for
+    others (up to max_batch requests), then runs one padded forward pass of the NLI model over every
+    (text, hypothesis) pair of the batch, and resolves each request's future with the same output the
+    transformers pipeline gives. stats() reports queue waits and batch fill.
+
+    get_pipeline returns the transformers zero-shot pipeline whose model and tokenizer are used.
+    """
+
+    def __init__(
+        self,
+        get_pipeline,
+        max_batch=ZERO_SHOT_MAX_BATCH,
+        max_wait_ms=ZERO_SHOT_MAX_WAIT_MS,
+    ):
+        super().__init__(max_batch, max_wait_ms, "zero-shot-batcher")
+        self.get_pipeline = get_pipeline
+
+    def submit(self, text, labels, multi_label=False):
+        """
+        Queues a request; returns a Future of its {"sequence", "labels", "scores"} output
+        """
+        future = Future()
+        self.put((text, list(labels), multi_label, future))
+        return future
+
+    def classify(self, text, labels, multi_label=False, timeout=None):
+        return self.submit(text, labels, multi_label).result(timeout)
+
+    def process_batch(self, batch):
+        batch = [
+            request for request in batch if request[3].set_running_or_notify_cancel()
+        ]
+        if not batch:
+            return
+        for request, output in zip(batch, self._classify_batch(batch)):
+            request[3].set_result(output)
+
+    def fail_batch(self, batch, error):
+        for request in batch:
+            if not request[3].done():
+                request[3].set_exception(error)
+
+    def _forward(self, premises, hypotheses):
+        """
+        The NLI logits of every (premise, hypothesis) pair, padded into one batch, and the model's label ids
+        """
+        import torch
+
+        pipeline = self.get_pipeline()
+        inputs = pipeline.tokenizer(
+            premises,
+            hypotheses,
+            padding=True,
+            truncation="only_first",
+            return_tensors="pt",
+        ).to(pipeline.model.device)
+        with torch.no_grad():
+            logits = pipeline.model(**inputs).logits
+        return logits.float().cpu().numpy(), pipeline.model.config.label2id
+
+    def _classify_batch(self, batch):
+        premises, hypotheses = [], []
+        for text, labels, _, _ in batch:
+            premises.extend([text] * len(labels))
+            hypotheses.extend(HYPOTHESIS_TEMPLATE.format(label) for label in labels)
+        logits, label2id = self._forward(premises, hypotheses)
+        ids = {label.lower(): i for label, i in label2id.items()}
+        entailment = next(i for label, i in ids.items() if label.startswith("entail"))
+        contradiction = next(
+            i for label, i in ids.items() if label.startswith("contradict")
+        )
+
+        outputs, position = [], 0
+        for text, labels, multi_label, _ in batch:
+            pair_logits = logits[position : position + len(labels)]
+            position += len(labels)
+            if multi_label or len(labels) == 1:
+                scores = _softmax(pair_logits[:, [contradiction, entailment]])[:, 1]
+            else:
+                scores = _softmax(pair_logits[:, entailment])
+            order = np.argsort(-scores, kind="stable")
+            outputs.append(
+                {
+                    "sequence": text,
+                    "labels": [labels[i] for i in order],
+                    "scores": [float(scores[i]) for i in order],
+                }
+            )
+        return outputs
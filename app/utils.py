@@ -1,126 +1,176 @@
-import json
-import sentence_transformers
+import os
+import threading
+import numpy as np
 import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from nlp.embedding_cache import EmbeddingCache
+from nlp.embedding_service import EmbeddingService
+from nlp.poi_formats import PoiBatch
+from nlp.poi_formats import iter_poi_batches
 
 logging.basicConfig(level=logging.INFO)
 
-EMBEDDING_MODEL = sentence_transformers.SentenceTransformer("all-MiniLM-L6-v2")
-
-
-def _load_dc_poi_format(filepath, duplication=1):
-    data = []
-    names = []
-    categories = []
-    descriptions = []
-    with open(filepath, "r") as f:
-        for line in f:
-            for i in range(duplication):
-                json_line = json.loads(line)
-                if "addr:full" not in json_line["properties"]:
-                    json_line["properties"]["addr:full"] = ""
-                if "addr:street" not in json_line["properties"]:
-                    json_line["properties"]["addr:street"] = ""
-                name = json_line["properties"]["name"]
-                category = " and ".join(
-                    json_line["properties"]["mapbox:search:categories"].split(";")
-                )
-                description = ""
-                if "description" in json_line["properties"]:
-                    description = json_line["properties"]["tripadvisor"]["description"]
-                descriptions.append(description)
-                names.append(name)
-                categories.append(category)
-                data.append(
-                    {
-                        "mbx_id": str(json_line["properties"]["mapbox:id"]),
-                        "latitude": str(json_line["geometry"]["coordinates"][0]),
-                        "longitude": str(json_line["geometry"]["coordinates"][1]),
-                        "name": str(name),
-                        "addr_full": str(json_line["properties"]["addr:full"]),
-                        "addr_street": str(json_line["properties"]["addr:street"]),
-                        "category": str(category),
-                        "description": str(description),
-                    }
-                )
-    contexts = []
-    for name_text, category_text in zip(names, categories):
-        encoding_context = f"The place name is {name_text} and it is of type {category_text} and is described as {description}"
-        contexts.append(encoding_context)
-    embeddings = embed(contexts)
-    for i, embedding in enumerate(embeddings):
-        data[i]["embedding"] = embedding
-
-    return data
-
-
-def _load_simple_poi_format(filepath):
-    data = []
-    names = []
-    categories = []
-    descriptions = []
-    with open(filepath, "r") as fp:
-        for line in fp:
-            json_line = json.loads(line)
-            description = json_line["description"]
-            name = json_line["name"]
-            category = json_line["category"]
-            descriptions.append(description)
-            names.append(name)
-            categories.append(category)
-            data.append(
-                {
-                    "mbx_id": str(json_line["mbx_id"]),
-                    "latitude": "N/A",
-                    "longitude": "N/A",
-                    "name": str(name),
-                    "addr_full": "N/A",
-                    "addr_street": "N/A",
-                    "category": str(category),
-                    "description": str(description),
-                }
+EMBEDDING_MODEL_NAME = "all-MiniLM-L6-v2"
+# output size of EMBEDDING_MODEL_NAME, known up front so that nothing has to load the model to size arrays
+EMBEDDING_DIM = 384
+
+# set EMBEDDING_CACHE_DIR to an empty string to disable the on-disk embedding cache
+EMBEDDING_CACHE_DIR = os.environ.get("EMBEDDING_CACHE_DIR", ".cache/embeddings")
+
+# the model and the cache are created on first use, so importing this module stays cheap
+_embedding_model = None
+_embedding_cache = None
+_lazy_lock = threading.Lock()
+
+
+def get_embedding_model():
+    """
+    Returns the sentence encoder, loading it on the first call
+    """
+    global _embedding_model
+    with _lazy_lock:
+        if _embedding_model is None:
+            import sentence_transformers
+
+            _embedding_model = sentence_transformers.SentenceTransformer(
+                EMBEDDING_MODEL_NAME
             )
-    contexts = []
-    for name_text, category_text in zip(names, categories):
-        encoding_context = f"The place name is {name_text} and it is of type {category_text} and is described as {description}"
-        contexts.append(encoding_context)
-    embeddings = embed(contexts)
-    for i, embedding in enumerate(embeddings):
-        data[i]["embedding"] = embedding
+        return _embedding_model
 
-    return data
 
+def get_embedding_cache():
+    """
+    Returns the on-disk embedding cache, opening it on the first call, or None when it is disabled
+    """
+    global _embedding_cache
+    if not EMBEDDING_CACHE_DIR:
+        return None
+    with _lazy_lock:
+        if _embedding_cache is None:
+            _embedding_cache = EmbeddingCache(
+                EMBEDDING_CACHE_DIR, EMBEDDING_MODEL_NAME, EMBEDDING_DIM
+            )
+        return _embedding_cache
+
+
+# every embedding of the process is computed through this service, which batches concurrent callers
+# together (see nlp.embedding_service); EMBEDDING_SERVICE.stats() reports throughput and latency
+EMBEDDING_SERVICE = EmbeddingService(get_embedding_model, EMBEDDING_DIM)
 
-def load_data(filepath, duplication=1):
+DEFAULT_BATCH_SIZE = 1000
+
+
+def encoding_contexts(batch):
+    """
+    Builds the text that gets embedded for each POI of a PoiBatch
+    """
+    return [
+        f"The place name is {name_text} and it is of type {category_text} and is described as {description_text}"
+        for name_text, category_text, description_text in zip(
+            batch["name"].to_list(),
+            batch["category"].to_list(),
+            batch["description"].to_list(),
+        )
+    ]
+
+
+def embed_batch(batch, update_cache=True):
+    """
+    Embeds a PoiBatch in place, setting its float32 embedding matrix
+    """
+    batch.embedding = np.asarray(
+        embed(encoding_contexts(batch), update_cache=update_cache), dtype=np.float32
+    )
+    return batch
+
+
+def load_data(filepath, duplication=1, fmt=None):
     """
     Loads data from a json file, cleans fields, and embeds text.
 
-    The DC dataset has a particular format given that it was sampled from Mapbox's POI dataset.
-    The Duvall dataset was hand curated and has a simpler format.
+    fmt names the POI format adapter to parse the file with (see nlp.poi_formats); it is detected when not given.
+    Everything is held in one PoiBatch; use iter_embedded_batches for large files.
     """
-    if "us_dc_georgetown_with_details.json" in filepath:
-        return _load_dc_poi_format(filepath, duplication=duplication)
-    else:
-        return _load_simple_poi_format(filepath)
+    batches = list(
+        iter_poi_batches(filepath, DEFAULT_BATCH_SIZE, duplication=duplication, fmt=fmt)
+    )
+    return embed_batch(PoiBatch.concat(batches))
 
 
-def embed(texts):
+def iter_batches(filepath, batch_size=DEFAULT_BATCH_SIZE, duplication=1, fmt=None):
+    """
+    Streams cleaned (but not yet embedded) PoiBatches of at most batch_size rows from a json file
+    """
+    return iter_poi_batches(filepath, batch_size, duplication=duplication, fmt=fmt)
+
+
+def iter_embedded_batches(
+    filepath, batch_size=DEFAULT_BATCH_SIZE, duplication=1, fmt=None
+):
+    """
+    Streams embedded PoiBatches of at most batch_size rows from a json file.
+
+    Batch N+1 is embedded on a background thread while the caller consumes (e.g. inserts) batch N,
+    so only a couple of batches are held in memory regardless of the file size.
+    """
+    with ThreadPoolExecutor(max_workers=1) as executor:
+        pending = None
+        for batch in iter_batches(
+            filepath, batch_size=batch_size, duplication=duplication, fmt=fmt
+        ):
+            future = executor.submit(embed_batch, batch)
+            if pending is not None:
+                yield pending.result()
+            pending = future
+        if pending is not None:
+            yield pending.result()
+
+
+def embed(texts, use_cache=True, update_cache=True):
     """
     embeds text using the universal sentence encoder
+
+    Texts already in the on-disk embedding cache are not re-encoded; only the misses go through the model.
+    Pass update_cache=False from worker processes, so that only the parent process writes to the cache.
+    texts is a list of strings; a single string has to be wrapped in a list.
     """
-    logging.info(f"Embedding {len(texts)} contexts")
-    embeddings = EMBEDDING_MODEL.encode(texts)
+    if isinstance(texts, str):
+        raise TypeError("embed() takes a list of texts, not a single string")
+    cache = get_embedding_cache() if use_cache else None
+    if cache is None:
+        logging.info(f"Embedding {len(texts)} contexts")
+        return EMBEDDING_SERVICE.encode(texts)
+    embeddings, misses = cache.lookup(texts)
+    logging.info(
+        f"Embedding {len(misses)} contexts ({len(texts) - len(misses)} of {len(texts)} cached)"
+    )
+    if misses:
+        miss_texts = [texts[i] for i in misses]
+        encoded = EMBEDDING_SERVICE.encode(miss_texts)
+        embeddings[misses] = encoded
+        if update_cache:
+            cache.add(miss_texts, encoded)
     return embeddings
 
 
-def parse_results(result):
+# POI fields shown to the LLM for each recommendation, hydrated from the document store of the location
+PROMPT_FIELDS = os.environ.get("PROMPT_FIELDS", "name").split(",")
+
+
+def parse_results(documents, fields=PROMPT_FIELDS):
     """
-    Take the results from a vectorDB query, and turn it into a context string for the LLM query
+    Take the hydrated documents of vectorDB hits (see VectorDB.hydrate), and turn them into context strings for the LLM query
     """
     results = []
-    logging.info(f"Found {len(result)} results")
-    for hits in result:
-        logging.info(f"Found {len(hits)} hits")
-        for hit in hits:
-            logging.info(f"Found {hit}")
-            results.append(f"place name: {hit.entity.get('name')}")
+    logging.info(f"Found {len(documents)} hits")
+    for document in documents:
+        logging.info(f"Found {document}")
+        if document is not None:
+            results.append(
+                ", ".join(
+                    f"place {field.replace('_', ' ')}: {document[field]}"
+                    for field in fields
+                )
+            )
     return results
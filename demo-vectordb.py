@@ -6,6 +6,8 @@
 # 5. search, query, and hybrid search on entities
 # 6. delete entities by PK
 # 7. drop collection
+import os
+import sys
 import time
 
 import numpy as np
@@ -18,8 +20,10 @@ from pymilvus import (
     Collection,
 )
 import pandas as pd
-from app.utils import load_data
-from app.utils import embed
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "app"))
+from utils import load_data
+from utils import embed
 
 fmt = "\n=== {:30} ===\n"
 search_latency_fmt = "search latency = {:.4f}s"
@@ -119,8 +123,8 @@ fields = [
         is_primary=True,
         auto_id=False,
     ),
-    FieldSchema(name="latitude", dtype=DataType.VARCHAR, max_length=500),
-    FieldSchema(name="longitude", dtype=DataType.VARCHAR, max_length=500),
+    FieldSchema(name="latitude", dtype=DataType.DOUBLE),
+    FieldSchema(name="longitude", dtype=DataType.DOUBLE),
     FieldSchema(name="name", dtype=DataType.VARCHAR, max_length=2000),
     FieldSchema(name="addr_full", dtype=DataType.VARCHAR, max_length=2000),
     FieldSchema(name="addr_street", dtype=DataType.VARCHAR, max_length=500),
@@ -141,9 +145,11 @@ dc_pois = Collection("dc_pois", schema, consistency_level="Strong")
 # - or the existing primary key field from the entities if auto_id=False in the schema.
 
 print(fmt.format("Start inserting entities"))
-entities = load_data(filepath="data/us_dc_georgetown_with_details.json")
+entities = load_data(filepath="data/us_dc_georgetown_with_details.json", fmt="mapbox")
 
-insert_result = dc_pois.insert(pd.DataFrame(entities))
+insert_result = dc_pois.insert(
+    pd.DataFrame(entities.to_pydict([field.name for field in fields]))
+)
 
 dc_pois.flush()
 print(f"Number of entities in Milvus: {dc_pois.num_entities}")  # check the num_entites
@@ -182,7 +188,7 @@ user_queries = [
     "a coffee shop that sells sandwiches",
     "a popular bar that has nightlife and a dinner menu",
 ]
-vectors_to_search = [embed(x) for x in user_queries]
+vectors_to_search = list(embed(user_queries))
 
 search_params = {
     "metric_type": "L2",
@@ -0,0 +1,39 @@
+import os
+import sys
+import zlib
+
+import numpy as np
+import pytest
+
+# the app imports its modules relative to app/, as with PYTHONPATH=app
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(__file__)), "app"))
+
+import utils  # noqa: E402
+
+
+class FakeEncoder:
+    """
+    Stands in for the sentence encoder: a deterministic vector per text, without loading a model
+    """
+
+    def encode(self, texts, batch_size=32):
+        return np.array(
+            [
+                np.random.default_rng(zlib.crc32(text.encode())).random(
+                    utils.EMBEDDING_DIM
+                )
+                for text in texts
+            ],
+            dtype=np.float32,
+        )
+
+
+@pytest.fixture
+def fake_encoder(monkeypatch):
+    """
+    Embeds with a FakeEncoder, without the on-disk embedding cache
+    """
+    encoder = FakeEncoder()
+    monkeypatch.setattr(utils, "_embedding_model", encoder)
+    monkeypatch.setattr(utils, "EMBEDDING_CACHE_DIR", "")
+    return encoder
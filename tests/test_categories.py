@@ -0,0 +1,90 @@
+import operator
+
+import numpy as np
+import pytest
+
+from nlp.categories import ARRAY_CONTAINER_LIMIT
+from nlp.categories import CategoryBuilder
+from nlp.categories import CategoryFilter
+from nlp.categories import RoaringBitmap
+from nlp.categories import load_category_index
+from nlp.categories import split_categories
+from nlp.poi_formats import PoiBatchBuilder
+
+
+def poi_batch(categories):
+    builder = PoiBatchBuilder()
+    for i, tokens in enumerate(categories):
+        builder.append((f"poi{i}", 0.0, 0.0, "", "", "", "", "", tokens))
+    return builder.build()
+
+
+# sparse and dense chunks, and rows past the first chunk
+ROWS = [3, 7, 70000] + list(range(140000, 140000 + ARRAY_CONTAINER_LIMIT + 10))
+OTHER = [7, 8, 70000, 140001, 200000]
+
+
+def test_bitmap_picks_a_container_per_chunk():
+    bitmap = RoaringBitmap.from_rows(ROWS)
+
+    assert bitmap.containers[0].dtype == np.uint16
+    assert bitmap.containers[2].dtype == bool
+    assert len(bitmap) == len(ROWS)
+    assert bitmap.to_rows().tolist() == ROWS
+
+
+@pytest.mark.parametrize("operation", [operator.or_, operator.and_, operator.sub])
+def test_bitmap_set_operations_match_python_sets(operation):
+    result = operation(RoaringBitmap.from_rows(ROWS), RoaringBitmap.from_rows(OTHER))
+
+    assert result.to_rows().tolist() == sorted(operation(set(ROWS), set(OTHER)))
+
+
+def test_bitmap_contains():
+    bitmap = RoaringBitmap.from_rows(ROWS)
+    probes = np.array([-1, 0, 3, 7, 8, 70000, 140005, 200000])
+
+    assert bitmap.contains(probes).tolist() == [
+        row in set(ROWS) for row in probes.tolist()
+    ]
+    assert RoaringBitmap().contains(probes).tolist() == [False] * len(probes)
+
+
+def test_split_categories_normalizes_tokens():
+    assert split_categories(" Coffee;cafe ;;BAR") == ["coffee", "cafe", "bar"]
+
+
+def test_filters_include_any_and_exclude_all():
+    batch = poi_batch(["coffee;cafe", "bar", "coffee;bar", "bakery", ""])
+    builder = CategoryBuilder(store_ids=True)
+    builder.add(batch.slice(0, 3))
+    builder.add(batch.slice(3, 5))
+    index = builder.build()
+
+    def rows(**kwargs):
+        return index.matching(CategoryFilter(**kwargs)).to_rows().tolist()
+
+    assert index.counts() == {"coffee": 2, "cafe": 1, "bar": 2, "bakery": 1}
+    assert rows(include=["Coffee", "bakery"]) == [0, 2, 3]
+    assert rows(exclude=["bar"]) == [0, 3, 4]
+    assert rows(include=["coffee"], exclude=["bar"]) == [0]
+    assert rows(include=["sushi"]) == []
+    assert index.milvus_expr(CategoryFilter(include=["bakery"])) == 'mbx_id in ["poi3"]'
+    # the complement is shorter
+    assert index.milvus_expr(CategoryFilter(exclude=["bakery"])) == (
+        'mbx_id not in ["poi3"]'
+    )
+
+
+def test_saved_index_matches_the_built_one(tmp_path):
+    builder = CategoryBuilder()
+    builder.add(poi_batch(["coffee", "bar", "coffee;bar"]))
+    index = builder.build()
+    index.save(str(tmp_path))
+
+    loaded = load_category_index(str(tmp_path), 3)
+
+    assert loaded.counts() == index.counts()
+    bar = CategoryFilter(include=["bar"])
+    assert loaded.matching(bar).to_rows().tolist() == [1, 2]
+    assert load_category_index(str(tmp_path / "missing"), 3) is None
@@ -0,0 +1,69 @@
+import math
+
+import numpy as np
+import pytest
+
+from nlp.geo import GeoFilter
+from nlp.geo import GridIndex
+from nlp.geo import blend_scores
+from nlp.geo import haversine
+
+# Duvall, WA
+CENTER = (47.742, -121.985)
+
+
+def test_haversine_distances():
+    # one degree of latitude is about 111 km everywhere
+    assert haversine(0.0, 0.0, 1.0, 0.0) == pytest.approx(111195, rel=1e-3)
+    # one degree of longitude shrinks with the cosine of the latitude
+    assert haversine(60.0, 0.0, 60.0, 1.0) == pytest.approx(111195 / 2, rel=1e-2)
+    assert haversine(*CENTER, *CENTER) == 0.0
+
+
+def test_radius_keeps_the_circle_not_its_box():
+    geo = GeoFilter.radius(*CENTER, 1000)
+    min_lat, min_lon, max_lat, max_lon = geo.box
+    latitudes = np.array([CENTER[0], max_lat, max_lat, np.nan])
+    longitudes = np.array([CENTER[1], CENTER[1], max_lon, CENTER[1]])
+
+    # the center, the edge of the circle, a corner of its box, and a POI without coordinates
+    inside = geo.contains(latitudes - 1e-9, longitudes)
+    assert inside.tolist() == [True, True, False, False]
+    assert geo.scale_m() == 1000
+
+
+def test_bounding_box_filter():
+    geo = GeoFilter.bounding_box(47.0, -122.5, 48.0, -121.5)
+
+    assert geo.contains([47.5, 48.5], [-122.0, -122.0]).tolist() == [True, False]
+    assert geo.reference() == (47.5, -122.0)
+    assert geo.milvus_expr() == (
+        "latitude >= 47.0 && latitude <= 48.0 && longitude >= -122.5 && longitude <= -121.5"
+    )
+    with pytest.raises(ValueError):
+        GeoFilter()
+
+
+def test_blend_scores_weights_distance_against_similarity():
+    vector, meters = np.array([0.2, 0.4]), np.array([900.0, 100.0])
+
+    assert blend_scores(vector, meters, 0.0, 1000).tolist() == vector.tolist()
+    blended = blend_scores(vector, meters, 0.5, 1000)
+    assert blended.tolist() == pytest.approx([0.55, 0.25])
+
+
+def test_grid_candidates_are_the_points_inside():
+    rng = np.random.default_rng(0)
+    latitudes = CENTER[0] + rng.uniform(-0.05, 0.05, 2000)
+    longitudes = CENTER[1] + rng.uniform(-0.05, 0.05, 2000)
+    latitudes[::10] = math.nan
+    grid = GridIndex(latitudes, longitudes)
+
+    for geo in (
+        GeoFilter.radius(*CENTER, 2000),
+        GeoFilter.bounding_box(47.73, -122.0, 47.75, -121.97),
+        # a box covering more cells than are worth looking up one by one
+        GeoFilter.bounding_box(-80.0, -170.0, 80.0, 170.0),
+    ):
+        expected = np.flatnonzero(geo.contains(latitudes, longitudes))
+        assert grid.candidates(geo).tolist() == expected.tolist()
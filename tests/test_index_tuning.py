@@ -0,0 +1,77 @@
+import numpy as np
+
+from nlp import index_tuning
+from nlp.index_tuning import candidate_configs
+from nlp.index_tuning import choose_config
+from nlp.index_tuning import load_index_config
+from nlp.index_tuning import pareto_front
+from nlp.index_tuning import sample_queries
+from nlp.index_tuning import tune_collection
+from nlp.local_index import LocalCollection
+from nlp.poi_formats import PoiBatchBuilder
+
+
+def row(name, recall, p50_ms):
+    return {"index": {"index_type": name}, "recall": recall, "p50_ms": p50_ms}
+
+
+ROWS = [
+    row("FLAT", 1.0, 9.0),
+    row("IVF_SLOW", 0.97, 10.0),
+    row("IVF_FAST", 0.96, 2.0),
+    row("IVF_FASTER", 0.90, 1.0),
+    row("HNSW", 0.99, 3.0),
+]
+
+
+def names(rows):
+    return [row["index"]["index_type"] for row in rows]
+
+
+def test_pareto_front_drops_dominated_configs():
+    assert names(pareto_front(ROWS)) == ["FLAT", "IVF_FAST", "IVF_FASTER", "HNSW"]
+
+
+def test_choose_config_takes_the_fastest_reaching_the_target():
+    assert names([choose_config(ROWS, 0.95)]) == ["IVF_FAST"]
+    assert names([choose_config(ROWS, 0.98)]) == ["HNSW"]
+    assert names([choose_config(ROWS, 0.8)]) == ["IVF_FASTER"]
+    # nothing reaches the target: the most accurate one
+    assert names([choose_config(ROWS[2:4], 0.99)]) == ["IVF_FAST"]
+
+
+def test_candidate_configs_start_with_exact_search():
+    configs = candidate_configs(10000)
+
+    assert configs[0][0]["index_type"] == "FLAT"
+    assert {index["index_type"] for index, _ in configs} == {
+        "FLAT",
+        "IVF_FLAT",
+        "IVF_SQ8",
+        "HNSW",
+    }
+    for index, search in configs:
+        assert index["metric_type"] == search["metric_type"] == "L2"
+        if index["index_type"].startswith("IVF"):
+            assert search["params"]["nprobe"] <= index["params"]["nlist"]
+
+
+def test_tuning_a_local_collection_saves_its_config(tmp_path, monkeypatch):
+    monkeypatch.setattr(index_tuning, "INDEX_CONFIG_DIR", str(tmp_path))
+    rng = np.random.default_rng(0)
+    builder = PoiBatchBuilder()
+    for i in range(400):
+        builder.append((f"poi{i}", 0.0, 0.0, "", "", "", "", "", ""))
+    batch = builder.build()
+    batch.embedding = rng.normal(size=(400, 8)).astype(np.float32)
+    collection = LocalCollection("town", batch)
+    queries = sample_queries(batch.embedding, 20)
+
+    config = tune_collection(collection, queries, k=5, target_recall=0.9)
+
+    assert queries.shape == (20, 8)
+    assert config["recall"] >= 0.9
+    assert config["index"]["index_type"] != "HNSW"
+    assert collection.index.index_type == config["index"]["index_type"]
+    assert load_index_config("town")["index"] == config["index"]
+    assert load_index_config("elsewhere") is None
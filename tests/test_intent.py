@@ -0,0 +1,117 @@
+import numpy as np
+import pytest
+
+from nlp import classifiers
+from nlp import intent
+from nlp.intent import PrototypeClassifier
+from nlp.intent import calibration_report
+from nlp.intent import fit_platt
+from nlp.intent import load_examples
+
+
+def two_intents(n=40, dim=16, seed=0):
+    """
+    Embeddings of n messages per intent around two directions, labels 1 for the first
+    """
+    rng = np.random.default_rng(seed)
+    directions = np.eye(dim)[:2] * 3
+    embeddings = np.concatenate(
+        [direction + rng.normal(size=(n, dim)) for direction in directions]
+    )
+    return embeddings, np.array([1] * n + [0] * n)
+
+
+def test_shipped_examples_cover_both_intents():
+    texts, labels = load_examples()
+
+    assert len(texts) == len(labels)
+    assert 0 < labels.sum() < len(labels)
+
+
+def test_platt_scaling_is_increasing_in_the_margin():
+    margins = np.array([-2.0, -1.0, -0.5, 0.5, 1.0, 2.0])
+
+    a, b = fit_platt(margins, np.array([0, 0, 0, 1, 1, 1]))
+
+    assert a > 0
+    assert abs(b) < 1e-6
+
+
+def test_prototypes_separate_the_intents():
+    embeddings, labels = two_intents()
+
+    classifier = PrototypeClassifier().fit(embeddings, labels)
+
+    probabilities = classifier.predict_proba(embeddings)
+    assert ((probabilities > 0.5) == (labels == 1)).mean() >= 0.95
+    # a single embedding of shape (dim,) or (1, dim)
+    assert classifier.predict_proba(embeddings[0]).shape == (1,)
+    # the prototypes are unit vectors: scaling a message does not change its probability
+    assert classifier.predict_proba(5 * embeddings[:3]) == pytest.approx(
+        probabilities[:3]
+    )
+
+
+def test_calibration_report_measures_the_cascade():
+    embeddings, labels = two_intents()
+    texts = [f"message {i}" for i in range(len(labels))]
+
+    report = calibration_report(
+        texts, labels, embeddings, 0.9, 0.1, zero_shot_scores=labels * 0.95
+    )
+
+    assert report["examples"] == 80 and report["positives"] == 40
+    assert [row["accept"] for row in report["sweep"]][0] == 0.5
+    assert 0 <= report["configured"]["escalated"] <= 1
+    assert report["zero_shot"]["precision"] == 1.0
+    assert report["configured"]["cascade_precision"] >= 0.9
+
+
+class FixedPrototypes:
+    def __init__(self, probability):
+        self.probability = probability
+
+    def predict_proba(self, embeddings):
+        return np.array([self.probability])
+
+
+@pytest.mark.parametrize(
+    "probability, zero_shot_score, expected, escalated",
+    [
+        (0.95, 0.0, True, False),
+        (0.05, 1.0, False, False),
+        (0.5, 0.95, True, True),
+        (0.5, 0.5, False, True),
+    ],
+)
+def test_cascade_only_escalates_unsure_messages(
+    monkeypatch, probability, zero_shot_score, expected, escalated
+):
+    calls = []
+    monkeypatch.setattr(classifiers, "INTENT_CLASSIFIER", "cascade")
+    monkeypatch.setattr(
+        classifiers,
+        "get_prototype_classifier",
+        lambda: FixedPrototypes(probability),
+    )
+    monkeypatch.setattr(
+        classifiers,
+        "recommendation_score",
+        lambda text: calls.append(text) or zero_shot_score,
+    )
+
+    detected = classifiers.is_recommendation_request(
+        "any coffee nearby?", embedding=np.zeros((1, 4))
+    )
+
+    assert detected == expected
+    assert calls == (["any coffee nearby?"] if escalated else [])
+
+
+def test_prototype_classifier_is_fitted_once(monkeypatch, fake_encoder):
+    monkeypatch.setattr(intent, "_prototype_classifier", None)
+
+    classifier = intent.get_prototype_classifier()
+
+    assert intent.get_prototype_classifier() is classifier
+    assert classifier.prototypes.shape[0] == 2
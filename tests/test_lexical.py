@@ -0,0 +1,81 @@
+import numpy as np
+
+from nlp.lexical import BM25Builder
+from nlp.lexical import load_bm25
+from nlp.lexical import reciprocal_rank_fusion
+from nlp.lexical import tokenize
+from nlp.local_index import LocalHit
+from nlp.poi_formats import PoiBatchBuilder
+
+
+def poi_batch(pois):
+    builder = PoiBatchBuilder()
+    for i, (name, category, description) in enumerate(pois):
+        builder.append(
+            (f"poi{i}", 47.0, -122.0, name, "", "", category, description, category)
+        )
+    return builder.build()
+
+
+POIS = [
+    ("Grateful Bread", "bakery", "Fresh bread and pastries"),
+    ("Duvall Tavern", "bar", "Burgers, beer and a bread pudding"),
+    ("Valley Coffee", "coffee", "Espresso drinks"),
+    ("Bread & Butter Cafe", "cafe", "Breakfast all day"),
+]
+
+
+def hits(ids, distance=1.0):
+    return [LocalHit(mbx_id, distance, {"mbx_id": mbx_id}) for mbx_id in ids]
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize("Rocky's Pizza, 24/7") == ["rocky", "s", "pizza", "24", "7"]
+
+
+def test_bm25_prefers_names_and_rare_terms():
+    batch = poi_batch(POIS)
+    builder = BM25Builder()
+    builder.add(batch.slice(0, 2))
+    builder.add(batch.slice(2, 4))
+    index = builder.build(batch)
+
+    rows, scores = index.search("grateful bread", 10)
+
+    assert rows.tolist()[0] == 0
+    assert set(rows.tolist()) == {0, 1, 3}
+    assert np.all(np.diff(scores) <= 0)
+    assert index.search("sushi", 10)[0].tolist() == []
+    assert index.search("bread", 10, allowed=np.array([1, 2]))[0].tolist() == [1]
+
+
+def test_stored_index_round_trips(tmp_path):
+    batch = poi_batch(POIS)
+    builder = BM25Builder(store=True)
+    builder.add(batch)
+    index = builder.build()
+    index.save(str(tmp_path))
+
+    loaded = load_bm25(str(tmp_path), index.batch)
+
+    assert loaded.batch["mbx_id"].to_list() == batch["mbx_id"].to_list()
+    for query in ("bread", "coffee espresso", "tavern"):
+        assert loaded.search(query, 3)[0].tolist() == index.search(query, 3)[0].tolist()
+    assert load_bm25(str(tmp_path / "missing"), batch) is None
+
+
+def test_reciprocal_rank_fusion_favours_hits_in_both_rankings():
+    vector = hits(["a", "b", "c"], distance=0.5)
+    lexical = hits(["c", "d"], distance=-12.0)
+
+    fused = reciprocal_rank_fusion([vector, lexical], limit=3, k=60)
+
+    # b and d tie, and keep the order they were first seen in
+    assert [hit.id for hit in fused] == ["c", "a", "b"]
+    # every hit gets minus its fused score as distance, whichever list it came from
+    assert [hit.distance for hit in fused] == [
+        -(1 / 63 + 1 / 61),
+        -1 / 61,
+        -1 / 62,
+    ]
+    assert fused[0].entity == {"mbx_id": "c"}
@@ -0,0 +1,115 @@
+import numpy as np
+import pytest
+
+from nlp.categories import CategoryFilter
+from nlp.geo import GeoFilter
+from nlp.local_index import BruteForceIndex
+from nlp.local_index import IVFIndex
+from nlp.local_index import LocalCollection
+from nlp.local_index import kmeans
+from nlp.poi_formats import PoiBatchBuilder
+from nlp.quantization import Int8Quantizer
+from nlp.quantization import recall_at_k
+
+
+def clustered_vectors(n=3000, dim=16, clusters=30, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim)) * 3
+    return (centers[rng.integers(clusters, size=n)] + rng.normal(size=(n, dim))).astype(
+        np.float32
+    )
+
+
+def poi_batch(n, dim=16, seed=0):
+    """
+    n POIs along a line of latitude east of (47.0, -122.0), every third one a coffee shop
+    """
+    builder = PoiBatchBuilder()
+    for i in range(n):
+        category = "coffee" if i % 3 == 0 else "bar"
+        builder.append(
+            (f"poi{i}", 47.0, -122.0 + i * 0.001, f"Place {i}", "", "", category, "")
+            + (category,)
+        )
+    batch = builder.build()
+    batch.embedding = clustered_vectors(n, dim, seed=seed)
+    return batch
+
+
+def test_kmeans_finds_separated_clusters():
+    rng = np.random.default_rng(0)
+    vectors = np.concatenate(
+        [rng.normal(loc, 0.1, size=(100, 2)) for loc in (-10.0, 0.0, 10.0)]
+    ).astype(np.float32)
+
+    centroids = kmeans(vectors, 3)
+
+    assert sorted(np.round(centroids[:, 0]).tolist()) == [-10.0, 0.0, 10.0]
+
+
+@pytest.mark.parametrize("quantizer", [None, Int8Quantizer()])
+def test_ivf_recall_grows_with_nprobe(quantizer):
+    vectors = clustered_vectors()
+    queries = vectors[:100] + 0.1
+    expected, _ = BruteForceIndex(vectors).search(queries, 10)
+    index = IVFIndex(vectors, nlist=32, quantizer=quantizer)
+
+    one, _ = index.search(queries, 10, {"nprobe": 1})
+    all_lists, distances = index.search(queries, 10, {"nprobe": 32})
+
+    assert recall_at_k(all_lists, expected) >= (0.9 if quantizer else 0.999)
+    assert recall_at_k(one, expected) <= recall_at_k(all_lists, expected)
+    assert np.all(np.diff(distances[0]) >= 0)
+
+
+def test_local_collection_switches_index_types():
+    collection = LocalCollection("town", poi_batch(500))
+    assert not collection.has_index()
+
+    collection.create_index(
+        "embedding", {"index_type": "IVF_FLAT", "params": {"nlist": 8}}
+    )
+    assert collection.has_index() and collection.index.index_type == "IVF_FLAT"
+    collection.create_index(
+        "embedding", {"index_type": "IVF_SQ8", "params": {"nlist": 8}}
+    )
+    assert collection.index.index_type == "IVF_SQ8"
+    with pytest.raises(ValueError):
+        collection.create_index("embedding", {"index_type": "HNSW", "params": {}})
+    collection.drop_index()
+    assert not collection.has_index()
+
+
+def test_local_search_returns_hits_like_milvus():
+    batch = poi_batch(200)
+    collection = LocalCollection("town", batch)
+
+    results = collection.search(
+        batch.embedding[:2], "embedding", {}, limit=5, output_fields=["name"]
+    )
+
+    assert len(results) == 2
+    assert [hit.id for hit in results[0]][0] == "poi0"
+    assert results[1][0].entity["name"] == "Place 1"
+    assert results[0][0].distance == pytest.approx(0.0, abs=1e-3)
+
+
+def test_local_search_scores_only_rows_passing_the_filters():
+    batch = poi_batch(200)
+    collection = LocalCollection("town", batch)
+    # POIs are about 76 m apart, so the radius covers a stretch of the line around the eighth one
+    geo = GeoFilter.radius(47.0, -122.0 + 0.007, 1200)
+
+    hits = collection.search(
+        batch.embedding[:1],
+        "embedding",
+        {},
+        limit=100,
+        geo=geo,
+        categories=CategoryFilter(include=["coffee"]),
+    )[0]
+
+    rows = sorted(int(hit.id[3:]) for hit in hits)
+    inside = np.flatnonzero(geo.contains(batch["latitude"], batch["longitude"]))
+    assert rows == [row for row in inside if row % 3 == 0]
+    assert rows
@@ -0,0 +1,95 @@
+import threading
+from concurrent.futures import Future
+
+import pytest
+
+from nlp.micro_batching import MicroBatcher
+
+
+class Collector(MicroBatcher):
+    """
+    Records the batches it is handed; its first batch waits for release, so later items queue up behind it
+    """
+
+    def __init__(self, max_batch, fail=False):
+        super().__init__(max_batch, 0, "test-batcher", unit="items")
+        self.started = threading.Event()
+        self.release = threading.Event()
+        self.fail = fail
+        self.batches_seen = []
+        self.failed = []
+
+    def process_batch(self, items):
+        self.started.set()
+        self.release.wait()
+        self.batches_seen.append([item for item, _ in items])
+        if self.fail:
+            raise RuntimeError("boom")
+        for item, future in items:
+            future.set_result(item)
+
+    def fail_batch(self, items, error):
+        self.failed.append([item for item, _ in items])
+        for _, future in items:
+            future.set_exception(error)
+
+    def submit(self, item, size=1, priority=0):
+        future = Future()
+        self.put((item, future), size, priority)
+        return future
+
+
+def queue_behind_blocker(batcher, items):
+    """
+    Queue items while the worker is busy with a first one, then let it go on
+    """
+    blocker = batcher.submit("blocker")
+    batcher.started.wait(timeout=5)
+    futures = [batcher.submit(*item) for item in items]
+    batcher.release.set()
+    return [blocker] + futures
+
+
+def test_items_are_batched_by_size_then_priority():
+    batcher = Collector(max_batch=4)
+
+    futures = queue_behind_blocker(
+        batcher, [("a", 1), ("b", 2), ("urgent", 1, -1), ("c", 1), ("d", 1)]
+    )
+
+    assert [future.result(timeout=5) for future in futures] == [
+        "blocker",
+        "a",
+        "b",
+        "urgent",
+        "c",
+        "d",
+    ]
+    # "urgent" jumps the queue; "b" counts for two of the four units
+    assert batcher.batches_seen == [["blocker"], ["urgent", "a", "b"], ["c", "d"]]
+    stats = batcher.stats()
+    assert stats["items"] == 7 and stats["batches"] == 3
+    assert stats["queued"] == 0
+    assert stats["batch_size_mean"] == pytest.approx(7 / 3)
+    assert stats["batch_fill"] == pytest.approx(7 / 12)
+    assert stats["items_per_second"] > 0
+
+
+def test_a_failing_batch_fails_its_items_only():
+    batcher = Collector(max_batch=2, fail=True)
+
+    futures = queue_behind_blocker(batcher, [("a",), ("b",)])
+
+    for future in futures:
+        with pytest.raises(RuntimeError):
+            future.result(timeout=5)
+    assert batcher.failed == [["blocker"], ["a", "b"]]
+    # failed batches are not counted
+    assert batcher.stats()["batches"] == 0
+
+
+def test_stats_before_any_batch():
+    stats = Collector(max_batch=2).stats()
+
+    assert stats["items"] == 0 and stats["queue_wait_ms_p50"] is None
+    assert stats["items_per_second"] is None
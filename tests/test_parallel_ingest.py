@@ -0,0 +1,45 @@
+import json
+
+import numpy as np
+
+import utils
+from nlp import parallel_ingest
+from utils import EMBEDDING_DIM
+
+
+def write_pois(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            poi = {
+                "mbx_id": f"poi{i}",
+                "name": f"Place {i}",
+                "description": "A place" + " to eat" * (i % 5),
+                "category": "food",
+                "city": "Duvall, WA",
+            }
+            f.write(json.dumps(poi) + "\n")
+
+
+def test_parallel_batches_are_embedded(tmp_path, monkeypatch, fake_encoder):
+    # fork the worker processes, so they inherit the fake encoder and the disabled cache; no model is ever
+    # loaded here, so no lock can be held while forking
+    monkeypatch.setattr(parallel_ingest, "START_METHOD", "fork")
+    monkeypatch.setattr(parallel_ingest, "_init_worker", lambda threads: None)
+    monkeypatch.setattr(parallel_ingest, "CHUNK_BYTES", 256)
+    filepath = str(tmp_path / "pois.json")
+    write_pois(filepath, 12)
+
+    batches = list(
+        parallel_ingest.iter_parallel_embedded_batches(
+            filepath, batch_size=5, duplication=2, workers=2
+        )
+    )
+
+    assert [len(batch) for batch in batches] == [5, 5, 5, 5, 4]
+    for batch in batches:
+        assert batch.embedding is not None
+        assert batch.embedding.shape == (len(batch), EMBEDDING_DIM)
+    ids = [mbx_id for batch in batches for mbx_id in batch["mbx_id"].to_list()]
+    assert ids == [f"poi{i}" for i in range(12) for _ in range(2)]
+    expected = fake_encoder.encode(utils.encoding_contexts(batches[0]))
+    assert np.allclose(batches[0].embedding, expected)
@@ -0,0 +1,115 @@
+import json
+import math
+
+import numpy as np
+import pytest
+
+from nlp.poi_formats import POI_FIELDS
+from nlp.poi_formats import PoiBatch
+from nlp.poi_formats import PoiBatchBuilder
+from nlp.poi_formats import StringColumn
+from nlp.poi_formats import get_format
+from nlp.poi_formats import iter_poi_batches
+from nlp.poi_formats import resolve_format
+
+
+def mapbox_feature(i):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [-77.06 + i / 100, 38.9]},
+        "properties": {
+            "mapbox:id": f"dc{i}",
+            "name": f"Café {i}",
+            "addr:full": f"{i} M St NW",
+            "mapbox:search:categories": "coffee;cafe",
+        },
+    }
+
+
+def simple_record(i):
+    return {
+        "mbx_id": f"poi{i}",
+        "name": f"Place {i}",
+        "description": "A place",
+        "category": "food",
+    }
+
+
+def write_lines(path, records):
+    with open(path, "w") as f:
+        for record in records:
+            f.write(json.dumps(record) + "\n")
+
+
+def test_string_column_round_trips():
+    values = ["", "abc", "Café ☕", "x"]
+    column = StringColumn.from_list(values)
+
+    assert len(column) == 4
+    assert column.to_list() == values
+    assert column.take(np.array([3, 0, 2])).to_list() == ["x", "", "Café ☕"]
+    joined = StringColumn.concat([column, StringColumn.from_list(["y", "zz"])])
+    assert joined.to_list() == values + ["y", "zz"]
+
+
+def test_mapbox_and_simple_formats_are_detected(tmp_path):
+    mapbox = str(tmp_path / "dc.json")
+    simple = str(tmp_path / "duvall.json")
+    write_lines(mapbox, [mapbox_feature(i) for i in range(3)])
+    write_lines(simple, [simple_record(i) for i in range(3)])
+
+    assert resolve_format(mapbox).name == "mapbox"
+    assert resolve_format(simple).name == "simple"
+    assert resolve_format(simple, "mapbox").name == "mapbox"
+    with pytest.raises(ValueError):
+        get_format("csv")
+
+
+def test_mapbox_lines_are_parsed_into_every_field():
+    values = get_format("mapbox").parse_line(json.dumps(mapbox_feature(1)))
+    poi = dict(zip(POI_FIELDS, values))
+
+    assert poi["mbx_id"] == "dc1"
+    assert poi["latitude"] == 38.9
+    assert poi["longitude"] == pytest.approx(-77.05)
+    assert poi["category"] == "coffee and cafe"
+    assert poi["categories"] == "coffee;cafe"
+    assert poi["addr_full"] == "1 M St NW"
+
+
+def test_simple_records_have_no_coordinates():
+    values = get_format("simple").parse_line(json.dumps(simple_record(0)))
+    poi = dict(zip(POI_FIELDS, values))
+
+    assert math.isnan(poi["latitude"]) and math.isnan(poi["longitude"])
+    assert poi["categories"] == "food"
+
+
+def test_batches_follow_the_file_and_duplicate_lines(tmp_path):
+    path = str(tmp_path / "duvall.json")
+    write_lines(path, [simple_record(i) for i in range(5)])
+
+    batches = list(iter_poi_batches(path, batch_size=4, duplication=2))
+
+    assert [len(batch) for batch in batches] == [4, 4, 2]
+    ids = [mbx_id for batch in batches for mbx_id in batch["mbx_id"].to_list()]
+    assert ids == [f"poi{i}" for i in range(5) for _ in range(2)]
+    assert batches[0]["latitude"].dtype == np.float64
+
+
+def test_batches_keep_embeddings_through_take_and_concat():
+    builder = PoiBatchBuilder()
+    for i in range(4):
+        builder.append(get_format("simple").parse_line(json.dumps(simple_record(i))))
+    batch = builder.build()
+    batch.embedding = np.arange(8, dtype=np.float32).reshape(4, 2)
+
+    taken = batch.take([2, 0])
+    assert taken["mbx_id"].to_list() == ["poi2", "poi0"]
+    assert taken.embedding.tolist() == [[4, 5], [0, 1]]
+    joined = PoiBatch.concat([batch.slice(0, 1), taken])
+    assert joined["mbx_id"].to_list() == ["poi0", "poi2", "poi0"]
+    assert joined.embedding.shape == (3, 2)
+    # a batch without embeddings makes the concatenation unembedded rather than misaligned
+    assert PoiBatch.concat([batch, builder.build()]).embedding is None
+    assert len(PoiBatch.concat([])) == 0
@@ -0,0 +1,84 @@
+import numpy as np
+import pytest
+
+from nlp.quantization import QUANTIZERS
+from nlp.quantization import exact_search
+from nlp.quantization import get_quantizer
+from nlp.quantization import quantized_search
+from nlp.quantization import recall_at_k
+from nlp.quantization import top_k
+
+
+def clustered_vectors(n=2000, dim=32, clusters=20, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.normal(size=(clusters, dim))
+    return (
+        centers[rng.integers(clusters, size=n)] + 0.3 * rng.normal(size=(n, dim))
+    ).astype(np.float32)
+
+
+def test_top_k_returns_the_smallest_distances_sorted():
+    distances = np.array([[5.0, 1.0, 3.0, 0.5], [2.0, 2.5, 0.1, 9.0]])
+
+    rows, values = top_k(distances, 2)
+
+    assert rows.tolist() == [[3, 1], [2, 0]]
+    assert values.tolist() == [[0.5, 1.0], [0.1, 2.0]]
+    assert top_k(distances, 10)[0].shape == (2, 4)
+
+
+def test_recall_at_k_counts_shared_ids():
+    assert recall_at_k([[1, 2, 3], [4, 5, 6]], [[3, 2, 1], [4, 7, 8]]) == pytest.approx(
+        (1 + 1 / 3) / 2
+    )
+
+
+@pytest.mark.parametrize("name", sorted(QUANTIZERS))
+def test_rescored_quantized_search_keeps_recall(name):
+    vectors = clustered_vectors()
+    queries = vectors[:50] + 0.05
+    quantizer = get_quantizer(name).fit(vectors)
+    codes = quantizer.encode(vectors)
+
+    expected, _ = exact_search(vectors, queries, 10)
+    rows, distances = quantized_search(
+        quantizer, codes, vectors, queries, 10, oversample=8
+    )
+
+    assert recall_at_k(rows, expected) >= 0.9
+    # rescored distances are exact squared L2 distances, sorted
+    exact = ((vectors[rows[0]] - queries[0]) ** 2).sum(axis=1)
+    assert np.allclose(distances[0], exact, rtol=1e-4, atol=1e-4)
+    assert np.all(np.diff(distances[0]) >= 0)
+
+
+def test_quantized_codes_are_smaller():
+    vectors = clustered_vectors()
+
+    sizes = {
+        name: get_quantizer(name).fit(vectors).encode(vectors).nbytes
+        for name in QUANTIZERS
+    }
+
+    assert sizes["float16"] == vectors.nbytes // 2
+    assert sizes["int8"] == vectors.nbytes // 4
+    assert sizes["binary"] == vectors.nbytes // 32
+
+
+@pytest.mark.parametrize("name", sorted(QUANTIZERS))
+def test_quantizer_state_round_trips(name):
+    vectors = clustered_vectors(n=200)
+    fitted = get_quantizer(name).fit(vectors)
+
+    loaded = get_quantizer(name).load_state(fitted.state())
+
+    codes = fitted.encode(vectors)
+    assert np.array_equal(loaded.encode(vectors), codes)
+    assert np.allclose(
+        loaded.distances(codes, vectors[:3]), fitted.distances(codes, vectors[:3])
+    )
+
+
+def test_unknown_quantization_is_rejected():
+    with pytest.raises(ValueError):
+        get_quantizer("pq")
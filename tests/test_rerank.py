@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+import pytest
+
+from nlp import rerank
+from nlp.local_index import LocalHit
+from nlp.rerank import Reranker
+from nlp.rerank import hit_context
+from nlp.rerank import mmr
+
+
+class FakeCrossEncoder:
+    """
+    Scores a (query, context) pair by how many query words the context contains, optionally after waiting
+    for an event
+    """
+
+    def __init__(self, release=None):
+        self.release = release
+
+    def predict(self, pairs, batch_size=32):
+        if self.release is not None:
+            self.release.wait()
+        return [
+            sum(word in context.lower() for word in query.split())
+            for query, context in pairs
+        ]
+
+
+def candidates(names, categories="cafe"):
+    hits = [LocalHit(f"poi{i}", float(i), {}) for i in range(len(names))]
+    documents = [{"name": name, "category": categories} for name in names]
+    return hits, documents
+
+
+def test_hit_context():
+    assert hit_context({"name": "Tavern", "category": "bar;pub"}) == "Tavern (bar, pub)"
+    assert hit_context({"name": "Tavern", "category": ""}) == "Tavern"
+    assert hit_context(None) == ""
+
+
+def test_mmr_skips_near_duplicates():
+    relevance = np.array([1.0, 0.95, 0.5])
+    # the second candidate is a copy of the first
+    embeddings = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]])
+
+    assert mmr(relevance, embeddings, 2, diversity_lambda=1.0) == [0, 1]
+    assert mmr(relevance, embeddings, 2, diversity_lambda=0.5) == [0, 2]
+    assert mmr(relevance, embeddings, 5, diversity_lambda=0.5) == [0, 2, 1]
+
+
+def test_rerank_orders_by_cross_encoder_score(monkeypatch):
+    monkeypatch.setattr(rerank, "_cross_encoder", FakeCrossEncoder())
+    hits, documents = candidates(["Pizza Place", "Coffee House", "Coffee Bar"])
+    reranker = Reranker(mmr_lambda=1.0)
+
+    reranked, done = reranker.rerank("coffee bar", hits, documents, top_k=2)
+
+    assert done
+    assert [hit.id for hit in reranked] == ["poi2", "poi1"]
+    assert reranker.stats == {"reranked": 1, "fallbacks": 0}
+
+
+def test_rerank_diversifies_with_stored_embeddings(monkeypatch):
+    monkeypatch.setattr(rerank, "_cross_encoder", FakeCrossEncoder())
+    hits, documents = candidates(["Coffee Bar", "Coffee Bar 2", "Coffee"])
+    embeddings = np.array([[1.0, 0.0], [1.0, 0.0], [0.0, 1.0]], dtype=np.float32)
+
+    reranked, done = Reranker(mmr_lambda=0.4).rerank(
+        "coffee bar", hits, documents, top_k=2, embeddings=lambda: embeddings
+    )
+
+    assert done
+    assert [hit.id for hit in reranked] == ["poi0", "poi2"]
+
+
+def test_rerank_keeps_the_vector_order_past_its_budget(monkeypatch):
+    release = threading.Event()
+    monkeypatch.setattr(rerank, "_cross_encoder", FakeCrossEncoder(release))
+    hits, documents = candidates(["Pizza Place", "Coffee House", "Coffee Bar"])
+    reranker = Reranker(mmr_lambda=1.0)
+
+    try:
+        reranked, done = reranker.rerank(
+            "coffee bar", hits, documents, top_k=2, budget_ms=20
+        )
+    finally:
+        release.set()
+
+    assert not done
+    assert [hit.id for hit in reranked] == ["poi0", "poi1"]
+    assert reranker.stats == {"reranked": 0, "fallbacks": 1}
+
+
+@pytest.mark.parametrize("n", [0, 1])
+def test_nothing_to_rerank(n):
+    hits, documents = candidates(["Coffee"] * n)
+
+    assert Reranker().rerank("coffee", hits, documents, top_k=5) == (hits, True)
@@ -0,0 +1,78 @@
+import json
+
+import numpy as np
+import pytest
+
+from nlp import snapshot
+from nlp.categories import CategoryFilter
+from nlp.snapshot import PoiSnapshot
+from nlp.snapshot import build_snapshot
+from nlp.snapshot import has_snapshot
+
+
+def write_pois(path, n):
+    with open(path, "w") as f:
+        for i in range(n):
+            poi = {
+                "mbx_id": f"poi{i}",
+                "name": f"Place {i}",
+                "description": f"Serves dish number {i}",
+                "category": "coffee" if i % 2 else "bar",
+            }
+            f.write(json.dumps(poi) + "\n")
+
+
+@pytest.fixture
+def snapshot_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(snapshot, "SNAPSHOT_DIR", str(tmp_path / "snapshots"))
+    return tmp_path / "snapshots"
+
+
+def test_snapshot_serves_what_was_ingested(tmp_path, snapshot_dir, fake_encoder):
+    filepath = str(tmp_path / "pois.json")
+    write_pois(filepath, 10)
+
+    directory = build_snapshot("town", filepath, batch_size=4, quantizations=["int8"])
+    opened = PoiSnapshot(directory)
+
+    assert opened.num_entities == 10
+    assert opened.row_of("poi7") == 7
+    assert opened.row_of("missing") is None
+    query = np.array(opened.batch.embedding[3:4])
+    # the embedding of a POI is its nearest neighbour
+    hits = opened.search(query, "embedding", {}, limit=3)[0]
+    assert hits[0].id == "poi3"
+    assert hits[0].distance == pytest.approx(0.0, abs=1e-3)
+    coffee = opened.search(
+        query, "embedding", {}, limit=10, categories=CategoryFilter(include=["coffee"])
+    )[0]
+    assert sorted(hit.id for hit in coffee) == [f"poi{i}" for i in (1, 3, 5, 7, 9)]
+    # int8 codes only shortlist the candidates, which are rescored at full precision
+    quantized = PoiSnapshot(directory, quantization="int8")
+    rescored = quantized.search(query, "embedding", {}, limit=3)[0]
+    assert [hit.id for hit in rescored] == [hit.id for hit in hits]
+
+
+def test_snapshot_of_a_rewritten_data_file_is_stale(
+    tmp_path, snapshot_dir, fake_encoder
+):
+    filepath = str(tmp_path / "pois.json")
+    write_pois(filepath, 4)
+    build_snapshot("town", filepath)
+
+    assert has_snapshot("town", filepath)
+    assert has_snapshot("town")
+    assert not has_snapshot("elsewhere", filepath)
+    write_pois(filepath, 5)
+    assert not has_snapshot("town", filepath)
+
+
+def test_snapshot_of_another_layout_version_is_ignored(
+    tmp_path, snapshot_dir, fake_encoder, monkeypatch
+):
+    filepath = str(tmp_path / "pois.json")
+    write_pois(filepath, 4)
+    build_snapshot("town", filepath)
+
+    monkeypatch.setattr(snapshot, "SNAPSHOT_VERSION", snapshot.SNAPSHOT_VERSION + 1)
+    assert not has_snapshot("town", filepath)
@@ -0,0 +1,133 @@
+import json
+
+import pytest
+
+import utils
+from nlp import doc_store
+from nlp import vector_db
+from nlp.categories import CategoryBuilder
+from nlp.categories import CategoryFilter
+from nlp.doc_store import DocStoreWriter
+from nlp.doc_store import doc_store_path
+from nlp.lexical import RRF_K
+from nlp.local_index import LocalCollection
+from nlp.poi_formats import PoiBatch
+from nlp.vector_db import VectorDB
+from nlp.vector_db import category_index_of
+from nlp.vector_db import mark_reindexed
+
+NAMES = ["Grateful Bread", "Duvall Tavern", "Rocky's Pizza", "Valley Coffee", "Tacos"]
+
+
+def write_pois(path):
+    with open(path, "w") as f:
+        for i, name in enumerate(NAMES * 4):
+            poi = {
+                "mbx_id": f"poi{i}",
+                "name": name if i < len(NAMES) else f"{name} {i}",
+                "description": f"Place number {i}",
+                "category": "coffee" if i % 2 else "bar",
+            }
+            f.write(json.dumps(poi) + "\n")
+
+
+@pytest.fixture
+def town(tmp_path, fake_encoder, monkeypatch):
+    """
+    A VectorDB searching the location "Town" in a LocalCollection
+    """
+    filepath = str(tmp_path / "town.json")
+    write_pois(filepath)
+    batch = PoiBatch.concat(list(utils.iter_embedded_batches(filepath)))
+    collection = LocalCollection("town", batch)
+    monkeypatch.setitem(
+        vector_db.LOCATIONS,
+        "Town",
+        {"name": "town", "filepath": filepath, "description": "Town", "fmt": None},
+    )
+    db = VectorDB()
+    db._collection = lambda location: collection
+    return db
+
+
+def test_results_are_cached_until_the_collection_is_reindexed(town):
+    first = town.search("Town", "bread", hybrid=False)
+    assert town.search("Town", "  Bread ", hybrid=False) is first
+    assert town.results.hits == 1
+
+    mark_reindexed("town")
+
+    again = town.search("Town", "bread", hybrid=False)
+    assert again is not first
+    assert [hit.id for hit in again[0]] == [hit.id for hit in first[0]]
+    assert town.results.hits == 1
+
+
+@pytest.mark.parametrize("hybrid", [False, True])
+def test_search_many_ranks_like_search(town, hybrid):
+    queries = ["grateful bread", "pizza", "tacos"]
+
+    many = town.search_many("Town", queries, top_k=3, hybrid=hybrid)
+
+    for query, hits in zip(queries, many):
+        town.results.clear()
+        expected = town.search("Town", query, top_k=3, hybrid=hybrid)[0]
+        assert [hit.id for hit in hits] == [hit.id for hit in expected]
+
+
+def test_hybrid_hits_carry_their_fused_score(town):
+    hits = town.search("Town", "Grateful Bread", top_k=5, hybrid=True)[0]
+
+    assert "poi0" in [hit.id for hit in hits]
+    distances = [hit.distance for hit in hits]
+    assert distances == sorted(distances)
+    # minus a sum of 1 / (RRF_K + rank) over the vector and the lexical ranking
+    assert all(-2 / (RRF_K + 1) <= distance < 0 for distance in distances)
+
+
+def test_category_filtered_search(town):
+    hits = town.search(
+        "Town",
+        "place",
+        top_k=20,
+        hybrid=True,
+        categories=CategoryFilter(include=["coffee"]),
+    )[0]
+
+    assert hits and all(int(hit.id[3:]) % 2 for hit in hits)
+
+
+class Partition:
+    """
+    The name of a Milvus partition, all category_index_of looks at
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+
+def test_category_index_is_loaded_with_the_doc_store(tmp_path, monkeypatch):
+    monkeypatch.setattr(doc_store, "DOC_STORE_DIR", str(tmp_path))
+    monkeypatch.setattr(vector_db, "DOC_STORES", {})
+    monkeypatch.setattr(vector_db, "CATEGORY_INDEXES", {})
+    filepath = str(tmp_path / "town.json")
+    write_pois(filepath)
+
+    with pytest.raises(ValueError):
+        category_index_of(Partition("town"))
+
+    writer = DocStoreWriter(doc_store_path("town"))
+    categories = CategoryBuilder()
+    for batch in utils.iter_batches(filepath):
+        writer.add(batch)
+        categories.add(batch)
+    writer.finish()
+    categories.build().save(doc_store_path("town"))
+    vector_db.DOC_STORES.clear()
+
+    index = category_index_of(Partition("town"))
+    assert index.counts() == {"bar": 10, "coffee": 10}
+    assert index.milvus_expr(CategoryFilter(include=["coffee"]), max_ids=10) == (
+        "mbx_id in " + json.dumps([f"poi{i}" for i in range(1, 20, 2)])
+    )
+    assert index.milvus_expr(CategoryFilter(include=["coffee"]), max_ids=9) is None